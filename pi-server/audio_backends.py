@@ -0,0 +1,340 @@
+"""
+Audio I/O backends for AudioStreamHandler (microphone) and MicStreamHandler
+(speaker).
+
+PortAudioBackend drives real devices through PyAudio. WavReplayBackend and
+NullSinkBackend stand in for them on machines without a sound card and keep
+device timing: replay reads block until a chunk's worth of audio would have
+been captured and overflow when the reader falls behind, and the null sink
+calls its stream callback from its own thread once per buffer period, the
+way PortAudio does.
+"""
+import collections
+import logging
+import threading
+import time
+import wave
+
+logger = logging.getLogger(__name__)
+
+# PortAudio callback return flag and status bit, with pyaudio's values
+CONTINUE = 0
+OUTPUT_UNDERFLOW = 4
+
+
+class PortAudioInput:
+    def __init__(self, stream, overflow_errno):
+        self.stream = stream
+        self.overflow_errno = overflow_errno
+
+    def read(self, frames):
+        """Read `frames` frames, returning the data and whether the device overflowed."""
+        try:
+            return self.stream.read(frames, exception_on_overflow=True), False
+        except IOError as e:
+            if e.errno != self.overflow_errno:
+                raise
+            return self.stream.read(frames, exception_on_overflow=False), True
+
+    def stop_stream(self):
+        self.stream.stop_stream()
+
+    def close(self):
+        self.stream.close()
+
+
+# Pa_Initialize and Pa_Terminate aren't thread-safe, and the microphone and
+# speaker handlers start their backends concurrently, so every backend shares
+# one PyAudio instance, created by the first to start and terminated by the last
+_portaudio_lock = threading.Lock()
+_portaudio = None
+_portaudio_users = 0
+
+
+def log_devices(p):
+    """Log every device PortAudio found; only worth the time when debugging."""
+    info = p.get_host_api_info_by_index(0)
+    for i in range(info.get('deviceCount')):
+        device_info = p.get_device_info_by_host_api_device_index(0, i)
+        logger.debug(
+            f"Audio Device {i}: {device_info.get('name')} "
+            f"({device_info.get('maxInputChannels')} in, {device_info.get('maxOutputChannels')} out)"
+        )
+
+
+class PortAudioBackend:
+    """Real sound card input and output through PyAudio."""
+
+    def __init__(self):
+        self.p = None
+
+    def start(self):
+        global _portaudio, _portaudio_users
+        # Imported here so the server runs on machines without PortAudio
+        import pyaudio
+        self.pyaudio = pyaudio
+
+        with _portaudio_lock:
+            if _portaudio is None:
+                logger.info("Initializing PyAudio...")
+                _portaudio = pyaudio.PyAudio()
+                if logger.isEnabledFor(logging.DEBUG):
+                    log_devices(_portaudio)
+            _portaudio_users += 1
+            self.p = _portaudio
+
+    def open_input(self, rate, channels, chunk_size, sample_width=2):
+        stream = self.p.open(
+            format=self.p.get_format_from_width(sample_width),
+            channels=channels,
+            rate=rate,
+            input=True,
+            frames_per_buffer=chunk_size
+        )
+        return PortAudioInput(stream, self.pyaudio.paInputOverflowed)
+
+    def open_output(self, rate, channels, chunk_size, callback, sample_width=2):
+        stream = self.p.open(
+            format=self.p.get_format_from_width(sample_width),
+            channels=channels,
+            rate=rate,
+            output=True,
+            frames_per_buffer=chunk_size,
+            stream_callback=callback
+        )
+        stream.start_stream()
+        return stream
+
+    def terminate(self):
+        global _portaudio, _portaudio_users
+        with _portaudio_lock:
+            if not self.p:
+                return
+            self.p = None
+            _portaudio_users -= 1
+            if _portaudio_users == 0:
+                _portaudio.terminate()
+                _portaudio = None
+                logger.info("PyAudio instance terminated")
+
+
+class ReplayInput:
+    """
+    Input stream that loops prerecorded audio against a simulated device
+    clock. Like a capture device it buffers at most `buffer_frames`; audio
+    older than that is lost and reported as an overflow.
+    """
+
+    def __init__(self, audio, rate, channels, buffer_frames, sample_width=2):
+        self.audio = audio
+        self.rate = rate
+        self.frame_bytes = channels * sample_width
+        self.buffer_frames = buffer_frames
+        self.started = time.monotonic()
+        self.position = 0  # Device frames consumed or lost since the stream opened
+
+    def read(self, frames):
+        overflowed = False
+        available = int((time.monotonic() - self.started) * self.rate) - self.position
+        if available > self.buffer_frames:
+            self.position += available - self.buffer_frames
+            overflowed = True
+        elif available < frames:
+            time.sleep((frames - available) / self.rate)
+
+        total = len(self.audio)
+        start = (self.position * self.frame_bytes) % total
+        end = start + frames * self.frame_bytes
+        if end <= total:
+            data = self.audio[start:end]
+        else:
+            data = self.audio[start:] + self.audio[:end - total]
+        self.position += frames
+        return data, overflowed
+
+    def stop_stream(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class WavReplayBackend:
+    """Microphone replaced by a looping 16-bit WAV file, converted to the requested format."""
+
+    def __init__(self, path, buffer_chunks=4):
+        self.path = path
+        self.buffer_chunks = buffer_chunks
+
+    def start(self):
+        import numpy as np
+
+        with wave.open(self.path, "rb") as wav_file:
+            if wav_file.getsampwidth() != 2:
+                raise ValueError(f"{self.path} is not 16-bit PCM")
+            self.file_rate = wav_file.getframerate()
+            self.file_channels = wav_file.getnchannels()
+            raw = wav_file.readframes(wav_file.getnframes())
+        self.samples = np.frombuffer(raw, dtype="<i2").reshape(-1, self.file_channels)
+        logger.info(
+            f"Replaying {self.path} ({len(self.samples) / self.file_rate:.1f}s, "
+            f"{self.file_rate}Hz, {self.file_channels} channels) as the microphone"
+        )
+
+    def convert(self, rate, channels):
+        """Mix and resample the file once, so reads are plain slices."""
+        import numpy as np
+
+        data = self.samples.astype(np.float32)
+        if self.file_channels != channels:
+            data = np.repeat(data.mean(axis=1, keepdims=True), channels, axis=1)
+        if self.file_rate != rate:
+            positions = np.arange(int(len(data) * rate / self.file_rate)) * (self.file_rate / rate)
+            indices = np.arange(len(data))
+            data = np.stack([np.interp(positions, indices, data[:, c]) for c in range(channels)], axis=1)
+        return np.round(data).clip(-32768, 32767).astype("<i2").tobytes()
+
+    def open_input(self, rate, channels, chunk_size, sample_width=2):
+        if sample_width != 2:
+            raise ValueError("WAV replay only produces 16-bit audio")
+        return ReplayInput(self.convert(rate, channels), rate, channels, chunk_size * self.buffer_chunks)
+
+    def open_output(self, rate, channels, chunk_size, callback, sample_width=2):
+        raise NotImplementedError("WAV replay is an input-only backend")
+
+    def terminate(self):
+        pass
+
+
+class NullOutput:
+    """Output stream that plays into memory, calling back from its own thread once per buffer period."""
+
+    def __init__(self, sink, rate, channels, chunk_size, callback, sample_width):
+        self.sink = sink
+        self.chunk_size = chunk_size
+        self.callback = callback
+        self.period = chunk_size / rate
+        self.expected_bytes = chunk_size * channels * sample_width
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start_stream(self):
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, name="null-audio-sink", daemon=True)
+        self.thread.start()
+
+    def is_active(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def run(self):
+        next_due = time.monotonic()
+        while True:
+            delay = next_due - time.monotonic()
+            if self.stopping.wait(max(0, delay)):
+                break
+            now = time.monotonic()
+            status = 0
+            if now - next_due > self.period:
+                # A real device would have run dry by now; report it and resync
+                status = OUTPUT_UNDERFLOW
+                self.sink.late_callbacks += 1
+                next_due = now
+            time_info = {
+                "input_buffer_adc_time": 0.0,
+                "current_time": now,
+                "output_buffer_dac_time": next_due + self.period,
+            }
+            data, flag = self.callback(None, self.chunk_size, time_info, status)
+            self.sink.record(data)
+            if flag != CONTINUE or len(data) < self.expected_bytes:
+                # PortAudio ends the stream after a short buffer, so do the same
+                logger.warning(
+                    f"Null audio sink stopped: callback returned {len(data)} of {self.expected_bytes} bytes"
+                )
+                break
+            next_due += self.period
+
+    def stop_stream(self):
+        self.stopping.set()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def close(self):
+        self.stop_stream()
+        self.sink.stream_closed()
+
+
+class NullSinkBackend:
+    """
+    Speaker replaced by memory. Keeps the last `capture_seconds` of what
+    would have been played, and writes it to `capture_path` as a WAV file
+    whenever a stream closes.
+    """
+
+    def __init__(self, capture_path=None, capture_seconds=60):
+        self.capture_path = capture_path
+        self.capture_seconds = capture_seconds
+        self.lock = threading.Lock()
+        self.played = collections.deque()
+        self.played_bytes = 0
+        self.callbacks = 0
+        self.late_callbacks = 0
+        self.format = None
+
+    def start(self):
+        logger.info("Using the null audio sink for speaker output")
+
+    def open_input(self, rate, channels, chunk_size, sample_width=2):
+        raise NotImplementedError("The null sink is an output-only backend")
+
+    def open_output(self, rate, channels, chunk_size, callback, sample_width=2):
+        self.format = (rate, channels, sample_width)
+        self.limit = int(self.capture_seconds * rate) * channels * sample_width
+        stream = NullOutput(self, rate, channels, chunk_size, callback, sample_width)
+        stream.start_stream()
+        return stream
+
+    def record(self, data):
+        with self.lock:
+            self.callbacks += 1
+            self.played.append(data)
+            self.played_bytes += len(data)
+            while self.played_bytes > self.limit and len(self.played) > 1:
+                self.played_bytes -= len(self.played.popleft())
+
+    def captured(self):
+        """Everything still held of what would have been played."""
+        with self.lock:
+            return b"".join(self.played)
+
+    def stream_closed(self):
+        if not self.capture_path or not self.format:
+            return
+        rate, channels, sample_width = self.format
+        with wave.open(self.capture_path, "wb") as wav_file:
+            wav_file.setnchannels(channels)
+            wav_file.setsampwidth(sample_width)
+            wav_file.setframerate(rate)
+            wav_file.writeframes(self.captured())
+        logger.info(f"Wrote {self.callbacks} played buffers ({self.late_callbacks} late) to {self.capture_path}")
+
+    def terminate(self):
+        pass
+
+
+def create_audio_input(spec):
+    """Microphone backend from a command-line spec: `portaudio` or `replay:<wav>`."""
+    if spec == "portaudio":
+        return PortAudioBackend()
+    if spec.startswith("replay:"):
+        return WavReplayBackend(spec.split(":", 1)[1])
+    raise ValueError(f"Unknown audio input: {spec}")
+
+
+def create_audio_output(spec):
+    """Speaker backend from a command-line spec: `portaudio`, `null` or `null:<wav to capture into>`."""
+    if spec == "portaudio":
+        return PortAudioBackend()
+    if spec == "null" or spec.startswith("null:"):
+        return NullSinkBackend(spec.partition(":")[2] or None)
+    raise ValueError(f"Unknown audio output: {spec}")
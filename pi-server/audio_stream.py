@@ -1,103 +1,140 @@
 # pi-server/audio_stream.py
 import asyncio
-import numpy as np
-from websockets.server import serve
 import logging
-import pyaudio
 import time
+import metrics
+from audio_backends import PortAudioBackend
+from profiling import TRACER
 
 logger = logging.getLogger(__name__)
 
+# About 0.4 s of audio per listener at 1024-frame, 44.1 kHz chunks
+CLIENT_QUEUE_CHUNKS = 16
+
 class AudioStreamHandler:
-    def __init__(self):
+    def __init__(self, backend=None):
         self.clients = set()
         self.sample_rate = 44100
         self.channels = 1
         self.chunk_size = 1024
-        self.format = pyaudio.paInt16
         
-        logger.info("Initializing PyAudio for microphone capture...")
-        self.p = pyaudio.PyAudio()
+        # Any audio backend works; WAV replay needs no sound card
+        self.backend = backend or PortAudioBackend()
         self.stream = None
-        
-        # Log available audio devices
-        info = self.p.get_host_api_info_by_index(0)
-        numdevices = info.get('deviceCount')
-        for i in range(0, numdevices):
-            device_info = self.p.get_device_info_by_host_api_device_index(0, i)
-            logger.info(f"Audio Device {i}: {device_info.get('name')}")
-            if device_info.get('maxInputChannels') > 0:
-                logger.info(f"  Input Device {i}: {device_info.get('name')}")
+        # One capture loop feeds every listener, whatever its transport
+        self.sinks = set()
+        self.capture_task = None
+        self.chunks_dropped = metrics.AUDIO_CHUNKS_DROPPED.labels()
+        self.overruns = metrics.AUDIO_OVERRUNS.labels()
+        metrics.CONNECTED_CLIENTS.labels("audio").set_function(lambda: len(self.clients))
+
+    def start(self):
+        """Initialise the audio backend for microphone capture. Blocks."""
+        self.backend.start()
 
     def start_audio(self):
         try:
-            self.stream = self.p.open(
-                format=self.format,
-                channels=self.channels,
-                rate=self.sample_rate,
-                input=True,
-                frames_per_buffer=self.chunk_size
-            )
-            logger.info(f"Started audio input stream: rate={self.sample_rate}Hz, channels={self.channels}, format={self.format}")
+            self.stream = self.backend.open_input(self.sample_rate, self.channels, self.chunk_size)
+            logger.info(f"Started audio input stream: rate={self.sample_rate}Hz, channels={self.channels}, 16-bit")
         except Exception as e:
             logger.error(f"Failed to start audio input stream: {e}")
             raise
 
-    async def handle_client(self, websocket):
+    def read_chunk(self):
+        """Read one chunk from the microphone, counting overflows. Blocks."""
+        data, overflowed = self.stream.read(self.chunk_size)
+        if overflowed:
+            self.overruns.inc()
+        return data
+
+    def add_sink(self, sink):
+        """
+        Call `sink(chunk)` on the event loop with every chunk captured from
+        now on, starting capture if nobody was listening. `sink(None)` means
+        capture stopped on an error.
+        """
+        self.sinks.add(sink)
+        if self.capture_task is None:
+            self.capture_task = asyncio.create_task(self.capture())
+
+    def remove_sink(self, sink):
+        self.sinks.discard(sink)
+
+    async def capture(self):
+        """Read the microphone once for every listener and transport while anyone is listening."""
+        try:
+            if not self.stream:
+                self.start_audio()
+            while self.sinks:
+                # The blocking read paces this loop at the device rate
+                data = await asyncio.to_thread(self.read_chunk)
+                for sink in list(self.sinks):
+                    sink(data)
+        except Exception as e:
+            logger.error(f"Audio capture error: {e}")
+            for sink in list(self.sinks):
+                sink(None)
+            self.sinks.clear()
+        finally:
+            self.capture_task = None
+            self.stop_audio()
+
+    def stop_audio(self):
+        if self.stream:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.stream = None
+            logger.info("Audio input stream stopped - no more clients")
+
+    async def handle_client(self, websocket, stream="audio"):
+        """
+        Send the sample rate and then every captured chunk. `websocket` may
+        be anything with `accept` and `send_bytes`, e.g. a framed TCP
+        connection, with `stream` naming it in the metrics.
+        """
         client_id = id(websocket)
+        send_timer = metrics.SEND_SECONDS.labels(stream)
+        bytes_sent = metrics.BYTES_SENT.labels(stream)
+        client_bytes_sent = metrics.CLIENT_BYTES_SENT.labels(stream, client_id)
+        queue = asyncio.Queue(maxsize=CLIENT_QUEUE_CHUNKS)
+
+        def offer(data):
+            # A listener that falls behind loses its oldest chunks rather than drifting further behind
+            if queue.full():
+                queue.get_nowait()
+                self.chunks_dropped.inc()
+            queue.put_nowait(data)
+
         try:
+            await websocket.accept()
             self.clients.add(websocket)
             logger.info(f"New audio client connected [ID: {client_id}]. Total clients: {len(self.clients)}")
-            
-            if not self.stream:
-                self.start_audio()
-            
+
             # Send sample rate to client first
-            await websocket.send(str(self.sample_rate).encode())
+            await websocket.send_bytes(str(self.sample_rate).encode())
             logger.info(f"Sent sample rate {self.sample_rate}Hz to client [ID: {client_id}]")
-            
-            start_time = time.time()
-            frames_sent = 0
-            
-            while True:
-                try:
-                    data = self.stream.read(self.chunk_size, exception_on_overflow=False)
-                    audio_data = np.frombuffer(data, dtype=np.int16)
-                    await websocket.send(audio_data.tobytes())
-                    
-                    frames_sent += 1
-                    if frames_sent % 100 == 0:  # Log every 100 frames
-                        elapsed = time.time() - start_time
-                        rate = frames_sent / elapsed
-                        logger.debug(f"Streaming to client [ID: {client_id}] at {rate:.2f} fps")
-                        
-                except Exception as e:
-                    logger.error(f"Error streaming to client [ID: {client_id}]: {e}")
-                    break
-                    
-                await asyncio.sleep(self.chunk_size / self.sample_rate)
-                
+            self.add_sink(offer)
+
+            while (data := await queue.get()) is not None:
+                send_start = time.perf_counter()
+                await websocket.send_bytes(data)
+                send_end = time.perf_counter()
+                send_timer.observe(send_end - send_start)
+                if TRACER.enabled:
+                    TRACER.record(f"send {stream}", send_start, send_end)
+                bytes_sent.inc(len(data))
+                client_bytes_sent.inc(len(data))
         except Exception as e:
             logger.error(f"Audio client error [ID: {client_id}]: {e}")
         finally:
-            self.clients.remove(websocket)
+            self.remove_sink(offer)
+            self.clients.discard(websocket)
+            metrics.CLIENT_BYTES_SENT.remove(stream, client_id)
             logger.info(f"Audio client disconnected [ID: {client_id}]. Remaining clients: {len(self.clients)}")
-            if not self.clients and self.stream:
-                self.stream.stop_stream()
-                self.stream.close()
-                self.stream = None
-                logger.info("Audio input stream stopped - no more clients")
-
-    async def start_server(self):
-        async with serve(self.handle_client, "0.0.0.0", 5002):
-            logger.info("Audio server started on ws://0.0.0.0:5002")
-            await asyncio.Future()
 
     def cleanup(self):
         if self.stream:
             self.stream.stop_stream()
             self.stream.close()
             logger.info("Audio input stream closed")
-        if hasattr(self, 'p'):
-            self.p.terminate()
-            logger.info("PyAudio instance terminated")
\ No newline at end of file
+        self.backend.terminate()
\ No newline at end of file
@@ -0,0 +1,683 @@
+"""
+Load generator and benchmark for the streaming server.
+
+Opens concurrent WebSocket clients against the video (5001), audio (5002) and
+microphone (5003) streams, including deliberately slow readers, while
+hammering `/recordings` and periodically calling `/save-video`. Reports
+achieved fps, end-to-end frame latency, HTTP latency, dropped frames and
+the server's CPU, RSS and context switches as JSON.
+
+    # Benchmark a server this script starts itself
+    python benchmark.py --spawn --output run.json
+    # Same pipeline without a camera or sound card, from deterministic sources
+    python benchmark.py --spawn --simulated-devices
+    # Benchmark a running server, sampling its process if it is local
+    python benchmark.py --host 192.168.10.59 --pid 1234 --output run.json
+    # Fail (exit 1) if a run regressed against a stored baseline
+    python benchmark.py --spawn --baseline baseline.json --tolerance 0.15
+    # Side-by-side comparison of two result files
+    python benchmark.py --compare before.json after.json
+    # Viewers per relay core: many viewers through a relay.py in front of the server
+    python benchmark.py --spawn --simulated-devices --relay --video-clients 200 --audio-clients 20
+    # CPU and latency per transport: compare the result files of one run for each
+    python benchmark.py --spawn --simulated-devices --output ws.json
+    python benchmark.py --spawn --simulated-devices --video-transport tcp --audio-transport tcp --output tcp.json
+    python benchmark.py --spawn --simulated-devices --video-transport tcp --audio-transport rtp --output rtp.json
+    # Tile-mode bandwidth and encode cost for a static scene
+    python benchmark.py --spawn --simulated-devices --video-mode tiles --server-args --video-source replay:test_assets/test_frame.png
+
+End-to-end latency needs the server's capture timestamps, which `--spawn`
+enables with `--stamp-frames`; pass that flag yourself to a server you
+start separately, and keep both clocks in sync when not on one host.
+"""
+import argparse
+import asyncio
+import contextlib
+import glob
+import json
+import logging
+import os
+import re
+import struct
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+import wave
+
+from websockets import connect
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+FRAME_STAMP_PREFIX = b"\xff\xfe\x00\x0epits"
+# Ports spawned servers serve the non-WebSocket transports on
+TCP_VIDEO_PORT, TCP_AUDIO_PORT, RTP_AUDIO_PORT = 5006, 5007, 5008
+LENGTH_PREFIX = struct.Struct("!I")
+RTP_HEADER = struct.Struct("!BBHII")
+# Tile-mode messages start with the magic and flags, then the capture time
+TILE_MAGIC = b"TILE"
+TILE_STAMP = struct.Struct("<d")
+
+# Server audio counters sampled before and after the run
+AUDIO_COUNTERS = (
+    "pi_audio_input_overruns_total",
+    "pi_audio_output_underruns_total",
+    "pi_audio_playout_delay_seconds_sum",
+    "pi_audio_playout_delay_seconds_count",
+)
+
+# Metrics checked against a baseline, and whether higher values are better
+REGRESSION_CHECKS = {
+    "video.fps_per_client.mean": True,
+    "video.latency_ms.p95": False,
+    "video.frame_gap_ms.p95": False,
+    "video.dropped_frames": False,
+    "audio.chunks_per_second_per_client.mean": True,
+    "audio.input_overruns": False,
+    "mic.output_underruns": False,
+    "mic.playout_delay_ms_mean": False,
+    "http.recordings.requests_per_second": True,
+    "http.recordings.latency_ms.p95": False,
+    "process.cpu_percent": False,
+    "process.rss_bytes": False,
+    "startup.ready_seconds": False,
+    "relay.viewers_per_core": True,
+}
+
+
+def percentiles(samples, points=(50, 95, 99)):
+    if not samples:
+        return {f"p{p}": None for p in points}
+    ordered = sorted(samples)
+    return {
+        f"p{p}": ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+        for p in points
+    }
+
+
+def summary(values):
+    if not values:
+        return {"mean": None, "min": None, "max": None}
+    return {"mean": sum(values) / len(values), "min": min(values), "max": max(values)}
+
+
+def frame_timestamp(message):
+    """Capture time from a tile-mode header, or stamped into a JPEG comment segment, if present."""
+    if message[:4] == TILE_MAGIC:
+        return TILE_STAMP.unpack_from(message, 5)[0]
+    if message[2:10] == FRAME_STAMP_PREFIX:
+        return struct.unpack(">d", message[10:18])[0]
+    return None
+
+
+def process_counters(pid):
+    """Sum context switches over all threads of `pid` and read its CPU time and RSS."""
+    voluntary = involuntary = 0
+    for status_path in glob.glob(f"/proc/{pid}/task/*/status"):
+        try:
+            with open(status_path) as status:
+                for line in status:
+                    if line.startswith("voluntary_ctxt_switches"):
+                        voluntary += int(line.split()[1])
+                    elif line.startswith("nonvoluntary_ctxt_switches"):
+                        involuntary += int(line.split()[1])
+        except FileNotFoundError:
+            continue  # Thread exited while we were scanning
+    with open(f"/proc/{pid}/stat") as stat:
+        fields = stat.read().rsplit(")", 1)[1].split()
+    ticks = os.sysconf("SC_CLK_TCK")
+    return {
+        "voluntary_ctxt_switches": voluntary,
+        "nonvoluntary_ctxt_switches": involuntary,
+        "cpu_seconds": (int(fields[11]) + int(fields[12])) / ticks,
+        "threads": int(fields[17]),
+        "rss_bytes": int(fields[21]) * os.sysconf("SC_PAGE_SIZE"),
+    }
+
+
+def scrape_counter(host, name):
+    """Sum all series of a counter from the server's /metrics, or None if unavailable."""
+    try:
+        with urllib.request.urlopen(f"http://{host}:5004/metrics", timeout=5) as response:
+            text = response.read().decode()
+    except Exception:
+        return None
+    pattern = re.compile(rf"^{re.escape(name)}(?:{{[^}}]*}})? (\S+)$", re.MULTILINE)
+    return sum(float(value) for value in pattern.findall(text))
+
+
+async def http_worker(url, deadline, latencies, errors, method="GET"):
+    loop = asyncio.get_running_loop()
+
+    def fetch():
+        request = urllib.request.Request(url, method=method)
+        with urllib.request.urlopen(request, timeout=30) as response:
+            response.read()
+
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            await loop.run_in_executor(None, fetch)
+            latencies.append((time.perf_counter() - start) * 1000)
+        except Exception as e:
+            errors.append(str(e))
+
+
+async def save_video_caller(host, deadline, interval, latencies, errors):
+    """Trigger a clip save every `interval` seconds, like the dashboard does on detections."""
+    loop = asyncio.get_running_loop()
+    sequence = 0
+    while time.monotonic() + interval < deadline:
+        await asyncio.sleep(interval)
+        sequence += 1
+        url = f"http://{host}:5005/save-video/bench-{os.getpid()}-{sequence}"
+        start = time.perf_counter()
+        try:
+            await loop.run_in_executor(
+                None, lambda: urllib.request.urlopen(urllib.request.Request(url, method="POST"), timeout=60).read()
+            )
+            latencies.append((time.perf_counter() - start) * 1000)
+        except Exception as e:
+            errors.append(str(e))
+
+
+@contextlib.asynccontextmanager
+async def open_stream(url):
+    """Yield a function receiving one message from a ws:// URL or a length-prefixed tcp://HOST:PORT stream."""
+    if url.startswith("tcp://"):
+        host, port = url[len("tcp://"):].rsplit(":", 1)
+        reader, writer = await asyncio.open_connection(host, int(port))
+
+        async def receive():
+            length, = LENGTH_PREFIX.unpack(await reader.readexactly(LENGTH_PREFIX.size))
+            return await reader.readexactly(length)
+
+        try:
+            yield receive
+        finally:
+            writer.close()
+    else:
+        # A slow reader's queue is full of frames, so it may never see the server's close frame
+        async with connect(url, max_size=None, compression=None, close_timeout=1) as websocket:
+            yield websocket.recv
+
+
+class Jitter:
+    """RFC 3550 interarrival jitter: how much arrival times wander relative to media time."""
+
+    def __init__(self):
+        self.previous = None
+        self.seconds = 0.0
+
+    def add(self, arrival, media_time):
+        transit = arrival - media_time
+        if self.previous is not None:
+            self.seconds += (abs(transit - self.previous) - self.seconds) / 16
+        self.previous = transit
+
+
+async def video_client(url, deadline, stats, read_delay=0.0):
+    """Receive frames; a non-zero `read_delay` makes this a deliberately slow reader."""
+    gaps, latencies = [], []
+    frames = size = 0
+    first_frame = None
+    connected = time.perf_counter()
+    async with open_stream(url) as receive:
+        last = None
+        while time.monotonic() < deadline:
+            try:
+                message = await asyncio.wait_for(receive(), timeout=max(0.01, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                break
+            received = time.time()
+            now = time.perf_counter()
+            if first_frame is None:
+                first_frame = now - connected
+            if last is not None:
+                gaps.append((now - last) * 1000)
+            last = now
+            frames += 1
+            size += len(message)
+            stamp = frame_timestamp(message)
+            if stamp is not None:
+                latencies.append((received - stamp) * 1000)
+            if read_delay:
+                await asyncio.sleep(read_delay)
+        receiving = time.perf_counter() - connected
+    stats.append({
+        "frames": frames,
+        "seconds": receiving,
+        "bytes": size,
+        "gaps_ms": gaps,
+        "latencies_ms": latencies,
+        "first_frame_ms": first_frame * 1000 if first_frame is not None else None,
+        "slow": bool(read_delay),
+    })
+
+
+async def audio_client(url, deadline, stats):
+    chunks = size = samples = 0
+    jitter = Jitter()
+    async with open_stream(url) as receive:
+        sample_rate = int(await receive())
+        while time.monotonic() < deadline:
+            try:
+                message = await asyncio.wait_for(receive(), timeout=max(0.01, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                break
+            jitter.add(time.perf_counter(), samples / sample_rate)
+            chunks += 1
+            size += len(message)
+            samples += len(message) // 2
+    stats.append({"chunks": chunks, "bytes": size, "sample_rate": sample_rate, "jitter_ms": jitter.seconds * 1000})
+
+
+class RtpReceiver(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.packets = asyncio.Queue()
+
+    def datagram_received(self, data, address):
+        self.packets.put_nowait((time.perf_counter(), data))
+
+
+async def rtp_audio_client(host, port, token, deadline, stats, sample_rate=44100):
+    """Subscribe to the server's RTP audio and count packets, losses and jitter."""
+    loop = asyncio.get_running_loop()
+    transport, receiver = await loop.create_datagram_endpoint(RtpReceiver, remote_addr=(host, port))
+    chunks = size = lost = 0
+    expected = None
+    jitter = Jitter()
+    try:
+        transport.sendto(token.encode())
+        while time.monotonic() < deadline:
+            try:
+                arrival, packet = await asyncio.wait_for(
+                    receiver.packets.get(), timeout=max(0.01, deadline - time.monotonic())
+                )
+            except asyncio.TimeoutError:
+                break
+            _, _, sequence, timestamp, _ = RTP_HEADER.unpack_from(packet)
+            if expected is not None:
+                lost += (sequence - expected) & 0xFFFF
+            expected = (sequence + 1) & 0xFFFF
+            jitter.add(arrival, timestamp / sample_rate)
+            chunks += 1
+            size += len(packet) - RTP_HEADER.size
+    finally:
+        transport.close()
+    stats.append({
+        "chunks": chunks, "bytes": size, "sample_rate": sample_rate, "jitter_ms": jitter.seconds * 1000, "lost": lost,
+    })
+
+
+def load_wav(path):
+    with wave.open(path, "rb") as wav_file:
+        return wav_file.readframes(wav_file.getnframes()), wav_file.getframerate()
+
+
+async def mic_client(url, deadline, stats, audio, sample_rate, chunk_size=4096):
+    """Send audio to the speaker endpoint at real-time pace."""
+    chunk_bytes = chunk_size * 2
+    chunks = 0
+    interval = chunk_size / sample_rate
+    next_send = time.monotonic()
+    async with connect(url, max_size=None, compression=None) as websocket:
+        while time.monotonic() < deadline:
+            offset = (chunks * chunk_bytes) % max(1, len(audio) - chunk_bytes)
+            await websocket.send(audio[offset:offset + chunk_bytes])
+            chunks += 1
+            next_send += interval
+            await asyncio.sleep(max(0, next_send - time.monotonic()))
+    stats.append({"chunks": chunks})
+
+
+def sample_process(pid, before, elapsed):
+    """CPU, memory and context switches of a process since `before` was sampled."""
+    after = process_counters(pid)
+    switches = (
+        after["voluntary_ctxt_switches"] - before["voluntary_ctxt_switches"]
+        + after["nonvoluntary_ctxt_switches"] - before["nonvoluntary_ctxt_switches"]
+    )
+    return {
+        "cpu_percent": 100 * (after["cpu_seconds"] - before["cpu_seconds"]) / elapsed,
+        "rss_bytes": after["rss_bytes"],
+        "threads": after["threads"],
+        "voluntary_ctxt_switches": after["voluntary_ctxt_switches"] - before["voluntary_ctxt_switches"],
+        "nonvoluntary_ctxt_switches": after["nonvoluntary_ctxt_switches"] - before["nonvoluntary_ctxt_switches"],
+        "context_switches_per_second": switches / elapsed,
+    }
+
+
+async def run(args, pid=None, relay_pid=None):
+    deadline = time.monotonic() + args.duration
+    recordings_latencies, recordings_errors = [], []
+    save_latencies, save_errors = [], []
+    video_stats, audio_stats, mic_stats = [], [], []
+    before = process_counters(pid) if pid else None
+    relay_before = process_counters(relay_pid) if relay_pid else None
+    # Viewers go through the relay when there is one; everything else talks to the server
+    video_port, audio_port = args.relay_ports if args.relay else (5001, 5002)
+    if args.video_transport == "tcp":
+        video_url = f"tcp://{args.host}:{TCP_VIDEO_PORT}"
+    else:
+        query = [f"tier={args.video_tier}"] if args.video_tier != "full" else []
+        if args.video_mode == "tiles":
+            query.append("mode=tiles")
+        video_url = f"ws://{args.host}:{video_port}/video" + ("?" + "&".join(query) if query else "")
+    dropped_before = scrape_counter(args.host, "pi_video_frames_dropped_total")
+    audio_before = {name: scrape_counter(args.host, name) for name in AUDIO_COUNTERS}
+    started = time.monotonic()
+
+    tasks = [
+        http_worker(f"http://{args.host}:5004/recordings", deadline, recordings_latencies, recordings_errors)
+        for _ in range(args.http_concurrency)
+    ]
+    tasks += [
+        video_client(video_url, deadline, video_stats)
+        for _ in range(args.video_clients)
+    ]
+    tasks += [
+        video_client(video_url, deadline, video_stats, read_delay=1 / args.slow_reader_fps)
+        for _ in range(args.slow_video_clients)
+    ]
+    for _ in range(args.audio_clients):
+        if args.audio_transport == "rtp":
+            tasks.append(rtp_audio_client(args.host, RTP_AUDIO_PORT, args.rtp_audio_token, deadline, audio_stats))
+        elif args.audio_transport == "tcp":
+            tasks.append(audio_client(f"tcp://{args.host}:{TCP_AUDIO_PORT}", deadline, audio_stats))
+        else:
+            tasks.append(audio_client(f"ws://{args.host}:{audio_port}/audio", deadline, audio_stats))
+    if args.mic_clients:
+        audio, sample_rate = load_wav(args.mic_wav)
+        tasks += [
+            mic_client(f"ws://{args.host}:5003/mic", deadline, mic_stats, audio, sample_rate)
+            for _ in range(args.mic_clients)
+        ]
+    if args.save_interval:
+        tasks.append(save_video_caller(args.host, deadline, args.save_interval, save_latencies, save_errors))
+
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    client_errors = [str(result) for result in results if isinstance(result, Exception)]
+    elapsed = time.monotonic() - started
+
+    fast_clients = [stats for stats in video_stats if not stats["slow"]]
+    slow_clients = [stats for stats in video_stats if stats["slow"]]
+    dropped_after = scrape_counter(args.host, "pi_video_frames_dropped_total")
+    audio_counts = {}
+    for name in AUDIO_COUNTERS:
+        previous, current = audio_before[name], scrape_counter(args.host, name)
+        audio_counts[name] = current - previous if previous is not None and current is not None else None
+    playout_delays = audio_counts["pi_audio_playout_delay_seconds_count"]
+    result = {
+        "duration": elapsed,
+        "scenario": {
+            key: getattr(args, key)
+            for key in ("video_clients", "slow_video_clients", "slow_reader_fps", "audio_clients",
+                        "mic_clients", "http_concurrency", "save_interval", "relay", "video_mode", "video_tier",
+                        "video_transport", "audio_transport")
+        },
+        "client_errors": client_errors,
+        "video": {
+            "fps_per_client": summary([stats["frames"] / stats["seconds"] for stats in fast_clients]),
+            "slow_reader_fps_per_client": summary([stats["frames"] / stats["seconds"] for stats in slow_clients]),
+            "bytes_per_second": sum(stats["bytes"] for stats in video_stats) / elapsed,
+            "frame_gap_ms": percentiles([gap for stats in fast_clients for gap in stats["gaps_ms"]]),
+            "latency_ms": percentiles([latency for stats in fast_clients for latency in stats["latencies_ms"]]),
+            "first_frame_ms": summary([stats["first_frame_ms"] for stats in video_stats if stats["first_frame_ms"]]),
+            "dropped_frames": (
+                dropped_after - dropped_before if dropped_before is not None and dropped_after is not None else None
+            ),
+        },
+        "audio": {
+            "chunks_per_second_per_client": summary([stats["chunks"] / elapsed for stats in audio_stats]),
+            "bytes_per_second": sum(stats["bytes"] for stats in audio_stats) / elapsed,
+            "jitter_ms": summary([stats["jitter_ms"] for stats in audio_stats]),
+            "lost_packets": sum(stats.get("lost", 0) for stats in audio_stats),
+            "input_overruns": audio_counts["pi_audio_input_overruns_total"],
+        },
+        "mic": {
+            "chunks_sent": sum(stats["chunks"] for stats in mic_stats),
+            "output_underruns": audio_counts["pi_audio_output_underruns_total"],
+            "playout_delay_ms_mean": (
+                audio_counts["pi_audio_playout_delay_seconds_sum"] / playout_delays * 1000
+                if playout_delays else None
+            ),
+        },
+        "http": {
+            "recordings": {
+                "requests": len(recordings_latencies),
+                "errors": len(recordings_errors),
+                "requests_per_second": len(recordings_latencies) / elapsed,
+                "latency_ms": percentiles(recordings_latencies),
+            },
+            "save_video": {
+                "requests": len(save_latencies),
+                "errors": len(save_errors),
+                "latency_ms": percentiles(save_latencies),
+            },
+        },
+    }
+    try:
+        # Time, CPU and power the capture service spent idle and active
+        with urllib.request.urlopen(f"http://{args.host}:5004/capture", timeout=5) as response:
+            capture = json.load(response)
+        result["capture"] = capture["modes"]
+        result["jpeg_encoder"] = capture["jpeg_encoder"]["name"]
+    except Exception as e:
+        logger.warning(f"Could not read capture modes: {e}")
+    if before:
+        result["process"] = sample_process(pid, before, elapsed)
+    if relay_before:
+        relay = sample_process(relay_pid, relay_before, elapsed)
+        viewers = len(video_stats) + len(audio_stats)
+        cores = relay["cpu_percent"] / 100
+        # Extrapolated from this run; valid while the relay's fps per client holds up
+        relay["viewers"] = viewers
+        relay["viewers_per_core"] = viewers / cores if cores else None
+        result["relay"] = relay
+    return result
+
+
+def spawn_server(args):
+    """
+    Start server.py in a scratch directory and wait until `/ready` reports
+    every subsystem up. Returns the process and the server's startup breakdown.
+    """
+    command = [
+        sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py"), "--stamp-frames",
+        "--tcp-video-port", str(TCP_VIDEO_PORT), "--tcp-audio-port", str(TCP_AUDIO_PORT),
+        "--rtp-audio-port", str(RTP_AUDIO_PORT), "--rtp-audio-token", args.rtp_audio_token,
+    ]
+    if args.simulated_devices:
+        command += [
+            "--video-source", "synthetic",
+            "--audio-input", f"replay:{os.path.abspath(args.mic_wav)}",
+            "--audio-output", "null",
+        ]
+    command += args.server_args
+    os.makedirs(args.workdir, exist_ok=True)
+    logger.info(f"Starting server: {' '.join(command)}")
+    process = subprocess.Popen(command, cwd=args.workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    started = time.monotonic()
+    deadline = started + args.startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited during startup with code {process.returncode}")
+        try:
+            with urllib.request.urlopen(f"http://{args.host}:5004/ready", timeout=1) as response:
+                status = json.load(response)
+        except urllib.error.HTTPError as e:
+            # 503 while devices are still starting
+            status = json.load(e)
+            failed = [name for name, state in status["subsystems"].items() if state["state"] == "failed"]
+            if failed:
+                process.terminate()
+                raise RuntimeError(f"Server failed to start: {status['subsystems']}")
+            time.sleep(0.1)
+            continue
+        except Exception:
+            time.sleep(0.1)
+            continue
+        ready_seconds = time.monotonic() - started
+        logger.info(f"Server ready after {ready_seconds:.1f}s")
+        return process, {
+            "ready_seconds": ready_seconds,
+            "phases": status["phases"],
+            "subsystems": {name: state["seconds"] for name, state in status["subsystems"].items()},
+        }
+    process.terminate()
+    raise RuntimeError("Server did not become ready in time")
+
+
+def spawn_relay(args):
+    """Start relay.py in front of the server and wait until it answers."""
+    command = [
+        sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "relay.py"),
+        "--upstream", f"{args.host}:5001", "--listen-ports", ",".join(map(str, args.relay_ports)),
+    ]
+    logger.info(f"Starting relay: {' '.join(command)}")
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Relay exited during startup with code {process.returncode}")
+        try:
+            with urllib.request.urlopen(f"http://{args.host}:{args.relay_ports[0]}/relay", timeout=1):
+                return process
+        except Exception:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("Relay did not start in time")
+
+
+def flatten(result, prefix=""):
+    for key, value in result.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from flatten(value, f"{name}.")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, value
+
+
+def compare(before_path, after_path):
+    with open(before_path) as before_file, open(after_path) as after_file:
+        before = dict(flatten(json.load(before_file)))
+        after = dict(flatten(json.load(after_file)))
+    print(f"{'metric':50} {'before':>14} {'after':>14} {'change':>8}")
+    for name in sorted(before.keys() & after.keys()):
+        old, new = before[name], after[name]
+        change = f"{(new - old) / old * 100:+.1f}%" if old else ""
+        print(f"{name:50} {old:14.2f} {new:14.2f} {change:>8}")
+
+
+def check_regressions(baseline, result, tolerance):
+    """Return a description of every checked metric that got worse by more than `tolerance`."""
+    old_values, new_values = dict(flatten(baseline)), dict(flatten(result))
+    regressions = []
+    for name, higher_is_better in REGRESSION_CHECKS.items():
+        old, new = old_values.get(name), new_values.get(name)
+        if old is None or new is None:
+            continue
+        if higher_is_better:
+            regressed = new < old * (1 - tolerance)
+        else:
+            # Allow a small absolute slack so near-zero baselines don't flap
+            regressed = new > old * (1 + tolerance) and new - old > 1
+        if regressed:
+            regressions.append(f"{name}: {old:.2f} -> {new:.2f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--pid", type=int, help="server process ID, to sample CPU, RSS and context switches")
+    parser.add_argument("--spawn", action="store_true", help="start server.py locally for the run")
+    parser.add_argument("--simulated-devices", action="store_true",
+                        help="run the spawned server on a synthetic camera, WAV microphone and null speaker")
+    parser.add_argument("--server-args", nargs=argparse.REMAINDER, default=[],
+                        help="arguments passed to the spawned server.py (must come last)")
+    parser.add_argument("--workdir", default="./bench-run", help="working directory of the spawned server")
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument("--warmup", type=float, default=2, help="seconds to wait after startup before measuring")
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--video-clients", type=int, default=2)
+    parser.add_argument("--slow-video-clients", type=int, default=1)
+    parser.add_argument("--slow-reader-fps", type=float, default=5)
+    parser.add_argument("--video-mode", choices=("jpeg", "tiles"), default="jpeg",
+                        help="whole JPEG frames, or keyframes and changed tiles; in tile mode a static "
+                             "scene sends few messages, so compare bytes_per_second rather than fps")
+    parser.add_argument("--audio-clients", type=int, default=1)
+    parser.add_argument("--video-tier", choices=("full", "half", "thumb"), default="full",
+                        help="quality tier video clients ask for")
+    parser.add_argument("--video-transport", choices=("websocket", "tcp"), default="websocket",
+                        help="receive video over WebSockets or the length-prefixed TCP port")
+    parser.add_argument("--audio-transport", choices=("websocket", "tcp", "rtp"), default="websocket",
+                        help="receive audio over WebSockets, the length-prefixed TCP port or RTP")
+    parser.add_argument("--rtp-audio-token", default="benchmark",
+                        help="token to subscribe to RTP audio with; spawned servers are started with it")
+    parser.add_argument("--mic-clients", type=int, default=1)
+    parser.add_argument("--mic-wav", default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                          "test_assets", "BabyElephantWalk60.wav"))
+    parser.add_argument("--http-concurrency", type=int, default=2)
+    parser.add_argument("--save-interval", type=float, default=5, help="seconds between /save-video calls, 0 to disable")
+    parser.add_argument("--relay", action="store_true",
+                        help="start relay.py in front of the server and connect video and audio clients to it")
+    parser.add_argument("--relay-ports", type=lambda value: tuple(int(port) for port in value.split(",")),
+                        default=(6001, 6002), help="video and audio ports for the spawned relay")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--baseline", help="result file to compare against; exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative regression")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.relay and (args.video_transport, args.audio_transport) != ("websocket", "websocket"):
+        parser.error("relay.py only serves WebSockets; drop --relay or the TCP/RTP transports")
+    if args.video_tier != "full" and (args.video_mode == "tiles" or args.video_transport == "tcp"):
+        parser.error("--video-tier needs whole-frame WebSocket video")
+    if args.video_transport == "tcp" and args.video_mode == "tiles":
+        parser.error("the TCP video port sends whole frames only")
+    if args.relay and args.video_mode == "tiles":
+        parser.error("relay.py only relays whole-frame video; drop --relay or --video-mode tiles")
+
+    process, startup = spawn_server(args) if args.spawn else (None, None)
+    relay = None
+    try:
+        relay = spawn_relay(args) if args.relay else None
+        time.sleep(args.warmup if process or relay else 0)
+        result = asyncio.run(run(
+            args, pid=process.pid if process else args.pid, relay_pid=relay.pid if relay else None,
+        ))
+        if startup:
+            result["startup"] = startup
+    finally:
+        for child in (relay, process):
+            if child:
+                child.terminate()
+                child.wait(timeout=30)
+
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(result, output, indent=2)
+        logger.info(f"Wrote results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = check_regressions(json.load(baseline_file), result, args.tolerance)
+        if regressions:
+            logger.error("Performance regressions against baseline:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        logger.info("No regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
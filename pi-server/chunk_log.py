@@ -0,0 +1,252 @@
+"""
+Append-only log of timestamped records, split across chunk files.
+
+Each chunk is a data file of `(timestamp, length, payload)` records and an
+index file of fixed-size `(timestamp, offset, length)` entries. Writes only
+ever append, so the SD card sees large sequential writes instead of one
+small file per frame, and a time range is read back with one seek per
+chunk followed by sequential reads.
+
+For SD cards, chunks can be preallocated so appends do not change the file
+size, letting the batched fdatasync skip metadata writes, and the log can be
+capped at `max_bytes` by dropping its oldest chunks, both when a new chunk
+starts and whenever old chunks are pruned with `remove_before`.
+"""
+import asyncio
+import bisect
+import itertools
+import logging
+import os
+import struct
+import threading
+import time
+from array import array
+
+logger = logging.getLogger(__name__)
+
+RECORD_HEADER = struct.Struct("<dI")
+INDEX_ENTRY = struct.Struct("<dQI")
+READ_BUFFER = 1024 * 1024
+READ_BATCH = 32
+
+
+async def iterate_in_thread(records):
+    """Drain a blocking generator a batch at a time from a worker thread."""
+    while True:
+        batch = await asyncio.to_thread(lambda: list(itertools.islice(records, READ_BATCH)))
+        if not batch:
+            return
+        for record in batch:
+            yield record
+
+
+class Chunk:
+    """One data file and its in-memory offset index."""
+
+    def __init__(self, directory, name):
+        self.name = name
+        self.data_path = os.path.join(directory, f"{name}.chunk")
+        self.index_path = os.path.join(directory, f"{name}.idx")
+        self.timestamps = array("d")
+        self.offsets = array("Q")
+        self.lengths = array("I")
+
+    def load(self):
+        """Read the index, ignoring entries for records that never fully reached the data file."""
+        data_size = os.path.getsize(self.data_path) if os.path.exists(self.data_path) else 0
+        with open(self.index_path, "rb") as index_file:
+            raw = index_file.read()
+        raw = raw[:len(raw) - len(raw) % INDEX_ENTRY.size]
+        for timestamp, offset, length in INDEX_ENTRY.iter_unpack(raw):
+            if offset + length > data_size:
+                break
+            self.add(timestamp, offset, length)
+        self.verify_tail()
+        return self
+
+    def verify_tail(self):
+        """Drop trailing entries whose record header never reached the data file, e.g. preallocated zeros."""
+        if not self.offsets:
+            return
+        with open(self.data_path, "rb") as data_file:
+            while self.offsets:
+                data_file.seek(self.offsets[-1] - RECORD_HEADER.size)
+                header = data_file.read(RECORD_HEADER.size)
+                if len(header) == RECORD_HEADER.size and \
+                        RECORD_HEADER.unpack(header) == (self.timestamps[-1], self.lengths[-1]):
+                    return
+                self.timestamps.pop()
+                self.offsets.pop()
+                self.lengths.pop()
+
+    def add(self, timestamp, offset, length):
+        self.timestamps.append(timestamp)
+        self.offsets.append(offset)
+        self.lengths.append(length)
+
+    @property
+    def end_offset(self):
+        """Where the next record goes: just past the last indexed one."""
+        return self.offsets[-1] + self.lengths[-1] if self.offsets else 0
+
+    @property
+    def size_bytes(self):
+        return sum(os.path.getsize(path) for path in (self.data_path, self.index_path) if os.path.exists(path))
+
+    def to_dict(self):
+        return {
+            "chunk": self.name,
+            "records": len(self.timestamps),
+            "bytes": self.size_bytes,
+            "first": self.timestamps[0] if self.timestamps else None,
+            "last": self.timestamps[-1] if self.timestamps else None,
+        }
+
+
+class ChunkLog:
+    """
+    Records go to the chunk named by `chunk_name(timestamp)`, e.g. one
+    chunk per day. Appends are flushed immediately so readers see them,
+    but only fsynced every `fsync_interval` seconds to spare the SD card.
+    """
+
+    def __init__(self, directory, chunk_name, fsync_interval=5.0, preallocate=0, max_bytes=None):
+        self.directory = directory
+        self.chunk_name = chunk_name
+        self.fsync_interval = fsync_interval
+        self.preallocate = preallocate
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.chunks = {}
+        self.writing = None
+        self.data_file = None
+        self.index_file = None
+        self.last_sync = 0.0
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with self.lock:
+            for filename in sorted(os.listdir(self.directory)):
+                if filename.endswith(".idx"):
+                    chunk = Chunk(self.directory, filename[:-len(".idx")]).load()
+                    if self.preallocate and os.path.exists(chunk.data_path):
+                        # A chunk left preallocated by a crash
+                        os.truncate(chunk.data_path, chunk.end_offset)
+                    self.chunks[chunk.name] = chunk
+        logger.info(f"Opened chunk log {self.directory}: {len(self.chunks)} chunks")
+
+    def append(self, timestamp, payload):
+        with self.lock:
+            name = self.chunk_name(timestamp)
+            if self.writing is None or self.writing.name != name:
+                self.rotate(name)
+            chunk = self.writing
+            if chunk.timestamps and timestamp < chunk.timestamps[-1]:
+                # Keep the index sorted if the wall clock steps backwards
+                timestamp = chunk.timestamps[-1]
+            offset = chunk.end_offset + RECORD_HEADER.size
+            self.data_file.write(RECORD_HEADER.pack(timestamp, len(payload)))
+            self.data_file.write(payload)
+            self.data_file.flush()
+            self.index_file.write(INDEX_ENTRY.pack(timestamp, offset, len(payload)))
+            self.index_file.flush()
+            chunk.add(timestamp, offset, len(payload))
+            if time.monotonic() - self.last_sync >= self.fsync_interval:
+                self.sync()
+
+    def rotate(self, name):
+        """Finish the current chunk and open `name` for appending, dropping any torn tail."""
+        self.close_files()
+        chunk = self.chunks.get(name)
+        if chunk is None:
+            self.evict(self.preallocate)
+            chunk = self.chunks[name] = Chunk(self.directory, name)
+        for path, size in ((chunk.data_path, chunk.end_offset),
+                           (chunk.index_path, len(chunk.timestamps) * INDEX_ENTRY.size)):
+            with open(path, "ab") as append_file:
+                append_file.truncate(size)
+        self.data_file = open(chunk.data_path, "r+b")
+        if self.preallocate > chunk.end_offset and hasattr(os, "posix_fallocate"):
+            os.posix_fallocate(self.data_file.fileno(), 0, self.preallocate)
+        self.data_file.seek(chunk.end_offset)
+        self.index_file = open(chunk.index_path, "ab")
+        self.writing = chunk
+
+    def evict(self, needed):
+        """Remove the oldest chunks, short of the one being written, until `needed` more bytes fit within `max_bytes`."""
+        if self.max_bytes is None:
+            return
+        total = sum(chunk.size_bytes for chunk in self.chunks.values())
+        for name in sorted(self.chunks):
+            if total + needed <= self.max_bytes or (self.writing and self.writing.name == name):
+                break
+            total -= self.chunks[name].size_bytes
+            self.remove(name)
+
+    def sync(self):
+        # Preallocated data files keep their size, so only the index needs its metadata written
+        sync = getattr(os, "fdatasync", os.fsync)
+        for log_file in (self.data_file, self.index_file):
+            if log_file:
+                sync(log_file.fileno())
+        self.last_sync = time.monotonic()
+
+    def close_files(self):
+        if self.data_file:
+            # Give back the unused end of the preallocation
+            self.data_file.truncate(self.writing.end_offset)
+            self.sync()
+            self.data_file.close()
+            self.index_file.close()
+        self.data_file = self.index_file = self.writing = None
+
+    def close(self):
+        with self.lock:
+            self.close_files()
+
+    def ranges(self, start, end):
+        """Index ranges of the records with `start <= timestamp <= end`, per chunk in time order."""
+        with self.lock:
+            ranges = []
+            for name in sorted(self.chunks):
+                chunk = self.chunks[name]
+                first = bisect.bisect_left(chunk.timestamps, start)
+                last = bisect.bisect_right(chunk.timestamps, end)
+                if first < last:
+                    ranges.append((chunk, first, last))
+            return ranges
+
+    def count(self, start, end):
+        return sum(last - first for _, first, last in self.ranges(start, end))
+
+    def read(self, start, end):
+        """Yield `(timestamp, payload)` for a time range, reading each chunk front to back."""
+        for chunk, first, last in self.ranges(start, end):
+            with open(chunk.data_path, "rb", buffering=READ_BUFFER) as data_file:
+                if hasattr(os, "posix_fadvise"):
+                    os.posix_fadvise(data_file.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                data_file.seek(chunk.offsets[first])
+                for i in range(first, last):
+                    # Skips over record headers stay inside the read buffer
+                    data_file.seek(chunk.offsets[i])
+                    yield chunk.timestamps[i], data_file.read(chunk.lengths[i])
+
+    def stats(self):
+        with self.lock:
+            return [self.chunks[name].to_dict() for name in sorted(self.chunks)]
+
+    def remove_before(self, name):
+        """Delete whole chunks named before `name`, e.g. days past retention, then any beyond `max_bytes`."""
+        with self.lock:
+            for old in [chunk_name for chunk_name in self.chunks if chunk_name < name]:
+                if self.writing and self.writing.name == old:
+                    continue
+                self.remove(old)
+            self.evict(0)
+
+    def remove(self, name):
+        chunk = self.chunks.pop(name)
+        for path in (chunk.data_path, chunk.index_path):
+            if os.path.exists(path):
+                os.remove(path)
+        logger.info(f"Removed chunk {name} from {self.directory}")
@@ -0,0 +1,160 @@
+import asyncio
+import collections
+import itertools
+import logging
+import os
+import time
+import uuid
+
+import metrics
+from profiling import TRACER
+
+logger = logging.getLogger(__name__)
+
+
+class ClipJob:
+    def __init__(self, video_id, output_path, frames, priority):
+        self.id = uuid.uuid4().hex[:12]
+        self.video_id = video_id
+        self.output_path = output_path
+        self.frames = frames
+        self.priority = priority
+        self.status = "queued"
+        self.progress = 0.0
+        self.error = None
+        # Set when the clip was written but `on_complete` (indexing it) failed
+        self.index_error = None
+        self.result = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "video_id": self.video_id,
+            "status": self.status,
+            "progress": round(self.progress, 3),
+            "output_path": self.output_path,
+            "error": self.error,
+            "index_error": self.index_error,
+            "result": self.result,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class ClipExportQueue:
+    """
+    Bounded priority queue of clip encodes served by a fixed pool of workers.
+
+    Submitting snapshots the pre-roll right away, so the clip covers the
+    moment of the request even if it waits in the queue. Requests for a
+    `video_id` that is already queued, running or saved return the existing
+    job instead of encoding the clip again, unless the saved clip has since
+    been deleted.
+
+    Each job pins its own pre-roll snapshot until it is encoded, and frames
+    the live buffer has moved past are kept alive only by those snapshots,
+    so `max_pending` is kept small: at most `workers + max_pending`
+    pre-rolls are held at once.
+    """
+
+    def __init__(self, video_handler, workers=2, max_pending=4, history=200, on_complete=None):
+        self.video_handler = video_handler
+        self.workers = workers
+        self.queue = asyncio.PriorityQueue(maxsize=max_pending)
+        self.jobs = collections.OrderedDict()
+        self.jobs_by_video_id = {}
+        self.history = history
+        self.on_complete = on_complete
+        self.sequence = itertools.count()
+        self.tasks = []
+        metrics.CLIP_QUEUE_DEPTH.set_function(self.queue.qsize)
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self.worker(i)) for i in range(self.workers)]
+        logger.info(f"Clip export queue started with {self.workers} workers")
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def submit(self, video_id, output_path, priority=10):
+        """
+        Queue a clip export and return `(job, created)`. Lower `priority`
+        values run first. Raises `asyncio.QueueFull` when the queue is full
+        and `ValueError` when there are no frames to save.
+        """
+        existing = self.jobs_by_video_id.get(video_id)
+        if existing and (existing.active or existing.status == "done" and os.path.exists(existing.output_path)):
+            return existing, False
+
+        frames = self.video_handler.snapshot_frames()
+        if not frames:
+            raise ValueError("No frames available in the buffer to save")
+
+        job = ClipJob(video_id, output_path, frames, priority)
+        self.queue.put_nowait((priority, next(self.sequence), job))
+        self.jobs[job.id] = job
+        self.jobs_by_video_id[video_id] = job
+        self.trim_history()
+        logger.info(f"Queued clip job {job.id} for video {video_id} ({len(frames)} frames)")
+        return job, True
+
+    def trim_history(self):
+        while len(self.jobs) > self.history:
+            job_id, job = next(iter(self.jobs.items()))
+            if job.active:
+                break
+            del self.jobs[job_id]
+            if self.jobs_by_video_id.get(job.video_id) is job:
+                del self.jobs_by_video_id[job.video_id]
+
+    async def worker(self, worker_id):
+        while True:
+            _, _, job = await self.queue.get()
+            job.status = "running"
+            job.started = time.time()
+
+            def report(progress, job=job):
+                job.progress = progress
+
+            try:
+                with TRACER.span("clip save"):
+                    job.result = await asyncio.to_thread(
+                        self.video_handler.write_clip, job.frames, job.output_path, report
+                    )
+                job.status = "done"
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e)
+                logger.error(f"Clip job {job.id} failed: {e}")
+            finally:
+                # Release the pre-roll snapshot as soon as it is encoded
+                job.frames = None
+                job.finished = time.time()
+                self.queue.task_done()
+            if job.status == "done" and self.on_complete:
+                try:
+                    # Indexing uses SQLite, which blocks
+                    await asyncio.to_thread(self.on_complete, job)
+                except Exception as e:
+                    # The clip is on disk, and the reconcile at the next startup indexes it
+                    job.index_error = str(e)
+                    logger.error(f"Clip job {job.id} saved {job.output_path} but could not index it: {e}")
+            metrics.CLIP_SAVE_SECONDS.observe(job.finished - job.started)
+            metrics.CLIP_JOBS.labels(job.status).inc()
+            logger.info(
+                f"Clip job {job.id} {job.status} in {job.finished - job.started:.2f}s "
+                f"on worker {worker_id}, waited {job.started - job.created:.2f}s"
+            )
@@ -0,0 +1,180 @@
+"""
+Optional 24/7 recording of the live video feed.
+
+Every JPEG the capture thread encodes for the main view is appended to a
+chunk log (see chunk_log.py) in fixed-length segments, each indexed by
+frame time and offset. MJPEG frames are all keyframes, so any `[start,
+end]` range is cut at frame accuracy and its segments joined into an MP4
+with stream copy, without re-encoding. Segments are preallocated and the
+oldest are dropped to stay within `max_bytes`.
+
+Each segment is preallocated for `segment_seconds` at the busiest data rate
+of the last few segments, starting from an estimate for full-rate 640x480
+MJPEG of about 1.2 MiB/s. At that rate the default 8 GiB holds roughly two
+hours; `status()` reports the window the measured rate gives.
+"""
+import collections
+import logging
+import queue
+import threading
+
+import metrics
+from chunk_log import ChunkLog, iterate_in_thread
+from media_tools import stream_ffmpeg
+
+logger = logging.getLogger(__name__)
+
+# Longer gaps (e.g. the server was down) are cut out of extracts rather than held as a still
+MAX_HOLD_SECONDS = 2.0
+
+# Data rate assumed until a segment has been measured: 30 fps of ~40 KB frames
+DEFAULT_BYTES_PER_SECOND = 1.2 * 1024 ** 2
+# Preallocate this much more than the busiest recent segment needed
+PREALLOCATE_HEADROOM = 1.25
+
+
+def at_constant_rate(records, fps):
+    """Repeat or skip timestamped frames so they play back in real time at `fps`."""
+    tick = None
+    held = None
+    for timestamp, jpeg in records:
+        if held is None or timestamp - tick > MAX_HOLD_SECONDS:
+            if held is not None:
+                yield held
+            tick = timestamp
+        else:
+            # `held` is the newest frame at every tick whose midpoint comes before this one
+            while tick + 0.5 / fps < timestamp:
+                yield held
+                tick += 1 / fps
+        held = jpeg
+    if held is not None:
+        yield held
+
+
+class DvrRecorder:
+    def __init__(
+        self,
+        video_handler,
+        directory="./dvr",
+        segment_seconds=60,
+        max_bytes=8 * 1024 ** 3,
+        default_bytes_per_second=DEFAULT_BYTES_PER_SECOND,
+        queue_size=90,
+    ):
+        self.video_handler = video_handler
+        self.directory = directory
+        self.enabled = False
+        self.segment_seconds = segment_seconds
+        self.max_bytes = max_bytes
+        self.default_bytes_per_second = default_bytes_per_second
+        # Measured bytes per second of recently finished segments
+        self.segment_rates = collections.deque(maxlen=10)
+        # Disk writes and fsyncs happen on our own thread, never the capture thread
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = None
+        self.log = None
+        self.frames_written = metrics.DVR_FRAMES.labels("written")
+        self.frames_dropped = metrics.DVR_FRAMES.labels("dropped")
+        metrics.DVR_BYTES.set_function(
+            lambda: sum(segment["bytes"] for segment in self.log.stats()) if self.log else 0
+        )
+
+    def segment_name(self, timestamp):
+        start = int(timestamp // self.segment_seconds * self.segment_seconds)
+        return f"segment-{start:012d}"
+
+    @property
+    def bytes_per_second(self):
+        """The busiest recent segment's data rate, so a burst of activity still fits its preallocation."""
+        return max(self.segment_rates, default=self.default_bytes_per_second)
+
+    @property
+    def segment_bytes(self):
+        return int(self.segment_seconds * self.bytes_per_second * PREALLOCATE_HEADROOM)
+
+    def start(self):
+        self.log = ChunkLog(
+            self.directory, self.segment_name, preallocate=self.segment_bytes, max_bytes=self.max_bytes,
+        )
+        self.log.open()
+        self.thread = threading.Thread(target=self.run, name="dvr", daemon=True)
+        self.thread.start()
+        self.video_handler.recorders.append(self.enqueue)
+        logger.info(
+            f"DVR recording {self.segment_seconds}s segments to {self.directory}, "
+            f"keeping at most {self.max_bytes / 1024 ** 3:.1f} GiB "
+            f"(about {self.max_bytes / self.bytes_per_second / 3600:.1f} h at {self.bytes_per_second / 1024 ** 2:.1f} MiB/s)"
+        )
+
+    def stop(self):
+        if self.enqueue in self.video_handler.recorders:
+            self.video_handler.recorders.remove(self.enqueue)
+        if self.thread:
+            self.queue.put(None)
+            self.thread.join(timeout=10)
+        if self.log:
+            self.log.close()
+
+    def enqueue(self, jpeg, captured_at):
+        try:
+            self.queue.put_nowait((captured_at, jpeg))
+        except queue.Full:
+            self.frames_dropped.inc()
+
+    def run(self):
+        segment = first = last = None
+        written = 0
+        while (item := self.queue.get()) is not None:
+            captured_at, jpeg = item
+            name = self.segment_name(captured_at)
+            if name != segment:
+                # Size the next segment's preallocation from the one just finished
+                if segment is not None and last - first >= 1:
+                    self.segment_rates.append(written / (last - first))
+                    self.log.preallocate = self.segment_bytes
+                segment, first, written = name, captured_at, 0
+            last = captured_at
+            written += len(jpeg)
+            try:
+                self.log.append(*item)
+                self.frames_written.inc()
+            except Exception as e:
+                self.frames_dropped.inc()
+                logger.error(f"DVR write failed: {e}")
+
+    def count(self, start, end):
+        return self.log.count(start, end)
+
+    async def extract(self, start, end, fps=30):
+        """The frames between `start` and `end` as a fragmented MP4, remuxed without re-encoding."""
+        async def frames():
+            async for jpeg in iterate_in_thread(at_constant_rate(self.log.read(start, end), fps)):
+                yield jpeg
+
+        async for chunk in stream_ffmpeg(
+            ["-f", "image2pipe", "-c:v", "mjpeg", "-framerate", str(fps), "-i", "-",
+             "-c:v", "copy", "-movflags", "frag_keyframe+empty_moov+default_base_moof", "-f", "mp4", "pipe:1"],
+            frames(),
+            low_priority=True,
+        ):
+            yield chunk
+
+    def status(self):
+        segments = self.log.stats() if self.log else []
+        for segment in segments:
+            segment["segment"] = segment.pop("chunk")
+        return {
+            "enabled": self.enabled,
+            "segment_seconds": self.segment_seconds,
+            "max_bytes": self.max_bytes,
+            "bytes_per_second": round(self.bytes_per_second),
+            "preallocate_bytes": self.segment_bytes,
+            # How far back `max_bytes` reaches at that rate
+            "retention_seconds": round(self.max_bytes / self.bytes_per_second),
+            "total_bytes": sum(segment["bytes"] for segment in segments),
+            "queued_frames": self.queue.qsize(),
+            "frames_written": self.frames_written.value,
+            "frames_dropped": self.frames_dropped.value,
+            "segments": segments,
+        }
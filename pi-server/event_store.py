@@ -0,0 +1,180 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+
+from recordings_index import decode_cursor, encode_cursor
+
+logger = logging.getLogger(__name__)
+
+
+class EventStore:
+    """
+    SQLite table of triggers (doorbell presses, detections, motion) with
+    their labels and scores.
+
+    Events live in the recordings database so each one is joined to its
+    clips through `recordings.event_id`, the ID `save_video` already tags
+    clips with; a deleted clip simply stops showing up. Labels are kept in
+    their own table, indexed by label and time, so a query like all person
+    events last week is an index range scan.
+    """
+
+    COLUMNS = ("id", "created", "source", "camera", "data")
+
+    def __init__(self, recordings_index):
+        self.recordings_index = recordings_index
+        self.lock = threading.Lock()
+        # A second connection to the recordings database; WAL lets it read while the index writes
+        self.conn = sqlite3.connect(recordings_index.db_path, check_same_thread=False, timeout=5)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS events (
+                    id TEXT PRIMARY KEY,
+                    created REAL NOT NULL,
+                    source TEXT NOT NULL,
+                    camera TEXT NOT NULL DEFAULT 'default',
+                    data TEXT
+                )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS events_created ON events (created, id)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS events_camera ON events (camera, created, id)")
+            # `created` is copied from the event so label queries never touch the events table to filter
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS event_labels (
+                    event_id TEXT NOT NULL REFERENCES events (id) ON DELETE CASCADE,
+                    label TEXT NOT NULL,
+                    score REAL,
+                    created REAL NOT NULL,
+                    PRIMARY KEY (event_id, label)
+                )
+            """)
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS event_labels_label ON event_labels (label, created, event_id)"
+            )
+
+    def record(self, event_id=None, source="manual", camera="default", created=None, labels=None, data=None):
+        """
+        Store an event, or add to one already stored under `event_id`: a
+        detection can arrive after the doorbell press it belongs to. Labels
+        keep their highest score, and stay unscored (NULL) until one arrives.
+        Returns the event.
+        """
+        event_id = str(event_id) if event_id is not None else uuid.uuid4().hex
+        with self.lock, self.conn:
+            existing = self.conn.execute("SELECT created, data FROM events WHERE id = ?", (event_id,)).fetchone()
+            if existing is None:
+                created = created if created is not None else time.time()
+                self.conn.execute(
+                    "INSERT INTO events (id, created, source, camera, data) VALUES (?, ?, ?, ?, ?)",
+                    (event_id, created, source, camera, json.dumps(data) if data else None),
+                )
+            else:
+                created = existing["created"]
+                if data:
+                    merged = {**json.loads(existing["data"] or "{}"), **data}
+                    self.conn.execute("UPDATE events SET data = ? WHERE id = ?", (json.dumps(merged), event_id))
+            for label, score in (labels or {}).items():
+                self.conn.execute(
+                    """
+                    INSERT INTO event_labels (event_id, label, score, created) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (event_id, label) DO UPDATE
+                    SET score = COALESCE(MAX(score, excluded.score), score, excluded.score)
+                    """,
+                    (event_id, label.lower(), score, created),
+                )
+        return self.get(event_id)
+
+    def delete(self, event_id):
+        """Forget an event and its labels. Its clips stay in the recordings index."""
+        with self.lock, self.conn:
+            return self.conn.execute("DELETE FROM events WHERE id = ?", (str(event_id),)).rowcount > 0
+
+    def get(self, event_id):
+        with self.lock:
+            row = self.conn.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM events WHERE id = ?", (str(event_id),)
+            ).fetchone()
+            return self._attach([dict(row)])[0] if row else None
+
+    def list(self, limit=100, cursor=None, since=None, until=None, label=None, camera=None, min_score=None):
+        """
+        Return one page of events, newest first, and the cursor for the next
+        page (None on the last page). Filtering by label scans the label
+        index; otherwise the time or camera index is used.
+        """
+        clauses, params = [], []
+        if label is not None:
+            query = (
+                f"SELECT {', '.join('e.' + column for column in self.COLUMNS)} "
+                "FROM event_labels l JOIN events e ON e.id = l.event_id"
+            )
+            clauses.append("l.label = ?")
+            params.append(label.lower())
+            if min_score is not None:
+                clauses.append("l.score >= ?")
+                params.append(min_score)
+            created, event_id = "l.created", "l.event_id"
+        else:
+            query = f"SELECT {', '.join('e.' + column for column in self.COLUMNS)} FROM events e"
+            created, event_id = "e.created", "e.id"
+        if camera is not None:
+            clauses.append("e.camera = ?")
+            params.append(camera)
+        if since is not None:
+            clauses.append(f"{created} >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append(f"{created} < ?")
+            params.append(until)
+        if cursor:
+            cursor_created, cursor_id = decode_cursor(cursor)
+            # A row value comparison stays a single index range scan, unlike the equivalent OR
+            clauses.append(f"({created}, {event_id}) < (?, ?)")
+            params.extend([cursor_created, cursor_id])
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        # Fetch one extra row to know whether there is a next page
+        query += f" ORDER BY {created} DESC, {event_id} DESC LIMIT ?"
+        params.append(limit + 1)
+
+        with self.lock:
+            rows = [dict(row) for row in self.conn.execute(query, params)]
+            next_cursor = None
+            if len(rows) > limit:
+                rows = rows[:limit]
+                next_cursor = encode_cursor(rows[-1]["created"], rows[-1]["id"])
+            return self._attach(rows), next_cursor
+
+    def _attach(self, events):
+        """Fill in each event's labels and clips with one query each. Caller holds the lock."""
+        if not events:
+            return events
+        by_id = {}
+        for event in events:
+            event["data"] = json.loads(event["data"]) if event["data"] else None
+            event["labels"] = {}
+            event["clips"] = []
+            by_id[event["id"]] = event
+        placeholders = ", ".join("?" * len(by_id))
+        for row in self.conn.execute(
+            f"SELECT event_id, label, score FROM event_labels WHERE event_id IN ({placeholders})", list(by_id)
+        ):
+            by_id[row["event_id"]]["labels"][row["label"]] = row["score"]
+        columns = ", ".join(self.recordings_index.COLUMNS)
+        for row in self.conn.execute(
+            f"SELECT {columns} FROM recordings WHERE event_id IN ({placeholders}) ORDER BY created",
+            list(by_id),
+        ):
+            by_id[row["event_id"]]["clips"].append(dict(row))
+        return events
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
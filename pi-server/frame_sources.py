@@ -0,0 +1,310 @@
+"""
+Frame sources for VideoStreamHandler.
+
+Every source returns frames shaped like Picamera2's `capture_array()`:
+uint8 arrays in RGB channel order (optionally with a fourth padding channel)
+and blocks until the next frame is due, so the real capture, encode and
+streaming pipeline can run unchanged on machines without a camera. OpenCV
+and NumPy are imported when a source starts, off the server's startup path.
+"""
+import glob
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class FrameSource:
+    """Interface for anything VideoStreamHandler can capture frames from."""
+
+    def __init__(self, size=(640, 480), fps=30):
+        self.size = size
+        self.fps = fps
+        self.last_timestamp = None
+        # Higher-resolution copy of the last frame for region crops, if the source has one
+        self.hires_frame = None
+        # Half-size RGB copy of the last frame for lower quality tiers, if the source scales for free
+        self.lores_frame = None
+        # The last frame as BT.601 video-range I420 planes, if the source captured it that way
+        self.yuv_frame = None
+
+    def start(self):
+        pass
+
+    def capture_array(self):
+        raise NotImplementedError
+
+    def set_frame_rate(self, fps):
+        """Change the delivery rate, e.g. to idle the camera when nobody is watching."""
+        self.fps = fps
+
+    def request_hires(self, enabled):
+        """Ask for `hires_frame` alongside each frame while region viewers need it."""
+
+    def request_lores(self, enabled):
+        """Ask for `lores_frame` alongside each frame while tier viewers need it."""
+
+    def resize(self, size):
+        """Deliver frames of `size` from the next capture on. Called between captures."""
+        self.stop()
+        self.size = size
+        self.start()
+
+    def stop(self):
+        pass
+
+
+class PacedFrameSource(FrameSource):
+    """Base for simulated sources: releases one frame per 1/fps on a fixed schedule."""
+
+    def __init__(self, size=(640, 480), fps=30):
+        super().__init__(size, fps)
+        self.frame_index = 0
+        self.next_due = None
+        # Video clients capture from their own threads; they share one schedule, as with the camera
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.frame_index = 0
+        self.next_due = time.monotonic()
+
+    def wait_for_next_frame(self):
+        now = time.monotonic()
+        if self.next_due is None:
+            self.next_due = now
+        if self.next_due > now:
+            time.sleep(self.next_due - now)
+        elif now - self.next_due > 1:
+            # After a long stall, resume from now instead of bursting to catch up
+            self.next_due = now
+        self.next_due += 1 / self.fps
+        self.last_timestamp = time.time()
+
+    def capture_array(self):
+        with self.lock:
+            self.wait_for_next_frame()
+            frame = self.render(self.frame_index)
+            self.frame_index += 1
+        return frame
+
+    def render(self, index):
+        raise NotImplementedError
+
+
+class Picamera2Source(FrameSource):
+    """
+    The Raspberry Pi camera. By default the main stream is the regular
+    `size` view and the ISP also scales a half-size lores stream for the
+    lower quality tiers, captured only while they have viewers. With
+    `hires_size`, main is instead a high-resolution stream for region crops
+    and lores is the regular view, all from the same exposure; tiers are
+    then scaled from the regular view. ScalerCrop is shared by every stream
+    and stays on the full sensor, because the pre-roll always needs the
+    full field of view.
+    """
+
+    def __init__(self, size=(640, 480), fps=30, hires_size=None):
+        super().__init__(size, fps)
+        self.hires_size = hires_size
+        self.hires_wanted = False
+        self.lores_wanted = False
+        self.picam2 = None
+
+    def start(self):
+        # Imported here so the rest of the server runs on machines without libcamera
+        from picamera2 import Picamera2
+        from libcamera import ColorSpace
+
+        self.picam2 = Picamera2()
+        self.configure(ColorSpace.Smpte170m())
+
+    def configure(self, colour_space):
+        frame_duration = int(1_000_000 / self.fps)
+        lores_size = (self.size[0] // 4 * 2, self.size[1] // 4 * 2)
+        streams = {"main": {"size": self.size}, "lores": {"size": lores_size, "format": "YUV420"}}
+        if self.hires_size:
+            streams = {"main": {"size": self.hires_size}, "lores": {"size": self.size, "format": "YUV420"}}
+        self.config = self.picam2.create_video_configuration(
+            **streams,
+            controls={
+                "FrameDurationLimits": (frame_duration, frame_duration)
+            },
+            colour_space=colour_space
+        )
+        self.picam2.configure(self.config)
+        self.picam2.start()
+        full_res = self.picam2.camera_properties['PixelArraySize']
+        self.picam2.set_controls({"ScalerCrop": [0, 0, full_res[0], full_res[1]]})
+
+    def capture_array(self):
+        import cv2
+
+        if not self.hires_size:
+            if self.lores_wanted:
+                (frame, lores), _ = self.picam2.capture_arrays(["main", "lores"])
+                self.lores_frame = cv2.cvtColor(lores, cv2.COLOR_YUV420p2RGB)
+            else:
+                frame = self.picam2.capture_array()
+                self.lores_frame = None
+            self.last_timestamp = time.time()
+            return frame
+
+        if self.hires_wanted:
+            (lores, self.hires_frame), _ = self.picam2.capture_arrays(["lores", "main"])
+        else:
+            lores = self.picam2.capture_array("lores")
+            self.hires_frame = None
+        self.last_timestamp = time.time()
+        # Encoders that take YUV can skip converting this back
+        self.yuv_frame = lores
+        return cv2.cvtColor(lores, cv2.COLOR_YUV420p2RGB)
+
+    def request_hires(self, enabled):
+        self.hires_wanted = enabled and bool(self.hires_size)
+
+    def request_lores(self, enabled):
+        # With a hires main stream, lores is already the regular view
+        self.lores_wanted = enabled and not self.hires_size
+
+    def resize(self, size):
+        # Stop and reconfigure the open camera; closing and reopening it takes far longer
+        self.picam2.stop()
+        self.size = size
+        self.configure(self.config["colour_space"])
+
+    def set_frame_rate(self, fps):
+        # Slowing the sensor itself is what saves power, not just capturing less often
+        super().set_frame_rate(fps)
+        frame_duration = int(1_000_000 / fps)
+        self.picam2.set_controls({"FrameDurationLimits": (frame_duration, frame_duration)})
+
+    def stop(self):
+        if self.picam2:
+            self.picam2.stop()
+
+
+class ReplaySource(PacedFrameSource):
+    """
+    Loops an MP4 or a sequence of images at a fixed rate. `path` may be a
+    video file, a single image, a directory of images or a glob pattern.
+    Image sequences are decoded once up front; videos are decoded as they
+    play so long recordings don't have to fit in memory.
+    """
+
+    IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+    def __init__(self, path, size=(640, 480), fps=30):
+        super().__init__(size, fps)
+        self.path = path
+        self.images = None
+        self.capture = None
+
+    def start(self):
+        import cv2
+
+        super().start()
+        if os.path.isdir(self.path):
+            paths = sorted(
+                os.path.join(self.path, name) for name in os.listdir(self.path)
+                if name.lower().endswith(self.IMAGE_EXTENSIONS)
+            )
+        elif self.path.lower().endswith(self.IMAGE_EXTENSIONS) or glob.has_magic(self.path):
+            paths = sorted(glob.glob(self.path))
+        else:
+            paths = None
+
+        if paths is not None:
+            if not paths:
+                raise FileNotFoundError(f"No images found for replay source {self.path}")
+            self.images = [self.prepare(self.load_image(path)) for path in paths]
+            logger.info(f"Replaying {len(self.images)} images from {self.path} at {self.fps} fps")
+        else:
+            self.capture = cv2.VideoCapture(self.path)
+            if not self.capture.isOpened():
+                raise FileNotFoundError(f"Cannot open replay video {self.path}")
+            logger.info(f"Replaying {self.path} at {self.fps} fps")
+
+    def load_image(self, path):
+        import cv2
+
+        # imread returns None rather than raising for unreadable or non-image files
+        image = cv2.imread(path)
+        if image is None:
+            raise ValueError(f"Cannot decode replay image {path}")
+        return image
+
+    def prepare(self, bgr_frame):
+        import cv2
+
+        if bgr_frame.shape[1::-1] != tuple(self.size):
+            bgr_frame = cv2.resize(bgr_frame, self.size, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(bgr_frame, cv2.COLOR_BGR2RGB)
+
+    def render(self, index):
+        if self.images is not None:
+            # The pipeline writes into captured frames, so hand out copies
+            return self.images[index % len(self.images)].copy()
+        ok, frame = self.capture.read()
+        if not ok:
+            self.capture.set(1, 0)  # cv2.CAP_PROP_POS_FRAMES
+            ok, frame = self.capture.read()
+            if not ok:
+                raise RuntimeError(f"Replay video {self.path} has no frames")
+        return self.prepare(frame)
+
+    def stop(self):
+        if self.capture:
+            self.capture.release()
+
+
+class SyntheticSource(PacedFrameSource):
+    """
+    Deterministic moving test pattern: a scrolling colour gradient with a
+    bouncing block, so every frame differs and encoders see realistic work.
+    """
+
+    def start(self):
+        import numpy as np
+
+        super().start()
+        width, height = self.size
+        x = np.linspace(0, 255, width, dtype=np.float32)
+        y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+        self.background = np.empty((height, width * 2, 3), dtype=np.uint8)
+        gradient = np.stack(
+            [np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width)),
+             np.broadcast_to(255 - x, (height, width))],
+            axis=-1,
+        ).astype(np.uint8)
+        # Two copies side by side so scrolling is a plain slice
+        self.background[:, :width] = gradient
+        self.background[:, width:] = gradient
+        logger.info(f"Generating synthetic {width}x{height} frames at {self.fps} fps")
+
+    def render(self, index):
+        width, height = self.size
+        offset = (index * 4) % width
+        frame = self.background[:, offset:offset + width].copy()
+        block = max(8, height // 6)
+        period = 2 * (width - block)
+        position = (index * 8) % period
+        left = position if position < width - block else period - position
+        top = (height - block) // 2
+        frame[top:top + block, left:left + block] = (255, 255, 255)
+        return frame
+
+
+def create_frame_source(spec, size=(640, 480), fps=30, hires_size=None):
+    """
+    Build a source from a command-line spec: `camera`, `synthetic` or
+    `replay:<path>`. `hires_size` only applies to the camera.
+    """
+    if spec == "camera":
+        return Picamera2Source(size, fps, hires_size)
+    if spec == "synthetic":
+        return SyntheticSource(size, fps)
+    if spec.startswith("replay:"):
+        return ReplaySource(spec.split(":", 1)[1], size, fps)
+    raise ValueError(f"Unknown video source: {spec}")
@@ -0,0 +1,203 @@
+"""
+JPEG encoder backends for VideoStreamHandler.
+
+Each backend takes frames as sources deliver them, uint8 RGB arrays with an
+optional fourth padding channel, and returns JPEG bytes with 4:2:0 chroma
+subsampling, so they are interchangeable mid-stream:
+
+* `opencv`: cv2.imencode, after swapping the frame to BGR in place.
+* `pillow`: Pillow, as old/server4.py used, straight from RGB.
+* `simplejpeg` and `turbojpeg`: libjpeg-turbo through the simplejpeg or
+  PyTurboJPEG bindings, straight from RGB or RGBX without a copy.
+* `yuv`: libjpeg-turbo fed I420 planes, skipping its colour conversion and
+  chroma downsampling. RGB frames are converted with OpenCV first; frames a
+  source captured as YUV420 (`FrameSource.yuv_frame`) skip that too. Both
+  are BT.601 video range, which is stretched to the full range JPEG uses.
+
+Which is fastest depends on the CPU and the libraries' builds, so
+`benchmark()` times every available backend on a real frame and
+VideoStreamHandler picks the fastest at startup. Libraries are imported
+when a backend loads; missing ones just make it unavailable.
+"""
+import io
+import time
+
+BENCHMARK_ROUNDS = 10
+
+
+class JpegEncoder:
+    """Interface for anything that turns a captured frame into a JPEG."""
+
+    name = None
+    # Whether `prepare` writes into the frame it is given, so callers must keep their own copy
+    modifies_frame = False
+    # Whether `encode` also accepts a source's I420 array in place of `prepare`'s result
+    accepts_yuv420 = False
+
+    def load(self):
+        """Import the backend's library, raising ImportError or OSError if it is unavailable."""
+
+    def prepare(self, frame):
+        """The frame in the form `encode` takes; the cheap part, timed as conversion."""
+        return frame
+
+    def encode(self, image, quality):
+        """JPEG bytes for a prepared image, or None if the library reports a failure."""
+        raise NotImplementedError
+
+
+class OpenCVEncoder(JpegEncoder):
+    name = "opencv"
+    modifies_frame = True
+
+    def load(self):
+        import cv2
+        self.cv2 = cv2
+
+    def prepare(self, frame):
+        frame[:, :, [0, 2]] = frame[:, :, [2, 0]]
+        return frame
+
+    def encode(self, image, quality):
+        ok, jpeg = self.cv2.imencode(".jpg", image, [self.cv2.IMWRITE_JPEG_QUALITY, quality])
+        return jpeg.tobytes() if ok else None
+
+
+class PillowEncoder(JpegEncoder):
+    name = "pillow"
+
+    def load(self):
+        from PIL import Image
+        self.Image = Image
+
+    def prepare(self, frame):
+        height, width = frame.shape[:2]
+        if frame.shape[2] == 4 and frame.flags.c_contiguous:
+            # Read past the padding channel rather than copying it away
+            return self.Image.frombuffer("RGB", (width, height), frame, "raw", "RGBX", 0, 1)
+        return self.Image.fromarray(frame[:, :, :3])
+
+    def encode(self, image, quality):
+        output = io.BytesIO()
+        image.save(output, "JPEG", quality=quality, subsampling=2)
+        return output.getvalue()
+
+
+class SimpleJpegEncoder(JpegEncoder):
+    name = "simplejpeg"
+
+    def load(self):
+        import numpy as np
+        import simplejpeg
+        self.np = np
+        self.simplejpeg = simplejpeg
+
+    def prepare(self, frame):
+        return self.np.ascontiguousarray(frame)
+
+    def encode(self, image, quality):
+        colorspace = "RGBX" if image.shape[2] == 4 else "RGB"
+        return self.simplejpeg.encode_jpeg(image, quality, colorspace, colorsubsampling="420")
+
+
+class TurboJpegEncoder(JpegEncoder):
+    name = "turbojpeg"
+
+    def load(self):
+        import numpy as np
+        import turbojpeg
+        self.np = np
+        self.turbojpeg = turbojpeg
+        # Finds and loads libturbojpeg, raising OSError or RuntimeError when it isn't installed
+        try:
+            self.encoder = turbojpeg.TurboJPEG()
+        except RuntimeError as e:
+            raise OSError(str(e)) from None
+
+    def prepare(self, frame):
+        return self.np.ascontiguousarray(frame)
+
+    def encode(self, image, quality):
+        pixel_format = self.turbojpeg.TJPF_RGBX if image.shape[2] == 4 else self.turbojpeg.TJPF_RGB
+        return self.encoder.encode(image, quality, pixel_format, self.turbojpeg.TJSAMP_420)
+
+
+class YuvPlanesEncoder(JpegEncoder):
+    name = "yuv"
+    accepts_yuv420 = True
+
+    def load(self):
+        import cv2
+        import numpy as np
+        import simplejpeg
+        self.cv2 = cv2
+        self.simplejpeg = simplejpeg
+        levels = np.arange(256, dtype=np.float32)
+        self.luma_range = np.clip(np.rint((levels - 16) * 255 / 219), 0, 255).astype(np.uint8)
+        self.chroma_range = np.clip(np.rint((levels - 128) * 255 / 224 + 128), 0, 255).astype(np.uint8)
+
+    def prepare(self, frame):
+        height, width = frame.shape[:2]
+        # I420 needs even dimensions; every size the pipeline produces already has them
+        frame = frame[:height // 2 * 2, :width // 2 * 2]
+        code = self.cv2.COLOR_RGBA2YUV_I420 if frame.shape[2] == 4 else self.cv2.COLOR_RGB2YUV_I420
+        return self.cv2.cvtColor(frame, code)
+
+    def encode(self, image, quality):
+        # Y rows, then the quarter-size U and V planes, each stored as rows of half-width pairs
+        height = image.shape[0] * 2 // 3
+        width = image.shape[1]
+        chroma_rows = height // 4
+        luma = self.cv2.LUT(image[:height], self.luma_range)
+        chroma = self.cv2.LUT(image[height:], self.chroma_range)
+        u = chroma[:chroma_rows].reshape(height // 2, width // 2)
+        v = chroma[chroma_rows:].reshape(height // 2, width // 2)
+        return self.simplejpeg.encode_jpeg_yuv_planes(luma, u, v, quality)
+
+
+ENCODERS = {
+    encoder.name: encoder
+    for encoder in (OpenCVEncoder, PillowEncoder, SimpleJpegEncoder, TurboJpegEncoder, YuvPlanesEncoder)
+}
+
+
+def create_jpeg_encoder(name):
+    """Load the backend called `name`, raising ValueError if it is unknown or its library is missing."""
+    if name not in ENCODERS:
+        raise ValueError(f"Unknown JPEG encoder {name!r}; expected auto or one of {', '.join(ENCODERS)}")
+    encoder = ENCODERS[name]()
+    try:
+        encoder.load()
+    except (ImportError, OSError) as e:
+        raise ValueError(f"JPEG encoder {name!r} is unavailable: {e}") from None
+    return encoder
+
+
+def benchmark(frame, quality, rounds=BENCHMARK_ROUNDS):
+    """
+    Time every available backend encoding `frame`, which is left untouched.
+    Returns `{name: {"seconds": per-frame time, "bytes": size}}`, with
+    `{"error": reason}` for unavailable backends, and the fastest encoder.
+    """
+    results = {}
+    fastest = None
+    for name in ENCODERS:
+        try:
+            encoder = create_jpeg_encoder(name)
+            # One untimed round warms caches and lazily initialised library state
+            jpeg = encoder.encode(encoder.prepare(frame.copy()), quality)
+            if jpeg is None:
+                raise RuntimeError("Encoding failed")
+            elapsed = 0.0
+            for _ in range(rounds):
+                image = frame.copy()
+                start = time.perf_counter()
+                encoder.encode(encoder.prepare(image), quality)
+                elapsed += time.perf_counter() - start
+        except Exception as e:
+            results[name] = {"error": str(e)}
+            continue
+        results[name] = {"seconds": elapsed / rounds, "bytes": len(jpeg)}
+        if fastest is None or results[name]["seconds"] < results[fastest.name]["seconds"]:
+            fastest = encoder
+    return results, fastest
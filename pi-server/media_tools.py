@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import os
+import shutil
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+
+def ffmpeg_exe():
+    """Locate ffmpeg, preferring the binary imageio already ships with."""
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except (ImportError, RuntimeError):
+        path = shutil.which("ffmpeg")
+        if path is None:
+            raise RuntimeError("ffmpeg not found; install imageio-ffmpeg or ffmpeg")
+        return path
+
+
+def low_priority_prefix():
+    """Command prefix that runs a child process at idle CPU and I/O priority."""
+    prefix = []
+    if shutil.which("ionice"):
+        prefix += ["ionice", "-c", "3"]
+    if shutil.which("nice"):
+        prefix += ["nice", "-n", "19"]
+    return prefix
+
+
+def run_ffmpeg(args, low_priority=False, timeout=None):
+    """Run ffmpeg with `args`, raising RuntimeError with its stderr on failure."""
+    command = [ffmpeg_exe(), "-hide_banner", "-loglevel", "error", "-y", *args]
+    if low_priority:
+        command = low_priority_prefix() + command
+    logger.debug(f"Running {' '.join(command)}")
+    result = subprocess.run(command, capture_output=True, timeout=timeout)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed ({result.returncode}): {result.stderr.decode(errors='replace').strip()}")
+
+
+async def stream_ffmpeg(args, chunks, low_priority=False):
+    """
+    Pipe `chunks` (an async iterable of bytes) into ffmpeg's stdin and yield
+    its stdout as it is produced. Raises RuntimeError if ffmpeg fails.
+    """
+    command = [ffmpeg_exe(), "-hide_banner", "-loglevel", "error", *args]
+    if low_priority:
+        command = low_priority_prefix() + command
+    logger.debug(f"Running {' '.join(command)}")
+    process = await asyncio.create_subprocess_exec(
+        *command, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+    )
+
+    async def feed():
+        try:
+            async for chunk in chunks:
+                process.stdin.write(chunk)
+                await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            process.stdin.close()
+
+    feeder = asyncio.create_task(feed())
+    try:
+        while output := await process.stdout.read(64 * 1024):
+            yield output
+        await feeder
+        stderr = await process.stderr.read()
+        if await process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed ({process.returncode}): {stderr.decode(errors='replace').strip()}")
+    finally:
+        feeder.cancel()
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+
+
+def temp_path_for(output_path):
+    """Hidden sibling path that recordings reconcile ignores while it is being written."""
+    directory, filename = os.path.split(output_path)
+    return os.path.join(directory, f".{filename}.tmp.mp4")
+
+
+def remux_atomically(input_args, output_path):
+    """Remux with stream copy into a temporary file, then rename it over `output_path`."""
+    temp_path = temp_path_for(output_path)
+    try:
+        run_ffmpeg([*input_args, "-c", "copy", "-movflags", "+faststart", "-f", "mp4", temp_path])
+        os.replace(temp_path, output_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def trim_clip(input_path, output_path, start, end):
+    """
+    Cut `[start, end]` seconds out of a clip without re-encoding. Seeking
+    before the input snaps the cut to the keyframe at or before `start`.
+    """
+    remux_atomically(
+        ["-ss", f"{start:.3f}", "-i", input_path, "-t", f"{end - start:.3f}", "-avoid_negative_ts", "make_zero"],
+        output_path,
+    )
+
+
+def concat_clips(input_paths, output_path):
+    """Join clips with identical codec parameters end to end without re-encoding."""
+    list_path = f"{temp_path_for(output_path)}.txt"
+    with open(list_path, "w") as list_file:
+        for path in input_paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            list_file.write(f"file '{escaped}'\n")
+    try:
+        remux_atomically(["-f", "concat", "-safe", "0", "-i", list_path], output_path)
+    finally:
+        os.remove(list_path)
@@ -0,0 +1,253 @@
+"""
+Minimal Prometheus text-format metrics for the streaming pipeline.
+
+Metrics are cheap enough for the 30 fps hot path: label children are
+created once and reused, histogram buckets are preallocated, and recording
+a sample only bumps a few numbers under an uncontended lock. Hot loops
+should look up their labelled child once and keep the reference.
+"""
+import bisect
+import threading
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.02, 0.033, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in pairs) + "}"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class CounterChild:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self, name, labels):
+        yield f"{name}{labels} {format_value(self.value)}"
+
+
+class GaugeChild:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set_function(self, function):
+        """Compute the value at scrape time instead of tracking it, e.g. a queue length."""
+        self.function = function
+
+    def samples(self, name, labels):
+        value = self.function() if self.function else self.value
+        yield f"{name}{labels} {format_value(value)}"
+
+
+class HistogramChild:
+    def __init__(self, buckets):
+        self.lock = threading.Lock()
+        self.bounds = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def samples(self, name, labels, labelnames=(), labelvalues=()):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float("inf"),), counts):
+            cumulative += count
+            bucket_labels = format_labels(labelnames, labelvalues, [("le", format_value(bound))])
+            yield f"{name}_bucket{bucket_labels} {cumulative}"
+        yield f"{name}_sum{labels} {format_value(total)}"
+        yield f"{name}_count{labels} {cumulative}"
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        self.lock = threading.Lock()
+        if not self.labelnames:
+            self.children[()] = self.new_child()
+        (registry or REGISTRY).register(self)
+
+    def new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *labelvalues):
+        """Return the child for these label values, creating it on first use."""
+        key = tuple(str(value) for value in labelvalues)
+        child = self.children.get(key)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(key, self.new_child())
+        return child
+
+    def remove(self, *labelvalues):
+        """Forget a child, e.g. the per-client series of a disconnected client."""
+        with self.lock:
+            self.children.pop(tuple(str(value) for value in labelvalues), None)
+
+    def __getattr__(self, attribute):
+        # Unlabelled metrics forward inc/set/observe to their only child
+        if attribute in ("inc", "dec", "set", "set_function", "observe") and not self.labelnames:
+            return getattr(self.children[()], attribute)
+        raise AttributeError(attribute)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for labelvalues, child in list(self.children.items()):
+            labels = format_labels(self.labelnames, labelvalues)
+            if isinstance(child, HistogramChild):
+                yield from child.samples(self.name, labels, self.labelnames, labelvalues)
+            else:
+                yield from child.samples(self.name, labels)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def new_child(self):
+        return CounterChild()
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def new_child(self):
+        return GaugeChild()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def new_child(self):
+        return HistogramChild(self.buckets)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                lines.append(f"# {metric.name} failed to render: {e}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Video pipeline
+VIDEO_CAPTURE_SECONDS = Histogram("pi_video_capture_seconds", "Time to capture one camera frame")
+VIDEO_CONVERT_SECONDS = Histogram("pi_video_convert_seconds", "Time to convert one frame's colour channels")
+VIDEO_ENCODE_SECONDS = Histogram("pi_video_encode_seconds", "Time to JPEG-encode one frame", ["backend"])
+VIDEO_JPEG_ENCODER = Gauge("pi_video_jpeg_encoder", "JPEG encoder backend in use, as a label on a constant 1", ["backend"])
+VIDEO_ENCODER_BENCHMARK_SECONDS = Gauge(
+    "pi_video_encoder_benchmark_seconds", "Per-frame time of each JPEG encoder backend in the last benchmark", ["backend"]
+)
+VIDEO_FRAMES_DROPPED = Counter("pi_video_frames_dropped_total", "Frame slots missed because the pipeline fell behind", ["stream"])
+VIDEO_BUFFER_FRAMES = Gauge("pi_video_buffer_frames", "Frames held in the pre-roll buffer")
+VIDEO_ROI_FEEDS = Gauge("pi_video_roi_feeds", "Distinct region-of-interest feeds being cropped and encoded")
+VIDEO_TIER_VIEWERS = Gauge("pi_video_tier_viewers", "Viewers of each quality tier of the full view", ["tier"])
+VIDEO_CAPTURE_FPS = Gauge("pi_video_capture_fps", "Current capture rate, lower while nobody is watching")
+VIDEO_RECONFIGURE_GAP_SECONDS = Histogram(
+    "pi_video_reconfigure_gap_seconds", "Time between the last frame before a live reconfiguration and the first after",
+    buckets=(0.033, 0.05, 0.1, 0.25, 0.5, 1, 2, 5),
+)
+CAPTURE_MODE_SECONDS = Counter("pi_capture_mode_seconds_total", "Time the capture service spent in each mode", ["mode"])
+CAPTURE_CPU_SECONDS = Counter("pi_capture_cpu_seconds_total", "Process CPU time used while in each capture mode", ["mode"])
+VIDEO_TILE_MESSAGES = Counter("pi_video_tile_messages_total", "Tile-mode messages encoded, by kind", ["kind"])
+VIDEO_TILES_SENT = Counter("pi_video_tiles_sent_total", "Changed tiles encoded into tile-mode updates")
+SNAPSHOT_REQUESTS = Counter("pi_snapshot_requests_total", "GET /snapshot requests by how they were served", ["result"])
+
+# Timelapse
+TIMELAPSE_FRAMES = Counter("pi_timelapse_frames_total", "Stills appended to the timelapse")
+TIMELAPSE_BYTES = Gauge("pi_timelapse_bytes", "Disk used by timelapse chunks and their indexes")
+TIMELAPSE_RENDER_FRAMES = Counter("pi_timelapse_render_frames_total", "Timelapse stills read back for rendering", ["format"])
+TIMELAPSE_RENDER_SECONDS = Histogram(
+    "pi_timelapse_render_seconds", "Wall time of one timelapse render",
+    ["format"], buckets=(0.5, 1, 2, 5, 10, 30, 60, 120, 300),
+)
+
+# Continuous recording
+DVR_FRAMES = Counter("pi_dvr_frames_total", "Frames offered to the DVR by outcome", ["result"])
+DVR_BYTES = Gauge("pi_dvr_bytes", "Disk used by DVR segments, including preallocated space")
+
+# Relay nodes
+RELAY_UPSTREAM_MESSAGES = Counter("pi_relay_upstream_messages_total", "Messages received from upstream", ["stream"])
+RELAY_UPSTREAM_CONNECTS = Counter("pi_relay_upstream_connects_total", "Upstream connections opened", ["stream"])
+RELAY_MESSAGES_DROPPED = Counter(
+    "pi_relay_messages_dropped_total", "Frames or chunks skipped for viewers that fell behind", ["stream"]
+)
+
+# Sending, per stream and per client
+SEND_SECONDS = Histogram("pi_send_seconds", "Time to hand one message to a client socket", ["stream"])
+BYTES_SENT = Counter("pi_bytes_sent_total", "Bytes sent to all clients of a stream", ["stream"])
+CLIENT_BYTES_SENT = Counter("pi_client_bytes_sent_total", "Bytes sent to each connected client", ["stream", "client"])
+CONNECTED_CLIENTS = Gauge("pi_connected_clients", "Clients currently connected", ["stream"])
+
+# Audio
+AUDIO_OVERRUNS = Counter("pi_audio_input_overruns_total", "Microphone capture overflows")
+AUDIO_UNDERRUNS = Counter("pi_audio_output_underruns_total", "Speaker callbacks that had to play silence")
+AUDIO_CHUNKS_DROPPED = Counter("pi_audio_chunks_dropped_total", "Microphone chunks skipped for listeners that fell behind")
+AUDIO_QUEUE_DEPTH = Gauge("pi_audio_output_queue_depth", "Chunks waiting to be played on the speaker")
+AUDIO_QUEUE_OVERFLOWS = Counter("pi_audio_output_queue_overflows_total", "Times the speaker queue was flushed because it was full")
+AUDIO_PLAYOUT_DELAY_SECONDS = Histogram(
+    "pi_audio_playout_delay_seconds", "Time a received speaker chunk waits before being played",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0),
+)
+
+# Clip saving
+CLIP_SAVE_SECONDS = Histogram(
+    "pi_clip_save_seconds", "Time to encode and write one clip",
+    buckets=(0.5, 1, 2, 5, 10, 20, 30, 60, 120),
+)
+CLIP_QUEUE_DEPTH = Gauge("pi_clip_queue_depth", "Clip export jobs waiting for a worker")
+CLIP_JOBS = Counter("pi_clip_jobs_total", "Clip export jobs by outcome", ["status"])
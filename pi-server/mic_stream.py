@@ -1,61 +1,55 @@
 import asyncio
-from websockets.server import serve
 import logging
-import pyaudio
-import numpy as np
 import time
 import queue
+import metrics
+from audio_backends import PortAudioBackend, CONTINUE
 
 logger = logging.getLogger(__name__)
 
 class MicStreamHandler:
-    def __init__(self):
+    def __init__(self, backend=None):
         self.clients = set()
         
         # Audio settings
         self.sample_rate = 44100
         self.channels = 1
         self.chunk_size = 4096  # Increased buffer size
-        self.format = pyaudio.paInt16
         
-        # Audio buffer
+        # Audio buffer of (received at, chunk) pairs
         self.buffer = queue.Queue(maxsize=10)  # Limit buffer size
+        self.underruns = metrics.AUDIO_UNDERRUNS.labels()
+        self.queue_overflows = metrics.AUDIO_QUEUE_OVERFLOWS.labels()
+        metrics.AUDIO_QUEUE_DEPTH.set_function(self.buffer.qsize)
+        self.playout_delay = metrics.AUDIO_PLAYOUT_DELAY_SECONDS.labels()
+        metrics.CONNECTED_CLIENTS.labels("mic").set_function(lambda: len(self.clients))
         
-        logger.info("Initializing PyAudio for speaker output...")
-        self.p = pyaudio.PyAudio()
+        # Any audio backend works; the null sink needs no sound card
+        self.backend = backend or PortAudioBackend()
         self.stream = None
-        
-        # Log available audio devices
-        info = self.p.get_host_api_info_by_index(0)
-        numdevices = info.get('deviceCount')
-        for i in range(0, numdevices):
-            device_info = self.p.get_device_info_by_host_api_device_index(0, i)
-            logger.info(f"Audio Device {i}: {device_info.get('name')}")
-            if device_info.get('maxOutputChannels') > 0:
-                logger.info(f"  Output Device {i}: {device_info.get('name')}")
+
+    def start(self):
+        """Initialise the audio backend for speaker output. Blocks."""
+        self.backend.start()
 
     def start_audio_output(self):
         try:
-            self.stream = self.p.open(
-                format=self.format,
-                channels=self.channels,
-                rate=self.sample_rate,
-                output=True,
-                frames_per_buffer=self.chunk_size,
-                stream_callback=self._audio_callback
+            self.stream = self.backend.open_output(
+                self.sample_rate, self.channels, self.chunk_size, self._audio_callback
             )
-            self.stream.start_stream()
-            logger.info(f"Started audio output stream: rate={self.sample_rate}Hz, channels={self.channels}, format={self.format}")
+            logger.info(f"Started audio output stream: rate={self.sample_rate}Hz, channels={self.channels}, 16-bit")
         except Exception as e:
             logger.error(f"Failed to start audio output stream: {e}")
             raise
 
     def _audio_callback(self, in_data, frame_count, time_info, status):
         try:
-            data = self.buffer.get_nowait()
-            return (data, pyaudio.paContinue)
+            received_at, data = self.buffer.get_nowait()
+            self.playout_delay.observe(time.monotonic() - received_at)
+            return (data, CONTINUE)
         except queue.Empty:
-            return (b'\x00' * self.chunk_size * 2, pyaudio.paContinue)
+            self.underruns.inc()
+            return (b'\x00' * self.chunk_size * 2, CONTINUE)
 
     def clear_buffer(self):
         while not self.buffer.empty():
@@ -67,6 +61,7 @@ class MicStreamHandler:
     async def handle_client(self, websocket):
         client_id = id(websocket)
         try:
+            await websocket.accept()
             self.clients.add(websocket)
             logger.info(f"New microphone client connected [ID: {client_id}]. Total clients: {len(self.clients)}")
             
@@ -75,7 +70,10 @@ class MicStreamHandler:
             else:
                 self.clear_buffer()
             
-            async for message in websocket:
+            start_time = time.time()
+            frames_received = 0
+            
+            async for data in websocket.iter_bytes():
                 try:
                     frames_received += 1
                     
@@ -84,11 +82,13 @@ class MicStreamHandler:
                         rate = frames_received / elapsed
                         logger.info(f"Receiving from client [ID: {client_id}] at {rate:.2f} fps")
                     
+                    item = (time.monotonic(), data)
                     try:
-                        self.buffer.put_nowait(data)
+                        self.buffer.put_nowait(item)
                     except queue.Full:
+                        self.queue_overflows.inc()
                         self.clear_buffer()  # Clear buffer if it gets full
-                        self.buffer.put_nowait(data)
+                        self.buffer.put_nowait(item)
                     
                 except Exception as e:
                     logger.error(f"Error processing audio from client [ID: {client_id}]: {e}")
@@ -105,22 +105,18 @@ class MicStreamHandler:
             logger.info(f"Microphone client disconnected [ID: {client_id}]. Remaining clients: {len(self.clients)}")
             
             if not self.clients:
-                self.clear_buffer()
-                self.cleanup()
+                # Only close the stream; the backend must survive for the next client
+                self.stop_audio_output()
                 logger.info("All clients disconnected, cleaned up audio resources")
 
-    async def start_server(self):
-        async with serve(self.handle_client, "0.0.0.0", 5003):
-            logger.info("Microphone server started on ws://0.0.0.0:5003")
-            await asyncio.Future()
-
-    def cleanup(self):
+    def stop_audio_output(self):
         self.clear_buffer()
         if self.stream:
             self.stream.stop_stream()
             self.stream.close()
             self.stream = None
             logger.info("Audio output stream closed")
-        if hasattr(self, 'p'):
-            self.p.terminate()
-            logger.info("PyAudio instance terminated")
\ No newline at end of file
+
+    def cleanup(self):
+        self.stop_audio_output()
+        self.backend.terminate()
\ No newline at end of file
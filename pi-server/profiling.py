@@ -0,0 +1,244 @@
+"""
+On-demand diagnostics for a running server: a sampling profiler, tracemalloc
+snapshots and hot-path spans exported as Chrome trace events.
+
+Everything is off until started through the admin endpoints. While the
+tracer is disabled, `TRACER.span()` returns a shared no-op context manager,
+so leaving spans in the 30 fps path costs one attribute check per call.
+"""
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+MAX_DURATION = 300
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler that samples every thread's stack from a
+    background thread. Unlike cProfile it adds no per-call overhead to the
+    profiled code, so it is safe to run under production load.
+    """
+
+    def __init__(self):
+        self.thread = None
+        self.stopping = threading.Event()
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.started = None
+        self.finished = None
+        self.interval = None
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, seconds, interval=0.005):
+        if self.running:
+            raise RuntimeError("Profiler is already running")
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.interval = interval
+        self.started = time.time()
+        self.finished = None
+        self.stopping.clear()
+        self.thread = threading.Thread(
+            target=self.run, args=(min(seconds, MAX_DURATION),), name="sampling-profiler", daemon=True
+        )
+        self.thread.start()
+        logger.info(f"Sampling profiler started for {seconds}s at {1 / interval:.0f} Hz")
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread:
+            self.thread.join()
+
+    def run(self, seconds):
+        own_id = threading.get_ident()
+        names = {}
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline and not self.stopping.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                if thread_id not in names:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+        self.finished = time.time()
+        logger.info(f"Sampling profiler finished with {self.samples} samples")
+
+    def collapsed(self):
+        """Stacks in the collapsed format read by flamegraph.pl and speedscope."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self, limit=25):
+        leaves = collections.Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        total = sum(self.stacks.values()) or 1
+        return {
+            "running": self.running,
+            "started": self.started,
+            "finished": self.finished,
+            "interval": self.interval,
+            "samples": self.samples,
+            "top_functions": [
+                {"function": function, "samples": count, "percent": round(100 * count / total, 2)}
+                for function, count in leaves.most_common(limit)
+            ],
+        }
+
+
+class MemorySnapshots:
+    """
+    Numbered tracemalloc snapshots that can be diffed against each other.
+    Each one holds every traced allocation, so only the newest `keep` are
+    kept.
+    """
+
+    def __init__(self, frames=10, keep=4):
+        self.frames = frames
+        self.keep = keep
+        self.snapshots = {}  # Insertion order is oldest first
+        self.next_id = 1
+        self.started_tracing = False
+
+    def take(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self.started_tracing = True
+            logger.info("tracemalloc started")
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        snapshot_id = self.next_id
+        self.next_id += 1
+        self.snapshots[snapshot_id] = snapshot
+        while len(self.snapshots) > self.keep:
+            del self.snapshots[next(iter(self.snapshots))]
+        current, peak = tracemalloc.get_traced_memory()
+        return {"snapshot_id": snapshot_id, "traced_bytes": current, "peak_bytes": peak}
+
+    def diff(self, base_id, current_id, limit=25):
+        try:
+            base, current = self.snapshots[base_id], self.snapshots[current_id]
+        except KeyError as e:
+            raise KeyError(f"Unknown snapshot {e.args[0]}; only the newest {self.keep} are kept") from e
+        stats = current.compare_to(base, "lineno")
+        return [
+            {
+                "location": str(stat.traceback),
+                "size_diff": stat.size_diff,
+                "size": stat.size,
+                "count_diff": stat.count_diff,
+                "count": stat.count,
+            }
+            for stat in stats[:limit]
+        ]
+
+    def stop(self):
+        self.snapshots.clear()
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+            logger.info("tracemalloc stopped")
+
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    __slots__ = ("tracer", "name", "start")
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer.record(self.name, self.start, time.perf_counter())
+        return False
+
+
+class Tracer:
+    """Records named spans as Chrome trace events for Perfetto or chrome://tracing."""
+
+    def __init__(self, max_events=200_000):
+        self.enabled = False
+        self.events = collections.deque(maxlen=max_events)
+        self.origin = time.perf_counter()
+        self.stop_timer = None
+
+    def span(self, name):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name)
+
+    def record(self, name, start, end):
+        # deque.append is atomic, so spans can be recorded from worker threads
+        self.events.append((name, start, end, threading.get_native_id()))
+
+    def start(self, seconds):
+        self.events.clear()
+        self.origin = time.perf_counter()
+        self.enabled = True
+        if self.stop_timer:
+            self.stop_timer.cancel()
+        self.stop_timer = threading.Timer(min(seconds, MAX_DURATION), self.stop)
+        self.stop_timer.daemon = True
+        self.stop_timer.start()
+        logger.info(f"Tracing hot-path spans for {seconds}s")
+
+    def stop(self):
+        self.enabled = False
+        if self.stop_timer:
+            self.stop_timer.cancel()
+            self.stop_timer = None
+
+    def chrome_trace(self):
+        pid = os.getpid()
+        return {
+            "traceEvents": [
+                {
+                    "name": name,
+                    "cat": "pipeline",
+                    "ph": "X",
+                    "ts": (start - self.origin) * 1e6,
+                    "dur": (end - start) * 1e6,
+                    "pid": pid,
+                    "tid": thread_id,
+                }
+                for name, start, end, thread_id in list(self.events)
+            ],
+            "displayTimeUnit": "ms",
+        }
+
+
+PROFILER = SamplingProfiler()
+MEMORY = MemorySnapshots()
+TRACER = Tracer()
@@ -0,0 +1,65 @@
+import asyncio
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class RecordingEventStream:
+    """
+    Fans out recordings index changes to Server-Sent Events subscribers.
+
+    Clips are saved and deleted from the HTTP threads, so the index
+    notifies us from whichever thread made the change and we wake each
+    subscriber on its own event loop.
+    """
+
+    def __init__(self, recordings_index, keepalive_interval=15):
+        self.recordings_index = recordings_index
+        self.keepalive_interval = keepalive_interval
+        self.subscribers = set()
+        recordings_index.add_listener(self.notify)
+
+    def notify(self):
+        for loop, wakeup in list(self.subscribers):
+            loop.call_soon_threadsafe(wakeup.set)
+
+    @staticmethod
+    def format_event(event_id, event_type, data):
+        return f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+    async def subscribe(self, last_event_id):
+        """
+        Yield SSE messages for every change after `last_event_id`. If the
+        client is too far behind to replay, a `reset` event tells it to
+        reload the full listing before continuing.
+        """
+        subscriber = (asyncio.get_running_loop(), asyncio.Event())
+        _, wakeup = subscriber
+        self.subscribers.add(subscriber)
+        logger.info(f"Recording events client connected. Total clients: {len(self.subscribers)}")
+        try:
+            # Tell EventSource how long to wait before reconnecting
+            yield "retry: 3000\n\n"
+            while True:
+                # Clear before reading so a change committed meanwhile still wakes us
+                wakeup.clear()
+                # SQLite blocks, and this loop also serves the live video and audio
+                events = await asyncio.to_thread(self.recordings_index.events_since, last_event_id)
+                if events is None:
+                    last_event_id = await asyncio.to_thread(lambda: self.recordings_index.generation)
+                    yield self.format_event(last_event_id, "reset", {"generation": last_event_id})
+                    continue
+                for event in events:
+                    last_event_id = event["id"]
+                    data = {"filename": event["filename"]}
+                    if event["recording"]:
+                        data["recording"] = event["recording"]
+                    yield self.format_event(event["id"], event["type"], data)
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout=self.keepalive_interval)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+        finally:
+            self.subscribers.discard(subscriber)
+            logger.info(f"Recording events client disconnected. Remaining clients: {len(self.subscribers)}")
@@ -0,0 +1,365 @@
+import base64
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+NOTIFICATION_PATTERN = re.compile(r"^notification_(.+)\.mp4$")
+
+
+def probe_video(path):
+    """Read duration, frame count and resolution from an MP4 header."""
+    import cv2  # Deferred: importing OpenCV takes seconds on a Pi
+
+    capture = cv2.VideoCapture(path)
+    try:
+        if not capture.isOpened():
+            return {}
+        frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT)) or None
+        fps = capture.get(cv2.CAP_PROP_FPS) or 0
+        return {
+            "frame_count": frame_count,
+            "duration": frame_count / fps if frame_count and fps else None,
+            "width": int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)) or None,
+            "height": int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)) or None,
+        }
+    finally:
+        capture.release()
+
+
+def event_id_from_filename(filename):
+    match = NOTIFICATION_PATTERN.match(filename)
+    return match.group(1) if match else None
+
+
+def encode_cursor(created, filename):
+    raw = json.dumps([created, filename]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        created, filename = json.loads(base64.urlsafe_b64decode(padded))
+        return float(created), str(filename)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+class RecordingsIndex:
+    """
+    SQLite index of the MP4 clips in the videos directory.
+
+    Rows are written whenever a clip is saved or deleted so that listing
+    recordings never has to walk the directory. Every change is also
+    appended to an event log; the ID of the latest event is the generation
+    that serves as the ETag for `/recordings` and lets clients resume a
+    change feed from where they left off.
+    """
+
+    EVENT_RETENTION = 1000
+
+    COLUMNS = ("filename", "size", "created", "duration", "frame_count", "width", "height", "event_id", "tier")
+
+    def __init__(self, video_dir="./videos", db_path=None):
+        self.video_dir = video_dir
+        # Next to the videos directory by default, so it follows the clips rather than the cwd
+        self.db_path = db_path or os.path.join(os.path.dirname(os.path.abspath(video_dir)), "recordings.db")
+        self.listeners = []
+        # Reconcile and clip saves run in worker threads, so share one connection behind a lock
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS recordings (
+                    filename TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    mtime REAL NOT NULL,
+                    duration REAL,
+                    frame_count INTEGER,
+                    width INTEGER,
+                    height INTEGER,
+                    event_id TEXT,
+                    tier TEXT NOT NULL DEFAULT 'full'
+                )
+            """)
+            self._ensure_column("recordings", "tier", "TEXT NOT NULL DEFAULT 'full'")
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS recordings_created ON recordings (created, filename)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS recordings_event ON recordings (event_id)")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+            )
+            self.conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', 0)")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS recording_events (
+                    id INTEGER PRIMARY KEY,
+                    type TEXT NOT NULL,
+                    filename TEXT NOT NULL,
+                    recording TEXT,
+                    created REAL NOT NULL
+                )
+            """)
+
+    def _ensure_column(self, table, column, definition):
+        """Add a column introduced after the database was first created."""
+        columns = {row["name"] for row in self.conn.execute(f"PRAGMA table_info({table})")}
+        if column not in columns:
+            self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+    def add_listener(self, callback):
+        """Register a callback run (on the writer's thread) after every committed change."""
+        self.listeners.append(callback)
+
+    def _notify(self):
+        for callback in self.listeners:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Recordings index listener failed: {e}")
+
+    @property
+    def generation(self):
+        with self.lock:
+            return self._generation()
+
+    def _generation(self):
+        return self.conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0]
+
+    def _record_change(self, event_type, filename):
+        """Bump the generation and log the change under it. Caller holds the lock."""
+        self.conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+        generation = self._generation()
+        recording = None
+        if event_type != "delete":
+            row = self.conn.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM recordings WHERE filename = ?", (filename,)
+            ).fetchone()
+            recording = json.dumps(dict(row))
+        self.conn.execute(
+            "INSERT INTO recording_events (id, type, filename, recording, created) VALUES (?, ?, ?, ?, ?)",
+            (generation, event_type, filename, recording, time.time()),
+        )
+        self.conn.execute(
+            "DELETE FROM recording_events WHERE id <= ?", (generation - self.EVENT_RETENTION,)
+        )
+
+    def _upsert(self, filename, stat, created, metadata):
+        self.conn.execute(
+            """
+            INSERT INTO recordings (filename, size, created, mtime, duration, frame_count, width, height, event_id, tier)
+            VALUES (:filename, :size, :created, :mtime, :duration, :frame_count, :width, :height, :event_id,
+                    COALESCE(:tier, 'full'))
+            ON CONFLICT (filename) DO UPDATE SET
+                size = excluded.size,
+                mtime = excluded.mtime,
+                duration = excluded.duration,
+                frame_count = excluded.frame_count,
+                width = excluded.width,
+                height = excluded.height,
+                event_id = excluded.event_id,
+                tier = COALESCE(:tier, recordings.tier)
+            """,
+            {
+                "filename": filename,
+                "size": stat.st_size,
+                "created": created,
+                "mtime": stat.st_mtime,
+                "duration": metadata.get("duration"),
+                "frame_count": metadata.get("frame_count"),
+                "width": metadata.get("width"),
+                "height": metadata.get("height"),
+                "event_id": metadata.get("event_id", event_id_from_filename(filename)),
+                "tier": metadata.get("tier"),
+            },
+        )
+
+    def add(self, filename, created=None, **metadata):
+        """Index a clip that was just written to the videos directory."""
+        stat = os.stat(os.path.join(self.video_dir, filename))
+        if created is None:
+            created = stat.st_ctime
+        with self.lock, self.conn:
+            existed = self._exists(filename)
+            self._upsert(filename, stat, created, metadata)
+            self._record_change("update" if existed else "add", filename)
+        self._notify()
+
+    def remove(self, filename):
+        """Drop a clip from the index. Returns whether it was indexed."""
+        with self.lock, self.conn:
+            cursor = self.conn.execute("DELETE FROM recordings WHERE filename = ?", (filename,))
+            if cursor.rowcount:
+                self._record_change("delete", filename)
+        if cursor.rowcount:
+            self._notify()
+        return cursor.rowcount > 0
+
+    def remove_many(self, filenames):
+        """Drop several clips in one transaction. Returns the filenames that were indexed."""
+        removed = []
+        with self.lock, self.conn:
+            for filename in filenames:
+                cursor = self.conn.execute("DELETE FROM recordings WHERE filename = ?", (filename,))
+                if cursor.rowcount:
+                    self._record_change("delete", filename)
+                    removed.append(filename)
+        if removed:
+            self._notify()
+        return removed
+
+    def _exists(self, filename):
+        return self.conn.execute(
+            "SELECT 1 FROM recordings WHERE filename = ?", (filename,)
+        ).fetchone() is not None
+
+    def get(self, filename):
+        with self.lock:
+            row = self.conn.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM recordings WHERE filename = ?", (filename,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def events_since(self, last_event_id):
+        """
+        Return the changes after `last_event_id`, oldest first, or None if
+        some of them have already been pruned, or `last_event_id` is ahead
+        of the index (e.g. it was recreated), and the client has to reload
+        the full listing.
+        """
+        with self.lock:
+            generation = self._generation()
+            if last_event_id > generation:
+                return None
+            if last_event_id == generation:
+                return []
+            rows = self.conn.execute(
+                "SELECT id, type, filename, recording FROM recording_events WHERE id > ? ORDER BY id",
+                (last_event_id,),
+            ).fetchall()
+        if not rows or rows[0]["id"] != last_event_id + 1:
+            return None
+        return [
+            {
+                "id": row["id"],
+                "type": row["type"],
+                "filename": row["filename"],
+                "recording": json.loads(row["recording"]) if row["recording"] else None,
+            }
+            for row in rows
+        ]
+
+    def list(self, limit=None, cursor=None, since=None, until=None):
+        """
+        Return one page of recordings, newest first, and the cursor for the
+        next page (None on the last page).
+        """
+        clauses, params = [], []
+        if since is not None:
+            clauses.append("created >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("created < ?")
+            params.append(until)
+        if cursor:
+            created, filename = decode_cursor(cursor)
+            clauses.append("(created < ? OR (created = ? AND filename < ?))")
+            params.extend([created, created, filename])
+        query = f"SELECT {', '.join(self.COLUMNS)} FROM recordings"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY created DESC, filename DESC"
+        if limit is not None:
+            # Fetch one extra row to know whether there is a next page
+            query += " LIMIT ?"
+            params.append(limit + 1)
+
+        with self.lock:
+            rows = [dict(row) for row in self.conn.execute(query, params)]
+
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]["created"], rows[-1]["filename"])
+        return rows, next_cursor
+
+    def oldest(self, limit, before=None, tier=None):
+        """Return up to `limit` recordings, oldest first, optionally older than `before` or in `tier`."""
+        clauses, params = [], []
+        if before is not None:
+            clauses.append("created < ?")
+            params.append(before)
+        if tier is not None:
+            clauses.append("tier = ?")
+            params.append(tier)
+        query = f"SELECT {', '.join(self.COLUMNS)} FROM recordings"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY created, filename LIMIT ?"
+        params.append(limit)
+        with self.lock:
+            return [dict(row) for row in self.conn.execute(query, params)]
+
+    def totals(self):
+        """Return the number of indexed recordings and their combined size in bytes."""
+        with self.lock:
+            count, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM recordings").fetchone()
+        return {"count": count, "bytes": size}
+
+    def reconcile(self):
+        """
+        Bring the index in line with the videos directory: index clips that
+        appeared while the server was down, re-probe clips that changed and
+        drop rows whose file is gone.
+        """
+        start = time.time()
+        os.makedirs(self.video_dir, exist_ok=True)
+        on_disk = {}
+        with os.scandir(self.video_dir) as entries:
+            for entry in entries:
+                # Hidden files are clips still being written
+                if entry.is_file() and entry.name.endswith(".mp4") and not entry.name.startswith("."):
+                    on_disk[entry.name] = entry.stat()
+
+        with self.lock:
+            indexed = {
+                row["filename"]: (row["size"], row["mtime"])
+                for row in self.conn.execute("SELECT filename, size, mtime FROM recordings")
+            }
+
+        stale = [name for name in indexed if name not in on_disk]
+        changed = [
+            name for name, stat in on_disk.items()
+            if indexed.get(name) != (stat.st_size, stat.st_mtime)
+        ]
+        # Probing opens each file, so do it before taking the lock
+        probed = {name: probe_video(os.path.join(self.video_dir, name)) for name in changed}
+
+        with self.lock, self.conn:
+            for name in stale:
+                self.conn.execute("DELETE FROM recordings WHERE filename = ?", (name,))
+                self._record_change("delete", name)
+            for name in changed:
+                self._upsert(name, on_disk[name], on_disk[name].st_ctime, probed[name])
+                self._record_change("update" if name in indexed else "add", name)
+        if stale or changed:
+            self._notify()
+
+        logger.info(
+            f"Reconciled recordings index in {time.time() - start:.2f}s: "
+            f"{len(on_disk)} on disk, {len(changed)} indexed, {len(stale)} removed"
+        )
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
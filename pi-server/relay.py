@@ -0,0 +1,318 @@
+"""
+Relay node that fans the doorbell's video and audio out to many viewers.
+
+Run it on a machine with a better uplink than the Pi:
+
+    python relay.py --upstream 192.168.10.59
+
+It serves `/video` and `/audio` with the same protocol as server.py, so the
+dashboard, benchmark.py and other relays connect to it exactly as they
+would to the Pi, and relays chain by pointing one's `--upstream` at
+another. Each distinct stream (e.g. `/video`, `/video?roi=door`, `/audio`)
+is pulled from upstream over one WebSocket while anyone watches it, and
+kept open for `--linger` seconds after the last viewer leaves.
+
+Every viewer has its own backpressure: video viewers are sent the newest
+frame and skip any they are too slow for, and audio viewers each get a
+short queue that loses its oldest chunks when they fall behind. A new
+video viewer is sent the cached latest frame straight away rather than
+waiting for the next one to arrive.
+"""
+import argparse
+import asyncio
+import logging
+import socket
+import time
+from urllib.parse import urlencode
+
+import uvicorn
+from fastapi import FastAPI, HTTPException, WebSocket
+from fastapi.responses import PlainTextResponse, Response
+from websockets import connect
+
+import metrics
+from video_feeds import FrameFeed
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# About 0.4 s of audio at the server's 1024-frame, 44.1 kHz chunks
+AUDIO_QUEUE_CHUNKS = 16
+MAX_RETRY_DELAY = 10.0
+
+
+class Upstream:
+    """One stream pulled from upstream, reconnecting until it is closed."""
+
+    def __init__(self, url, stream):
+        self.url = url
+        self.stream = stream
+        self.viewers = 0
+        self.task = None
+        self.linger_handle = None
+        self.connected = False
+        self.received = metrics.RELAY_UPSTREAM_MESSAGES.labels(stream)
+        self.connects = metrics.RELAY_UPSTREAM_CONNECTS.labels(stream)
+
+    def open(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def close(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def run(self):
+        retry_delay = 0.5
+        while True:
+            try:
+                async with connect(self.url, max_size=None, compression=None, open_timeout=5) as websocket:
+                    self.connected = True
+                    self.connects.inc()
+                    logger.info(f"Relaying {self.url}")
+                    retry_delay = 0.5
+                    await self.receive(websocket)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Upstream {self.url} failed: {e!r}; retrying in {retry_delay:.1f}s")
+            finally:
+                self.connected = False
+            await asyncio.sleep(retry_delay)
+            retry_delay = min(retry_delay * 2, MAX_RETRY_DELAY)
+
+    async def receive(self, websocket):
+        raise NotImplementedError
+
+    def to_dict(self):
+        return {"url": self.url, "connected": self.connected, "viewers": self.viewers,
+                "messages": self.received.value}
+
+
+class VideoUpstream(Upstream):
+    def __init__(self, url):
+        super().__init__(url, "video")
+        self.feed = FrameFeed()
+
+    async def receive(self, websocket):
+        async for message in websocket:
+            self.received.inc()
+            self.feed.publish(message, time.time())
+
+
+class AudioUpstream(Upstream):
+    def __init__(self, url):
+        super().__init__(url, "audio")
+        self.queues = set()
+        # The sample rate the server sends before any audio
+        self.header = None
+        self.header_received = asyncio.Event()
+        self.dropped = metrics.RELAY_MESSAGES_DROPPED.labels("audio")
+
+    async def receive(self, websocket):
+        self.header = await websocket.recv()
+        self.header_received.set()
+        async for message in websocket:
+            self.received.inc()
+            for queue in self.queues:
+                if queue.full():
+                    queue.get_nowait()
+                    self.dropped.inc()
+                queue.put_nowait(message)
+
+
+class Relay:
+    def __init__(self, upstream, linger=30.0):
+        self.upstream = upstream
+        self.linger = linger
+        # Keyed by upstream URL, so viewers of the same stream share one connection
+        self.upstreams = {}
+        self.clients = {"video": set(), "audio": set()}
+        self.send_timers = {stream: metrics.SEND_SECONDS.labels(stream) for stream in self.clients}
+        self.bytes_sent = {stream: metrics.BYTES_SENT.labels(stream) for stream in self.clients}
+        self.frames_dropped = metrics.RELAY_MESSAGES_DROPPED.labels("video")
+        for stream, clients in self.clients.items():
+            metrics.CONNECTED_CLIENTS.labels(stream).set_function(lambda clients=clients: len(clients))
+
+    def upstream_url(self, path, params):
+        query = urlencode([(key, value) for key, value in params.items() if value is not None])
+        return f"ws://{self.upstream}{path}{'?' + query if query else ''}"
+
+    def acquire(self, url, kind):
+        upstream = self.upstreams.get(url)
+        if upstream is None:
+            upstream = self.upstreams[url] = kind(url)
+        if upstream.linger_handle:
+            upstream.linger_handle.cancel()
+            upstream.linger_handle = None
+        upstream.viewers += 1
+        upstream.open()
+        return upstream
+
+    def release(self, upstream):
+        upstream.viewers -= 1
+        if upstream.viewers == 0:
+            upstream.linger_handle = asyncio.get_running_loop().call_later(
+                self.linger, lambda: asyncio.create_task(self.drop(upstream))
+            )
+
+    async def drop(self, upstream):
+        if upstream.viewers == 0 and self.upstreams.get(upstream.url) is upstream:
+            del self.upstreams[upstream.url]
+            await upstream.close()
+            logger.info(f"Stopped relaying {upstream.url}: no viewers for {self.linger:.0f}s")
+
+    async def send(self, websocket, stream, message):
+        send_start = time.perf_counter()
+        await websocket.send_bytes(message)
+        self.send_timers[stream].observe(time.perf_counter() - send_start)
+        self.bytes_sent[stream].inc(len(message))
+
+    async def handle_video(self, websocket, params):
+        upstream = self.acquire(self.upstream_url("/video", params), VideoUpstream)
+        subscriber = (asyncio.get_running_loop(), asyncio.Event())
+        try:
+            await websocket.accept()
+            self.clients["video"].add(websocket)
+            upstream.feed.subscribers.add(subscriber)
+            logger.info(f"Relay video viewer connected. Total viewers: {len(self.clients['video'])}")
+            last_sequence, jpeg = upstream.feed.latest
+            if jpeg is not None:
+                # Start from the cached frame instead of waiting for the next one
+                await self.send(websocket, "video", jpeg)
+            while True:
+                await subscriber[1].wait()
+                subscriber[1].clear()
+                sequence, jpeg = upstream.feed.latest
+                if sequence - last_sequence > 1:
+                    self.frames_dropped.inc(sequence - last_sequence - 1)
+                last_sequence = sequence
+                await self.send(websocket, "video", jpeg)
+        except Exception as e:
+            logger.debug(f"Relay video viewer error: {e!r}")
+        finally:
+            upstream.feed.subscribers.discard(subscriber)
+            self.clients["video"].discard(websocket)
+            self.release(upstream)
+            logger.info(f"Relay video viewer disconnected. Remaining viewers: {len(self.clients['video'])}")
+
+    async def handle_audio(self, websocket):
+        upstream = self.acquire(self.upstream_url("/audio", {}), AudioUpstream)
+        queue = asyncio.Queue(maxsize=AUDIO_QUEUE_CHUNKS)
+        try:
+            await websocket.accept()
+            self.clients["audio"].add(websocket)
+            upstream.queues.add(queue)
+            logger.info(f"Relay audio listener connected. Total listeners: {len(self.clients['audio'])}")
+            await upstream.header_received.wait()
+            await self.send(websocket, "audio", upstream.header)
+            while True:
+                await self.send(websocket, "audio", await queue.get())
+        except Exception as e:
+            logger.debug(f"Relay audio listener error: {e!r}")
+        finally:
+            upstream.queues.discard(queue)
+            self.clients["audio"].discard(websocket)
+            self.release(upstream)
+            logger.info(f"Relay audio listener disconnected. Remaining listeners: {len(self.clients['audio'])}")
+
+    def latest_frame(self):
+        upstream = self.upstreams.get(self.upstream_url("/video", {}))
+        return upstream.feed.latest[1] if upstream else None
+
+    def status(self):
+        return {
+            "upstream": self.upstream,
+            "linger": self.linger,
+            "viewers": {stream: len(clients) for stream, clients in self.clients.items()},
+            "upstreams": [upstream.to_dict() for upstream in self.upstreams.values()],
+        }
+
+    async def close(self):
+        for upstream in list(self.upstreams.values()):
+            await upstream.close()
+
+
+relay = Relay("localhost:5001")
+app = FastAPI()
+
+
+@app.get("/relay")
+async def relay_status():
+    """Upstream connections and viewers per stream."""
+    return relay.status()
+
+
+@app.get("/snapshot")
+async def snapshot():
+    """The latest relayed full-view frame, while anyone is watching it."""
+    jpeg = relay.latest_frame()
+    if jpeg is None:
+        raise HTTPException(status_code=503, detail="Not relaying video right now")
+    return Response(content=jpeg, media_type="image/jpeg", headers={"Cache-Control": "no-cache"})
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.websocket("/video")
+async def video_socket(
+    websocket: WebSocket, roi: str | None = None, width: int | None = None, mode: str = "jpeg", tier: str | None = None
+):
+    if mode != "jpeg":
+        # Skipping frames, as relayed viewers do, would corrupt a stream of tile updates
+        await websocket.close(code=1008, reason="Only whole-frame video is relayed")
+        return
+    await relay.handle_video(websocket, {"roi": roi, "width": width, "tier": tier})
+
+
+@app.websocket("/audio")
+async def audio_socket(websocket: WebSocket):
+    await relay.handle_audio(websocket)
+
+
+@app.on_event("shutdown")
+async def stop_relaying():
+    await relay.close()
+
+
+def bind_socket(port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("0.0.0.0", port))
+    return sock
+
+
+async def main(ports):
+    server = uvicorn.Server(uvicorn.Config(app, log_level="info", ws_per_message_deflate=False))
+    logger.info(f"Relaying {relay.upstream} on ports {', '.join(map(str, ports))}")
+    await server.serve(sockets=[bind_socket(port) for port in ports])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fan the doorbell's video and audio streams out to many viewers")
+    parser.add_argument("--upstream", required=True,
+                        help="HOST[:PORT] of the doorbell server or another relay (port defaults to 5001)")
+    parser.add_argument("--listen-ports", default="5001,5002",
+                        help="comma-separated ports to serve on, by default the server's video and audio ports")
+    parser.add_argument("--linger", type=float, default=30,
+                        help="seconds to keep an upstream stream open after its last viewer leaves")
+    args = parser.parse_args()
+    relay.upstream = args.upstream if ":" in args.upstream else f"{args.upstream}:5001"
+    relay.linger = args.linger
+    try:
+        ports = [int(port) for port in args.listen_ports.split(",")]
+    except ValueError:
+        parser.error(f"Invalid --listen-ports {args.listen_ports!r}")
+
+    try:
+        asyncio.run(main(ports))
+    except KeyboardInterrupt:
+        logger.info("Relay shutdown requested")
@@ -0,0 +1,235 @@
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+from media_tools import run_ffmpeg
+from recordings_index import probe_video
+
+logger = logging.getLogger(__name__)
+
+DAY = 24 * 60 * 60
+
+
+class RetentionManager:
+    """
+    Background service that keeps the videos directory within its quotas.
+
+    Clips are kept at full quality for `downgrade_after` seconds, then
+    re-encoded to a low-bitrate rendition, and deleted once older than
+    `max_age`. Independently of age, the oldest clips are evicted while the
+    directory is over `max_bytes` or, if `min_free_bytes` is set, the disk
+    has less than that left. The timelapse and DVR share the disk, so the
+    free-space floor is opt-in: low space caused by them would otherwise
+    cost every recording. Clips that cannot be deleted are left in place
+    and skipped until the next sweep. All work happens on one thread running at idle
+    CPU and I/O priority, deleting in small batches with pauses in between
+    so the SD card stays responsive for live streaming.
+    """
+
+    def __init__(
+        self,
+        recordings_index,
+        max_bytes=None,
+        min_free_bytes=None,
+        max_age=30 * DAY,
+        downgrade_after=7 * DAY,
+        interval=300,
+        batch_size=20,
+        batch_pause=1.0,
+    ):
+        self.recordings_index = recordings_index
+        self.video_dir = recordings_index.video_dir
+        self.max_bytes = max_bytes
+        self.min_free_bytes = min_free_bytes
+        self.max_age = max_age
+        self.downgrade_after = downgrade_after
+        self.interval = interval
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.stats = {
+            "evicted_files": 0,
+            "evicted_bytes": 0,
+            "evicted_by_age": 0,
+            "evicted_by_quota": 0,
+            "downgraded_files": 0,
+            "downgrade_bytes_saved": 0,
+            "errors": 0,
+            "last_sweep": None,
+            "last_sweep_duration": None,
+        }
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="retention", daemon=True)
+        self.thread.start()
+        logger.info("Retention manager started")
+
+    def stop(self):
+        self.stopping.set()
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join(timeout=10)
+
+    def wake(self):
+        """Request a sweep now, e.g. right after a clip was saved."""
+        self.wakeup.set()
+
+    def lower_priority(self):
+        """Drop this thread to idle CPU and I/O scheduling classes."""
+        thread_id = threading.get_native_id()
+        try:
+            os.setpriority(os.PRIO_PROCESS, thread_id, 19)
+        except (AttributeError, OSError) as e:
+            logger.debug(f"Could not lower retention thread CPU priority: {e}")
+        if shutil.which("ionice"):
+            # I/O priority is per thread on Linux, so target our own thread ID
+            subprocess.run(["ionice", "-c", "3", "-p", str(thread_id)], capture_output=True)
+
+    def run(self):
+        self.lower_priority()
+        while not self.stopping.is_set():
+            try:
+                self.sweep()
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(f"Retention sweep failed: {e}")
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+
+    def sweep(self):
+        start = time.time()
+        self.evict_expired(start)
+        self.evict_over_quota()
+        self.downgrade_old(start)
+        self.stats["last_sweep"] = start
+        self.stats["last_sweep_duration"] = time.time() - start
+
+    def excess_bytes(self):
+        """How much has to be freed to get back within `max_bytes` and above `min_free_bytes`."""
+        excess = 0
+        if self.max_bytes is not None:
+            excess = self.recordings_index.totals()["bytes"] - self.max_bytes
+        if self.min_free_bytes is not None:
+            excess = max(excess, self.min_free_bytes - shutil.disk_usage(self.video_dir).free)
+        return max(excess, 0)
+
+    def evict_expired(self, now):
+        if self.max_age is None:
+            return
+        while not self.stopping.is_set():
+            batch = self.recordings_index.oldest(self.batch_size, before=now - self.max_age)
+            if not batch or not self.delete_batch(batch, "age"):
+                # Nothing left, or the oldest clips can't be deleted; retry on the next sweep
+                return
+
+    def evict_over_quota(self):
+        while not self.stopping.is_set() and (excess := self.excess_bytes()) > 0:
+            batch = self.recordings_index.oldest(self.batch_size)
+            if not batch:
+                logger.warning("Disk is over quota but there are no recordings left to evict")
+                return
+            # Only as many of the oldest as it takes, not the whole batch
+            for count, recording in enumerate(batch, 1):
+                excess -= recording["size"]
+                if excess <= 0:
+                    batch = batch[:count]
+                    break
+            if not self.delete_batch(batch, "quota"):
+                logger.warning("Disk is over quota but the oldest recordings could not be evicted")
+                return
+
+    def delete_batch(self, batch, reason):
+        """Delete and unindex a batch of clips. Returns how many were evicted."""
+        evicted = 0
+        for recording in batch:
+            path = os.path.join(self.video_dir, recording["filename"])
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                self.stats["errors"] += 1
+                logger.error(f"Failed to evict {path}: {e}")
+                continue
+            self.recordings_index.remove(recording["filename"])
+            self.stats["evicted_files"] += 1
+            self.stats["evicted_bytes"] += recording["size"]
+            self.stats[f"evicted_by_{reason}"] += 1
+            evicted += 1
+        if evicted:
+            logger.info(f"Evicted {evicted} of {len(batch)} recordings ({reason})")
+        # Let the camera and clients have the disk between batches
+        self.stopping.wait(self.batch_pause)
+        return evicted
+
+    def downgrade_old(self, now):
+        if self.downgrade_after is None:
+            return
+        while not self.stopping.is_set():
+            batch = self.recordings_index.oldest(self.batch_size, before=now - self.downgrade_after, tier="full")
+            if not batch:
+                return
+            for recording in batch:
+                if self.stopping.is_set():
+                    return
+                self.downgrade(recording)
+
+    def downgrade(self, recording):
+        """Re-encode a clip at half resolution and low bitrate, replacing it in place."""
+        filename = recording["filename"]
+        path = os.path.join(self.video_dir, filename)
+        temp_path = os.path.join(self.video_dir, f".{filename}.low")
+        try:
+            run_ffmpeg([
+                "-i", path,
+                "-vf", "scale=trunc(iw/4)*2:-2",
+                "-c:v", "libx264", "-preset", "veryfast", "-crf", "32",
+                "-an", "-movflags", "+faststart",
+                "-f", "mp4", temp_path,
+            ], low_priority=True)
+            os.replace(temp_path, path)
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.error(f"Failed to downgrade {filename}: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            # Don't retry this clip on every sweep
+            self.reindex(filename, "failed")
+            return
+        if not self.reindex(filename, "low"):
+            return
+        saved = recording["size"] - os.path.getsize(path)
+        self.stats["downgraded_files"] += 1
+        self.stats["downgrade_bytes_saved"] += saved
+        logger.info(f"Downgraded {filename} to low quality, saved {saved} bytes")
+
+    def reindex(self, filename, tier):
+        """Record a clip's new tier. Returns False, unindexing it, if the clip was deleted meanwhile."""
+        path = os.path.join(self.video_dir, filename)
+        try:
+            self.recordings_index.add(filename, tier=tier, **probe_video(path))
+        except FileNotFoundError:
+            logger.info(f"{filename} was deleted before it could be downgraded")
+            self.recordings_index.remove(filename)
+            return False
+        return True
+
+    def status(self):
+        usage = shutil.disk_usage(self.video_dir)
+        return {
+            "disk": {"total": usage.total, "used": usage.used, "free": usage.free},
+            "recordings": self.recordings_index.totals(),
+            "policy": {
+                "max_bytes": self.max_bytes,
+                "min_free_bytes": self.min_free_bytes,
+                "max_age": self.max_age,
+                "downgrade_after": self.downgrade_after,
+            },
+            "stats": dict(self.stats),
+        }
@@ -1,16 +1,38 @@
+import time
+STARTED = time.monotonic()  # Before the imports below, for the startup breakdown
 import logging
+import argparse
 import asyncio
-import threading
+import socket
+import hmac
+import ipaddress
 from video_stream import VideoStreamHandler
+from frame_sources import create_frame_source
+from video_feeds import MAX_ROI_WIDTH, MIN_ROI_WIDTH, parse_named_roi
+from jpeg_encoders import ENCODERS, create_jpeg_encoder
+from audio_backends import create_audio_input, create_audio_output
 from audio_stream import AudioStreamHandler
 from mic_stream import MicStreamHandler
+from recordings_index import RecordingsIndex, probe_video
+from recording_events import RecordingEventStream
+from event_store import EventStore
+from retention import RetentionManager
+from clip_jobs import ClipExportQueue
+from timelapse import TimelapseRecorder, MJPEG_BOUNDARY
+from dvr import DvrRecorder
+from transports import Transports, parse_address
+from zip_stream import stream_zip
+import metrics
+from profiling import PROFILER, MEMORY, TRACER
+from media_tools import trim_clip, concat_clips
+from startup import Startup
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi import FastAPI, WebSocket, HTTPException
-from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from fastapi import FastAPI, WebSocket, HTTPException, Request, Query, Depends, Header
+from pydantic import BaseModel
+import uvicorn
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse, Response, PlainTextResponse
 import os
-import time
 import json
-import cv2
 import collections
 import subprocess
 
@@ -21,10 +43,24 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# FastAPI app for HTTP endpoints (Port 5004)
+startup = Startup(STARTED)
+startup.mark("imports")
+
+VIDEO_DIR = "./videos"
+os.makedirs(VIDEO_DIR, exist_ok=True)
+recordings_index = RecordingsIndex(VIDEO_DIR)
+recording_events = RecordingEventStream(recordings_index)
+retention_manager = RetentionManager(recordings_index)
+event_store = EventStore(recordings_index)
+
+# Every HTTP and WebSocket endpoint lives on this one app and one event loop.
+# It listens on all the historical ports so existing clients keep working:
+# 5001 video, 5002 audio, 5003 microphone, 5004 recordings, 5005 notifications.
+LISTEN_PORTS = (5001, 5002, 5003, 5004, 5005)
 app = FastAPI()
+# Set from --admin-token; without one the /admin endpoints only answer loopback clients
+app.state.admin_token = None
 
-# Add CORS middleware to the main app (port 5004)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Allow all origins (for production, specify the frontend URL)
@@ -33,39 +69,379 @@ app.add_middleware(
     allow_headers=["*"],  # Allow all headers (like Authorization, Content-Type, etc.)
 )
 
+def start_recordings():
+    """Catch up with clips added or removed while down before retention looks at them."""
+    recordings_index.reconcile()
+    retention_manager.start()
+
+
+@app.on_event("startup")
+async def start_background_work():
+    """Start serving right away and bring the devices up concurrently in the background."""
+    startup.mark("serving")
+    subsystems = {
+        "video": video_handler.start,
+        "audio": audio_handler.start,
+        "mic": mic_handler.start,
+        "recordings": start_recordings,
+    }
+    if timelapse.enabled:
+        subsystems["timelapse"] = timelapse.start
+    if dvr.enabled:
+        subsystems["dvr"] = dvr.start
+    startup.launch(subsystems)
+    await transports.start()
+    clip_queue.start()
+
+
+@app.on_event("shutdown")
+async def stop_background_work():
+    await transports.stop()
+    await clip_queue.stop()
+    await asyncio.to_thread(retention_manager.stop)
+    await asyncio.to_thread(timelapse.stop)
+    await asyncio.to_thread(dvr.stop)
+
+
+@app.get("/ready")
+async def ready():
+    """Per-subsystem startup state; 200 once everything is up, 503 until then."""
+    status = startup.status()
+    return JSONResponse(content=status, status_code=200 if status["ready"] else 503)
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
 @app.get("/recordings")
-async def get_recordings():
+async def get_recordings(
+    request: Request,
+    limit: int = Query(200, ge=1, le=1000),
+    cursor: str | None = None,
+    since: float | None = None,
+    until: float | None = None,
+):
     """
-    Get metadata for all video files in the storage directory.
+    Get metadata for video files in the storage directory, newest first.
+    Follow `next_cursor` to page through older recordings, then subscribe
+    to `/recordings/events` from `generation` for live updates.
     """
+    # SQLite blocks on the SD card; keep it off the loop that serves the live streams
+    generation = await asyncio.to_thread(lambda: recordings_index.generation)
+    etag = f'"rec-{generation}"'
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
     try:
-        video_path = "./videos"
-        recordings = []
-        for filename in os.listdir(video_path):
-            if filename.endswith(".mp4"):
-                filepath = os.path.join(video_path, filename)
-                file_info = os.stat(filepath)
-                recordings.append({
-                    "filename": filename,
-                    "size": file_info.st_size,
-                    "created": file_info.st_ctime
-                })
-        return JSONResponse(content={"recordings": recordings})
+        recordings, next_cursor = await asyncio.to_thread(
+            recordings_index.list, limit=limit, cursor=cursor, since=since, until=until
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error getting recordings: {e}")
         return JSONResponse(content={"error": "Failed to list recordings"}, status_code=500)
+    return JSONResponse(
+        content={"recordings": recordings, "next_cursor": next_cursor, "generation": generation},
+        headers={"ETag": etag, "Cache-Control": "no-cache"},
+    )
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Pipeline counters and histograms in the Prometheus text format.
+    """
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+def is_loopback(host):
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+async def require_admin(request: Request, x_admin_token: str | None = Header(None)):
+    """
+    Gate the /admin endpoints, which CORS would otherwise open to any page:
+    the X-Admin-Token header must match --admin-token, or without a token
+    configured the request must come from this machine.
+    """
+    token = request.app.state.admin_token
+    if token:
+        if x_admin_token is None or not hmac.compare_digest(x_admin_token.encode(), token.encode()):
+            raise HTTPException(status_code=401, detail="Missing or wrong X-Admin-Token")
+    elif request.client is None or not is_loopback(request.client.host):
+        raise HTTPException(status_code=403, detail="Admin endpoints are localhost-only without --admin-token")
+
+# Admin diagnostics. Nothing here runs until explicitly started.
+@app.post("/admin/profile", status_code=202, dependencies=[Depends(require_admin)])
+async def start_profile(seconds: float = Query(10, gt=0, le=300), interval: float = Query(0.005, ge=0.001, le=1)):
+    """
+    Sample every thread's stack for `seconds`; fetch the result from GET /admin/profile.
+    """
+    try:
+        PROFILER.start(seconds, interval)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"message": f"Profiling for {seconds}s"}
+
+@app.get("/admin/profile", dependencies=[Depends(require_admin)])
+async def get_profile(format: str = "json"):
+    """
+    Profiler summary, or `?format=collapsed` for flame graph input.
+    """
+    if format == "collapsed":
+        return PlainTextResponse(PROFILER.collapsed())
+    return PROFILER.summary()
+
+@app.delete("/admin/profile", dependencies=[Depends(require_admin)])
+async def stop_profile():
+    await asyncio.to_thread(PROFILER.stop)
+    return PROFILER.summary()
+
+@app.post("/admin/tracemalloc/snapshots", dependencies=[Depends(require_admin)])
+async def take_memory_snapshot():
+    """
+    Take a tracemalloc snapshot, starting tracing on first use.
+    """
+    return await asyncio.to_thread(MEMORY.take)
+
+@app.get("/admin/tracemalloc/diff", dependencies=[Depends(require_admin)])
+async def diff_memory_snapshots(base: int, current: int, limit: int = Query(25, ge=1, le=500)):
+    try:
+        return {"top_differences": await asyncio.to_thread(MEMORY.diff, base, current, limit)}
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+
+@app.delete("/admin/tracemalloc", dependencies=[Depends(require_admin)])
+async def stop_memory_tracing():
+    MEMORY.stop()
+    return {"message": "tracemalloc stopped"}
+
+@app.post("/admin/trace", status_code=202, dependencies=[Depends(require_admin)])
+async def start_trace(seconds: float = Query(10, gt=0, le=300)):
+    """
+    Record capture, encode, send and clip-save spans for `seconds`.
+    """
+    TRACER.start(seconds)
+    return {"message": f"Tracing for {seconds}s"}
+
+@app.get("/admin/trace", dependencies=[Depends(require_admin)])
+async def get_trace():
+    """
+    Recorded spans as Chrome trace-event JSON, loadable in Perfetto.
+    """
+    return JSONResponse(
+        content=await asyncio.to_thread(TRACER.chrome_trace),
+        headers={"Content-Disposition": 'attachment; filename="pi-server-trace.json"'},
+    )
+
+class VideoConfigRequest(BaseModel):
+    width: int | None = None
+    height: int | None = None
+    fps: float | None = None
+    idle_fps: float | None = None
+    quality: int | None = None
+    preroll_seconds: float | None = None
+    encoder: str | None = None
+
+
+@app.get("/admin/video", dependencies=[Depends(require_admin)])
+async def get_video_config():
+    """Current capture and encode settings, and the most recent live reconfigurations."""
+    return {"config": video_handler.config(), "reconfigurations": list(video_handler.reconfigurations)}
+
+@app.patch("/admin/video", dependencies=[Depends(require_admin)])
+async def reconfigure_video(request: VideoConfigRequest):
+    """
+    Change resolution, frame rates, JPEG quality, pre-roll length or JPEG
+    encoder without restarting; an encoder of "auto" reruns the encoder
+    benchmark. Viewers stay connected; the response reports the gap they saw.
+    """
+    if not await startup.wait("video"):
+        raise HTTPException(status_code=503, detail="Video unavailable")
+    try:
+        future = video_handler.reconfigure(**request.model_dump(exclude_none=True))
+        report = await asyncio.wait_for(asyncio.wrap_future(future), timeout=30)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Capture did not resume within 30s")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Reconfiguration failed: {e}")
+    return {"config": video_handler.config(), "reconfiguration": report}
+
+@app.get("/storage")
+async def get_storage():
+    """
+    Disk usage, retention policy and eviction statistics for the videos directory.
+    """
+    return JSONResponse(content=await asyncio.to_thread(retention_manager.status))
+
+def video_path(filename):
+    """Map a client-supplied filename to a clip in the videos directory."""
+    if not filename or os.path.basename(filename) != filename or filename.startswith("."):
+        raise HTTPException(status_code=400, detail=f"Invalid filename: {filename}")
+    return os.path.join(VIDEO_DIR, filename)
+
+
+def select_recordings(filenames, since, until):
+    """Resolve an explicit filename list, or else a created-time range, to filenames."""
+    if filenames:
+        for filename in filenames:
+            video_path(filename)
+        return list(dict.fromkeys(filenames))
+    if since is None and until is None:
+        raise HTTPException(status_code=400, detail="Specify filenames or a since/until time range")
+    selected, cursor = [], None
+    while True:
+        page, cursor = recordings_index.list(limit=1000, cursor=cursor, since=since, until=until)
+        selected.extend(recording["filename"] for recording in page)
+        if cursor is None:
+            return selected
+
+
+class BulkDeleteRequest(BaseModel):
+    filenames: list[str] | None = None
+    since: float | None = None
+    until: float | None = None
+
+
+@app.post("/videos/bulk-delete")
+async def bulk_delete_videos(request: BulkDeleteRequest):
+    """
+    Delete many clips in one request, either by filename or by created
+    time range. Returns which files were deleted and which were missing.
+    """
+    filenames = await asyncio.to_thread(select_recordings, request.filenames, request.since, request.until)
+
+    def delete_files():
+        deleted, missing = [], []
+        for filename in filenames:
+            try:
+                os.remove(video_path(filename))
+                deleted.append(filename)
+            except FileNotFoundError:
+                missing.append(filename)
+        # Drop stale index rows for missing files too
+        recordings_index.remove_many(filenames)
+        return deleted, missing
+
+    deleted, missing = await asyncio.to_thread(delete_files)
+    logger.info(f"Bulk deleted {len(deleted)} video files, {len(missing)} not found")
+    return {"deleted": deleted, "missing": missing}
+
+@app.get("/videos/export.zip")
+async def export_videos(
+    filenames: list[str] | None = Query(None),
+    since: float | None = None,
+    until: float | None = None,
+):
+    """
+    Stream the selected clips as an uncompressed ZIP built on the fly.
+    Select clips with repeated `filenames` parameters or a since/until range.
+    """
+    selected = await asyncio.to_thread(select_recordings, filenames, since, until)
+    entries = [(video_path(filename), filename) for filename in selected]
+    return StreamingResponse(
+        stream_zip(entries),
+        media_type="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="recordings.zip"'},
+    )
+
+class TrimRequest(BaseModel):
+    start: float
+    end: float
+    output: str | None = None
+
+
+class ConcatRequest(BaseModel):
+    filenames: list[str]
+    output: str | None = None
+
+
+def output_video_path(output):
+    if not output.endswith(".mp4"):
+        raise HTTPException(status_code=400, detail="Output filename must end in .mp4")
+    path = video_path(output)
+    if os.path.exists(path):
+        raise HTTPException(status_code=409, detail=f"{output} already exists")
+    return path
+
+
+def index_edited_clip(output, event_id=None):
+    recordings_index.add(output, created=time.time(), event_id=event_id, **probe_video(video_path(output)))
+    return recordings_index.get(output)
+
+
+@app.post("/videos/{filename}/trim")
+async def trim_video(filename: str, request: TrimRequest):
+    """
+    Keep only `[start, end]` seconds of a clip by remuxing with stream copy.
+    The cut starts at the keyframe at or before `start`.
+    """
+    source = video_path(filename)
+    if not os.path.isfile(source):
+        raise HTTPException(status_code=404, detail="Video not found")
+    if request.start < 0 or request.end <= request.start:
+        raise HTTPException(status_code=400, detail="Invalid trim range")
+    stem = filename.removesuffix(".mp4")
+    output = request.output or f"{stem}_trim_{request.start:g}-{request.end:g}.mp4"
+    output_path = output_video_path(output)
+    try:
+        await asyncio.to_thread(trim_clip, source, output_path, request.start, request.end)
+    except Exception as e:
+        logger.error(f"Error trimming {filename}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to trim video")
+    source_recording = await asyncio.to_thread(recordings_index.get, filename)
+    event_id = source_recording["event_id"] if source_recording else None
+    return await asyncio.to_thread(index_edited_clip, output, event_id)
+
+@app.post("/videos/concat")
+async def concat_videos(request: ConcatRequest):
+    """
+    Join clips in the given order by remuxing with stream copy. The clips
+    must share codec parameters, so mixed resolutions are rejected.
+    """
+    if len(request.filenames) < 2:
+        raise HTTPException(status_code=400, detail="Concatenation needs at least two clips")
+    sources = []
+    for filename in request.filenames:
+        source = video_path(filename)
+        if not os.path.isfile(source):
+            raise HTTPException(status_code=404, detail=f"Video not found: {filename}")
+        sources.append(source)
+    recordings = await asyncio.to_thread(lambda: [recordings_index.get(filename) for filename in request.filenames])
+    resolutions = {
+        (recording["width"], recording["height"])
+        for recording in recordings
+        if recording and recording["width"]
+    }
+    if len(resolutions) > 1:
+        raise HTTPException(status_code=409, detail="Clips have different resolutions and cannot be joined losslessly")
+    output = request.output or f"concat_{int(time.time())}.mp4"
+    output_path = output_video_path(output)
+    try:
+        await asyncio.to_thread(concat_clips, sources, output_path)
+    except Exception as e:
+        logger.error(f"Error concatenating {request.filenames}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to concatenate videos")
+    return await asyncio.to_thread(index_edited_clip, output)
 
 @app.get("/videos/{filename}")
 async def get_video(filename: str):
     """
     Serve the video file as a streaming response.
     """
-    video_path = f"./videos/{filename}"
-    if not os.path.isfile(video_path):
+    path = video_path(filename)
+    if not os.path.isfile(path):
         raise HTTPException(status_code=404, detail="Video not found")
     
     def video_stream():
-        with open(video_path, "rb") as video_file:
+        with open(path, "rb") as video_file:
             yield from video_file
     
     response = StreamingResponse(video_stream(), media_type="video/mp4")
@@ -78,60 +454,325 @@ async def delete_video(filename: str):
     """
     Delete the video file for a given filename.
     """
+    path = video_path(filename)
+
+    def delete_file():
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # Drop a stale index row, but still report the clip as missing
+            recordings_index.remove(filename)
+            return False
+        recordings_index.remove(filename)
+        return True
+
     try:
-        video_path = f"./videos/{filename}"
-        if os.path.exists(video_path):
-            os.remove(video_path)
-            logger.info(f"Deleted video file: {video_path}")
+        if await asyncio.to_thread(delete_file):
+            logger.info(f"Deleted video file: {path}")
             return JSONResponse(content={"message": "File deleted successfully"})
-        else:
-            logger.warning(f"File not found for deletion: {video_path}")
-            raise HTTPException(status_code=404, detail="File not found")
+        logger.warning(f"File not found for deletion: {path}")
+        raise HTTPException(status_code=404, detail="File not found")
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error deleting video file: {e}")
         return JSONResponse(content={"error": "Failed to delete video"}, status_code=500)
 
 
-# WebSocket server for notifications (Port 5005)
-notifications_app = FastAPI()
-
-# Add CORS middleware to the notifications app (port 5005)
-notifications_app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Allow all origins (you should restrict this in production)
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# Notification endpoints (historically their own app on port 5005)
 video_handler = VideoStreamHandler()
+audio_handler = AudioStreamHandler()
+mic_handler = MicStreamHandler()
+
+def clip_saved(job):
+    filename = os.path.basename(job.output_path)
+    recordings_index.add(filename, created=job.created, event_id=job.video_id, **job.result)
+    retention_manager.wake()
 
-@notifications_app.post("/save-video/{video_id}")
-async def save_video(video_id: str):
-    if not video_id:
+clip_queue = ClipExportQueue(video_handler, on_complete=clip_saved)
+timelapse = TimelapseRecorder(video_handler)
+dvr = DvrRecorder(video_handler)
+transports = Transports(video_handler, audio_handler, startup.wait)
+
+@app.post("/save-video/{video_id}", status_code=202)
+async def save_video(video_id: str, priority: int = 10):
+    """
+    Queue the current pre-roll to be saved as `notification_{video_id}.mp4`
+    and return a job to poll at `/jobs/{job_id}`. Repeated requests for the
+    same video ID return the existing job.
+    """
+    if not video_id or "/" in video_id:
         raise HTTPException(status_code=400, detail="Invalid video ID")
+    output_path = os.path.join(VIDEO_DIR, f"notification_{video_id}.mp4")
+    # Someone is at the door; capture what happens next at full rate
+    video_handler.trigger_activity()
     try:
-        output_path = f"videos/notification_{video_id}.mp4"
-        await video_handler.save_last_4_seconds(output_path)
-        return {"message": f"Saved last 4 seconds of video as {output_path}"}
-    except Exception as e:
-        logger.error(f"Error saving video: {e}")
-        raise HTTPException(status_code=500, detail="Failed to save video")
+        job, created = clip_queue.submit(video_id, output_path, priority=priority)
+    except asyncio.QueueFull:
+        raise HTTPException(status_code=503, detail="Clip export queue is full, retry later")
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    # Clips are tagged with the video ID, which links them to the event; only
+    # recorded once the clip is queued, so a rejected request leaves no event
+    await asyncio.to_thread(event_store.record, video_id, source="notification")
+    status_url = f"/jobs/{job.id}"
+    return JSONResponse(
+        content={**job.to_dict(), "status_url": status_url, "coalesced": not created},
+        status_code=202,
+        headers={"Location": status_url},
+    )
 
+class EventRequest(BaseModel):
+    id: str | None = None
+    source: str = "manual"
+    camera: str = "default"
+    timestamp: float | None = None
+    labels: dict[str, float | None] = {}
+    data: dict | None = None
 
 
+@app.post("/events", status_code=201)
+async def record_event(request: EventRequest):
+    """
+    Record a trigger such as a doorbell press or a detection, with labels
+    and their scores. Posting again with the same ID adds labels and data
+    to the existing event. Clips saved under the ID are linked to it.
+    """
+    if request.id is not None and (not request.id or "/" in request.id):
+        raise HTTPException(status_code=400, detail="Invalid event ID")
+    return await asyncio.to_thread(
+        event_store.record, request.id, source=request.source, camera=request.camera,
+        created=request.timestamp, labels=request.labels, data=request.data,
+    )
 
-async def main():
-    audio_handler = AudioStreamHandler()
-    mic_handler = MicStreamHandler()
-    
+@app.get("/events")
+async def list_events(
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: str | None = None,
+    since: float | None = None,
+    until: float | None = None,
+    label: str | None = None,
+    camera: str | None = None,
+    min_score: float | None = None,
+):
+    """Events newest first with their labels and clips; follow `next_cursor` for older ones."""
     try:
-        await asyncio.gather(
-            video_handler.start_server(),
-            audio_handler.start_server(),
-            mic_handler.start_server()
+        events, next_cursor = await asyncio.to_thread(
+            event_store.list, limit=limit, cursor=cursor, since=since, until=until,
+            label=label, camera=camera, min_score=min_score,
         )
-    except KeyboardInterrupt:
-        logger.info("Shutting down servers...")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"events": events, "next_cursor": next_cursor}
+
+@app.get("/events/{event_id}")
+async def get_event(event_id: str):
+    event = await asyncio.to_thread(event_store.get, event_id)
+    if event is None:
+        raise HTTPException(status_code=404, detail="Event not found")
+    return event
+
+@app.delete("/events/{event_id}")
+async def delete_event(event_id: str):
+    """Delete an event and its labels. Its clips are kept; delete them through /videos."""
+    if not await asyncio.to_thread(event_store.delete, event_id):
+        raise HTTPException(status_code=404, detail="Event not found")
+    return {"deleted": event_id}
+
+@app.get("/capture")
+async def capture_status():
+    """Current capture mode, and time, frames, CPU and power used in each mode so far."""
+    return video_handler.status()
+
+@app.get("/transports")
+async def transport_status():
+    """Ports of the length-prefixed TCP and RTP transports, and current RTP receivers."""
+    return transports.status()
+
+@app.get("/audio.sdp")
+async def audio_sdp(request: Request, port: int | None = Query(None, gt=0, lt=65536)):
+    """
+    Session description of the RTP audio for a player listening on `port`,
+    by default the first `--rtp-audio-target`, e.g. `ffplay -protocol_whitelist file,udp,rtp audio.sdp`.
+    """
+    if not transports.rtp_enabled:
+        raise HTTPException(status_code=404, detail="RTP audio is not enabled")
+    if port is None:
+        if not transports.rtp.fixed_targets:
+            raise HTTPException(status_code=400, detail="Pass ?port= for the player's receiving port")
+        port = min(transports.rtp.fixed_targets)[1]
+    return PlainTextResponse(transports.rtp.sdp(request.url.hostname, port), media_type="application/sdp")
+
+@app.post("/capture/activity")
+async def capture_activity(seconds: float = Query(30, gt=0, le=3600)):
+    """Ramp capture to full rate for `seconds`, e.g. when a motion sensor fires."""
+    video_handler.trigger_activity(seconds)
+    return video_handler.status()
+
+@app.get("/snapshot")
+async def snapshot(request: Request, width: int | None = Query(None, ge=16, le=1920)):
+    """
+    The most recently captured frame as a JPEG, optionally scaled down to
+    `width`. Served from a cache and never triggers a capture; send the
+    ETag back in `If-None-Match` to get a 304 until a newer frame exists.
+    """
+    captured_at, variant = video_handler.snapshot_key(width)
+    if captured_at is None:
+        raise HTTPException(status_code=503, detail="No frame captured yet")
+    etag = f'"snap-{captured_at:.6f}-{variant or "full"}"'
+    if etag_matches(request, etag):
+        metrics.SNAPSHOT_REQUESTS.labels("not_modified").inc()
+        return Response(status_code=304, headers={"ETag": etag})
+
+    captured_at, jpeg, cached = await asyncio.to_thread(video_handler.snapshot, width)
+    if jpeg is None:
+        raise HTTPException(status_code=503, detail="Failed to encode snapshot")
+    metrics.SNAPSHOT_REQUESTS.labels("cached" if cached else "encoded").inc()
+    # The newest frame may have changed since the ETag check
+    return Response(
+        content=jpeg,
+        media_type="image/jpeg",
+        headers={
+            "ETag": f'"snap-{captured_at:.6f}-{variant or "full"}"',
+            "Cache-Control": "no-cache",
+        },
+    )
+
+@app.get("/timelapse")
+async def timelapse_status():
+    """Timelapse settings, storage used per day, and the throughput of recent renders."""
+    return await asyncio.to_thread(timelapse.status)
+
+@app.get("/timelapse/render")
+async def render_timelapse(
+    start: float | None = None,
+    end: float | None = None,
+    format: str = Query("mjpeg", pattern="^(mjpeg|mp4)$"),
+    fps: float = Query(30, gt=0, le=120),
+):
+    """
+    Play back the timelapse between `start` and `end` (Unix times, default
+    the last 24 hours) at `fps`, as an MJPEG stream or a fragmented MP4.
+    """
+    if not timelapse.enabled:
+        raise HTTPException(status_code=404, detail="Timelapse recording is not enabled")
+    end = end if end is not None else time.time()
+    start = start if start is not None else end - 24 * 60 * 60
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    frames = timelapse.count(start, end)
+    if not frames:
+        raise HTTPException(status_code=404, detail="No timelapse frames in that range")
+    headers = {"X-Timelapse-Frames": str(frames), "Cache-Control": "no-cache"}
+    if format == "mp4":
+        return StreamingResponse(timelapse.render_mp4(start, end, fps), media_type="video/mp4", headers=headers)
+    return StreamingResponse(
+        timelapse.render_mjpeg(start, end, fps),
+        media_type=f"multipart/x-mixed-replace; boundary={MJPEG_BOUNDARY}",
+        headers=headers,
+    )
+
+@app.get("/dvr")
+async def dvr_status():
+    """Continuous recording state and the time index of the segments on disk."""
+    return await asyncio.to_thread(dvr.status)
+
+@app.get("/dvr/extract")
+async def extract_dvr(start: float, end: float, fps: float = Query(30, gt=0, le=60)):
+    """Download the continuous recording between `start` and `end` (Unix times) as an MP4."""
+    if not dvr.enabled:
+        raise HTTPException(status_code=404, detail="Continuous recording is not enabled")
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    frames = dvr.count(start, end)
+    if not frames:
+        raise HTTPException(status_code=404, detail="No recorded frames in that range")
+    filename = f"dvr_{int(start)}-{int(end)}.mp4"
+    return StreamingResponse(
+        dvr.extract(start, end, fps),
+        media_type="video/mp4",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "X-DVR-Frames": str(frames)},
+    )
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = clip_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@app.get("/recordings/events")
+async def recording_events_feed(request: Request, last_event_id: int | None = None):
+    """
+    Server-Sent Events feed of recordings being added, updated or deleted.
+    Resumes after the browser's `Last-Event-ID` on reconnect, or after the
+    `generation` returned by `/recordings` on the first connection.
+    """
+    header = request.headers.get("last-event-id")
+    if header and header.isdigit():
+        last_event_id = int(header)
+    if last_event_id is None:
+        last_event_id = await asyncio.to_thread(lambda: recordings_index.generation)
+    return StreamingResponse(
+        recording_events.subscribe(last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# Streaming endpoints (historically websockets servers on ports 5001-5003)
+async def device_ready(websocket: WebSocket, name: str) -> bool:
+    """Hold a new client until its device has started; reject it if the device failed."""
+    if await startup.wait(name):
+        return True
+    await websocket.close(code=1011, reason=f"{name} unavailable")
+    return False
+
+@app.websocket("/video")
+async def video_socket(
+    websocket: WebSocket,
+    roi: str | None = None,
+    width: int | None = Query(None, ge=MIN_ROI_WIDTH, le=MAX_ROI_WIDTH),
+    mode: str = "jpeg",
+    tier: str = "full",
+):
+    """
+    Full view, or with `?roi=` a named or `x,y,width,height` region scaled to `?width=`.
+    `?tier=half` or `?tier=thumb` picks a smaller encode of the full view for thumbnails and classifiers.
+    `?mode=tiles` sends the full view as keyframes and changed tiles (see video_feeds.TileFeed).
+    """
+    if mode not in ("jpeg", "tiles"):
+        await websocket.close(code=1008, reason=f"Unknown mode {mode!r}; expected jpeg or tiles")
+        return
+    if await device_ready(websocket, "video"):
+        await video_handler.handle_client(websocket, roi, width, tiles=mode == "tiles", tier=tier)
+
+@app.websocket("/audio")
+async def audio_socket(websocket: WebSocket):
+    if await device_ready(websocket, "audio"):
+        await audio_handler.handle_client(websocket)
+
+@app.websocket("/mic")
+async def mic_socket(websocket: WebSocket):
+    if await device_ready(websocket, "mic"):
+        await mic_handler.handle_client(websocket)
+
+
+def bind_socket(port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("0.0.0.0", port))
+    return sock
+
+
+async def main():
+    # Frames are JPEG and PCM, which deflate barely shrinks, so don't spend CPU trying
+    config = uvicorn.Config(app, log_level="info", ws_per_message_deflate=False)
+    server = uvicorn.Server(config)
+    sockets = [bind_socket(port) for port in LISTEN_PORTS]
+    logger.info(f"Serving all endpoints on ports {', '.join(map(str, LISTEN_PORTS))}")
+    try:
+        await server.serve(sockets=sockets)
     finally:
         video_handler.cleanup()
         audio_handler.cleanup()
@@ -139,21 +780,123 @@ async def main():
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Doorbell camera streaming server")
+    parser.add_argument("--stamp-frames", action="store_true",
+                        help="embed capture timestamps in video frames so benchmark.py can measure latency")
+    parser.add_argument("--video-source", default="camera",
+                        help="where video frames come from: camera, synthetic or replay:PATH "
+                             "(an MP4, an image, a directory of images or a glob)")
+    parser.add_argument("--video-fps", type=float, default=30,
+                        help="frame rate for synthetic and replay sources")
+    parser.add_argument("--roi", action="append", default=[], metavar="NAME=X,Y,W,H",
+                        help="named region of interest as fractions of the frame, "
+                             "viewable at /video?roi=NAME (repeatable)")
+    parser.add_argument("--roi-resolution", metavar="WxH",
+                        help="capture a high-resolution camera stream of this size to crop regions from")
+    parser.add_argument("--tile-size", type=int, default=32,
+                        help="tile edge in pixels for /video?mode=tiles, a multiple of 16")
+    parser.add_argument("--tile-threshold", type=float, default=4,
+                        help="mean absolute pixel difference at which a tile counts as changed")
+    parser.add_argument("--tile-refresh", type=float, default=2,
+                        help="seconds between tile-mode keyframes")
+    parser.add_argument("--jpeg-encoder", default="auto", choices=("auto", *ENCODERS),
+                        help="JPEG encoder backend; auto benchmarks the available ones on a real frame at startup")
+    parser.add_argument("--tcp-video-port", type=int,
+                        help="also serve the video feed as length-prefixed JPEGs on this TCP port")
+    parser.add_argument("--tcp-audio-port", type=int,
+                        help="also serve the microphone as length-prefixed PCM chunks on this TCP port")
+    parser.add_argument("--rtp-audio-port", type=int,
+                        help="UDP port receivers send a datagram to for RTP audio (0 for any free port)")
+    parser.add_argument("--rtp-audio-target", action="append", default=[], metavar="HOST:PORT",
+                        help="always send RTP audio to this receiver (repeatable)")
+    parser.add_argument("--rtp-audio-token",
+                        help="secret receivers send to --rtp-audio-port to subscribe (required with it)")
+    parser.add_argument("--admin-token",
+                        help="secret the /admin endpoints require in an X-Admin-Token header (default: localhost only)")
+    parser.add_argument("--rtp-audio-allow", action="append", default=[], metavar="HOST",
+                        help="only accept RTP subscriptions from this host (repeatable)")
+    parser.add_argument("--audio-input", default="portaudio",
+                        help="microphone backend: portaudio or replay:WAV (looped in real time)")
+    parser.add_argument("--audio-output", default="portaudio",
+                        help="speaker backend: portaudio, null, or null:WAV to save what would have played")
+    parser.add_argument("--timelapse", action="store_true",
+                        help="keep a downscaled still every --timelapse-interval seconds, playable from /timelapse/render")
+    parser.add_argument("--timelapse-interval", type=float, default=10,
+                        help="seconds between timelapse stills")
+    parser.add_argument("--timelapse-width", type=int, default=480,
+                        help="width timelapse stills are scaled down to")
+    parser.add_argument("--timelapse-keep-days", type=int, default=7,
+                        help="days of timelapse stills to keep")
+    parser.add_argument("--timelapse-max-gb", type=float, default=2,
+                        help="disk space for the timelapse; the oldest days are dropped beyond it")
+    parser.add_argument("--max-videos-gb", type=float,
+                        help="disk space for saved clips; the oldest are evicted beyond it (default: no size cap)")
+    parser.add_argument("--min-free-gb", type=float,
+                        help="also evict the oldest clips while the disk has less than this free "
+                             "(off by default, as the timelapse and DVR share the disk)")
+    parser.add_argument("--dvr", action="store_true",
+                        help="record the video feed continuously, extractable from /dvr/extract")
+    parser.add_argument("--dvr-segment-seconds", type=int, default=60,
+                        help="length of each continuous recording segment")
+    parser.add_argument("--dvr-max-gb", type=float, default=8,
+                        help="disk space for continuous recording; the oldest segments are dropped beyond it "
+                             "(the default holds about 2 hours of full-rate 640x480 video)")
+    args = parser.parse_args()
+    video_handler.stamp_frames = args.stamp_frames
     try:
-        import uvicorn
-        
-        http_server_thread = threading.Thread(
-            target=lambda: uvicorn.run(app, host="0.0.0.0", port=5004, log_level="info"),
-            daemon=True
-        )
-        http_server_thread.start()
-
-        notifications_server_thread = threading.Thread(
-            target=lambda: uvicorn.run(notifications_app, host="0.0.0.0", port=5005, log_level="info"),
-            daemon=True
-        )
-        notifications_server_thread.start()
+        hires_size = tuple(int(part) for part in args.roi_resolution.split("x")) if args.roi_resolution else None
+        video_handler.source = create_frame_source(args.video_source, fps=args.video_fps, hires_size=hires_size)
+        video_handler.named_rois = dict(parse_named_roi(value) for value in args.roi)
+        # Tiles aligned to 16 px JPEG macroblocks don't bleed into their neighbours in the atlas
+        if args.tile_size <= 0 or args.tile_size % 16:
+            raise ValueError("--tile-size must be a positive multiple of 16")
+        video_handler.tile_feed.tile_size = args.tile_size
+        video_handler.tile_feed.threshold = args.tile_threshold
+        video_handler.tile_feed.refresh_seconds = args.tile_refresh
+        if args.jpeg_encoder != "auto":
+            create_jpeg_encoder(args.jpeg_encoder)
+        video_handler.jpeg_encoder = args.jpeg_encoder
+        transports.tcp_video_port = args.tcp_video_port
+        transports.tcp_audio_port = args.tcp_audio_port
+        transports.rtp_audio_port = args.rtp_audio_port
+        transports.rtp.fixed_targets = {parse_address(target) for target in args.rtp_audio_target}
+        if args.rtp_audio_port is not None and not args.rtp_audio_token:
+            raise ValueError("--rtp-audio-port needs --rtp-audio-token, or anyone could listen to the microphone")
+        transports.rtp.token = args.rtp_audio_token
+        app.state.admin_token = args.admin_token
+        transports.rtp.allowed_hosts = {parse_address(f"{host}:1")[0] for host in args.rtp_audio_allow}
+        audio_handler.backend = create_audio_input(args.audio_input)
+        mic_handler.backend = create_audio_output(args.audio_output)
+        if args.timelapse_interval <= 0:
+            raise ValueError("--timelapse-interval must be positive")
+        timelapse.interval = args.timelapse_interval
+        if not MIN_ROI_WIDTH <= args.timelapse_width <= MAX_ROI_WIDTH:
+            raise ValueError(f"--timelapse-width must be between {MIN_ROI_WIDTH} and {MAX_ROI_WIDTH}")
+        timelapse.width = args.timelapse_width
+        if args.timelapse_keep_days <= 0:
+            raise ValueError("--timelapse-keep-days must be positive")
+        if args.timelapse_max_gb <= 0:
+            raise ValueError("--timelapse-max-gb must be positive")
+        timelapse.enabled = args.timelapse
+        timelapse.keep_days = args.timelapse_keep_days
+        timelapse.max_bytes = int(args.timelapse_max_gb * 1024 ** 3)
+        if args.dvr_segment_seconds <= 0:
+            raise ValueError("--dvr-segment-seconds must be positive")
+        dvr.enabled = args.dvr
+        dvr.segment_seconds = args.dvr_segment_seconds
+        dvr.max_bytes = int(args.dvr_max_gb * 1024 ** 3)
+        if args.max_videos_gb is not None:
+            if args.max_videos_gb <= 0:
+                raise ValueError("--max-videos-gb must be positive")
+            retention_manager.max_bytes = int(args.max_videos_gb * 1024 ** 3)
+        if args.min_free_gb is not None:
+            if args.min_free_gb <= 0:
+                raise ValueError("--min-free-gb must be positive")
+            retention_manager.min_free_bytes = int(args.min_free_gb * 1024 ** 3)
+    except ValueError as e:
+        parser.error(str(e))
 
+    try:
         asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("Server shutdown requested")
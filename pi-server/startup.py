@@ -0,0 +1,110 @@
+"""
+Background initialisation and readiness tracking.
+
+The server answers HTTP as soon as uvicorn is listening. Devices and the
+recordings catch-up start concurrently in worker threads; each is reported
+by `/ready` as pending, starting, ready or failed, and endpoints that need
+a device wait for it instead of failing while it comes up.
+"""
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Subsystem:
+    def __init__(self, name):
+        self.name = name
+        self.state = "pending"
+        self.error = None
+        self.started = None
+        self.finished = None
+        self.done = asyncio.Event()
+
+    @property
+    def duration(self):
+        if self.started is None:
+            return None
+        return (self.finished or time.monotonic()) - self.started
+
+    def to_dict(self):
+        return {
+            "state": self.state,
+            "error": self.error,
+            "seconds": round(self.duration, 3) if self.duration is not None else None,
+        }
+
+
+class Startup:
+    """
+    Starts subsystems concurrently and records how long each phase took,
+    measured from `began` (taken before the server's imports).
+    """
+
+    def __init__(self, began):
+        self.began = began
+        self.phases = {}
+        self.subsystems = {}
+        self.tasks = []
+        self.breakdown_task = None
+
+    def mark(self, phase):
+        """Record that `phase` finished now, e.g. imports or serving."""
+        self.phases[phase] = time.monotonic() - self.began
+
+    def launch(self, initializers):
+        """Run each `name: blocking function` in its own thread, all at once."""
+        for name in initializers:
+            self.subsystems[name] = Subsystem(name)
+        self.tasks = [
+            asyncio.create_task(self.initialize(self.subsystems[name], function))
+            for name, function in initializers.items()
+        ]
+        self.breakdown_task = asyncio.create_task(self.log_breakdown())
+
+    async def initialize(self, subsystem, function):
+        subsystem.state = "starting"
+        subsystem.started = time.monotonic()
+        try:
+            await asyncio.to_thread(function)
+            subsystem.state = "ready"
+        except Exception as e:
+            subsystem.state = "failed"
+            subsystem.error = str(e)
+            logger.error(f"Failed to start {subsystem.name}: {e}")
+        finally:
+            subsystem.finished = time.monotonic()
+            subsystem.done.set()
+
+    async def wait(self, name):
+        """Wait for a subsystem to finish starting; True if it is ready."""
+        subsystem = self.subsystems.get(name)
+        if subsystem is None:
+            return False
+        await subsystem.done.wait()
+        return subsystem.state == "ready"
+
+    @property
+    def ready(self):
+        return bool(self.subsystems) and all(
+            subsystem.state == "ready" for subsystem in self.subsystems.values()
+        )
+
+    def status(self):
+        return {
+            "ready": self.ready,
+            "uptime": round(time.monotonic() - self.began, 3),
+            "phases": {phase: round(seconds, 3) for phase, seconds in self.phases.items()},
+            "subsystems": {name: subsystem.to_dict() for name, subsystem in self.subsystems.items()},
+        }
+
+    async def log_breakdown(self):
+        await asyncio.gather(*(subsystem.done.wait() for subsystem in self.subsystems.values()))
+        self.mark("initialized")
+        parts = [f"{phase} at {seconds:.2f}s" for phase, seconds in self.phases.items()]
+        parts += [
+            f"{name} {subsystem.state} in {subsystem.duration:.2f}s"
+            for name, subsystem in self.subsystems.items()
+        ]
+        logger.info(f"Startup breakdown: {', '.join(parts)}")
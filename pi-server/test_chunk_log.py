@@ -0,0 +1,100 @@
+import os
+
+import pytest
+
+from chunk_log import INDEX_ENTRY, RECORD_HEADER, ChunkLog
+
+
+def per_ten_seconds(timestamp):
+    return f"chunk-{int(timestamp) // 10:04d}"
+
+
+@pytest.fixture
+def log(tmp_path):
+    log = ChunkLog(str(tmp_path), per_ten_seconds, fsync_interval=0)
+    log.open()
+    yield log
+    log.close()
+
+
+def payload(timestamp):
+    return f"frame at {timestamp:06.1f}".encode() * 3
+
+
+def test_reads_a_range_across_chunks(log):
+    for timestamp in range(5, 35):
+        log.append(float(timestamp), payload(timestamp))
+
+    assert [chunk["chunk"] for chunk in log.stats()] == ["chunk-0000", "chunk-0001", "chunk-0002", "chunk-0003"]
+    assert log.count(8, 21.5) == 14
+    assert list(log.read(8, 21.5)) == [(float(t), payload(t)) for t in range(8, 22)]
+    assert list(log.read(100, 200)) == []
+
+
+def test_index_survives_reopening_and_drops_torn_records(tmp_path, log):
+    for timestamp in range(10, 15):
+        log.append(float(timestamp), payload(timestamp))
+    log.close()
+    # The last record only half reached the data file
+    data_path = tmp_path / "chunk-0001.chunk"
+    os.truncate(data_path, os.path.getsize(data_path) - 5)
+
+    reopened = ChunkLog(str(tmp_path), per_ten_seconds)
+    reopened.open()
+    try:
+        assert list(reopened.read(0, 100)) == [(float(t), payload(t)) for t in range(10, 14)]
+        # Appending carries on after the last whole record
+        reopened.append(15.0, payload(15))
+        assert list(reopened.read(14, 100)) == [(15.0, payload(15))]
+    finally:
+        reopened.close()
+
+
+def test_preallocated_tail_left_by_a_crash_is_ignored(tmp_path):
+    log = ChunkLog(str(tmp_path), per_ten_seconds, preallocate=64 * 1024)
+    log.open()
+    log.append(10.0, payload(10))
+    # An index entry whose record never got past the preallocated zeros
+    log.index_file.write(INDEX_ENTRY.pack(11.0, 1000 + RECORD_HEADER.size, 100))
+    log.index_file.flush()
+    log.data_file.flush()
+    # Crash: the files are left open and preallocated
+
+    reopened = ChunkLog(str(tmp_path), per_ten_seconds, preallocate=64 * 1024)
+    reopened.open()
+    try:
+        assert list(reopened.read(0, 100)) == [(10.0, payload(10))]
+        assert os.path.getsize(tmp_path / "chunk-0001.chunk") == RECORD_HEADER.size + len(payload(10))
+    finally:
+        reopened.close()
+        log.data_file.close()
+        log.index_file.close()
+
+
+def test_remove_before_keeps_the_chunk_being_written(log):
+    for timestamp in (5, 15, 25):
+        log.append(float(timestamp), payload(timestamp))
+    # The clock stepped back: the chunk being written sorts before the cut-off
+    log.append(2.0, payload(2))
+
+    log.remove_before("chunk-0002")
+
+    assert [chunk["chunk"] for chunk in log.stats()] == ["chunk-0000", "chunk-0002"]
+    assert not os.path.exists(os.path.join(log.directory, "chunk-0001.chunk"))
+    assert not os.path.exists(os.path.join(log.directory, "chunk-0001.idx"))
+
+
+def test_remove_before_enforces_max_bytes(log):
+    for timestamp in range(0, 40, 2):
+        log.append(float(timestamp), payload(timestamp))
+    chunk_bytes = log.stats()[0]["bytes"]
+    log.max_bytes = chunk_bytes * 2
+
+    log.remove_before("chunk-0000")
+
+    assert [chunk["chunk"] for chunk in log.stats()] == ["chunk-0002", "chunk-0003"]
+
+    # The chunk being written stays even when it alone is over the cap
+    log.max_bytes = 1
+    log.remove_before("chunk-0000")
+    assert [chunk["chunk"] for chunk in log.stats()] == ["chunk-0003"]
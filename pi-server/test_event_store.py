@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+from event_store import EventStore
+from recordings_index import RecordingsIndex
+
+
+@pytest.fixture
+def store(tmp_path):
+    video_dir = tmp_path / "videos"
+    video_dir.mkdir()
+    index = RecordingsIndex(str(video_dir))
+    store = EventStore(index)
+    yield store
+    store.close()
+    index.close()
+
+
+def page_ids(store, limit, **filters):
+    pages, cursor = [], None
+    while True:
+        events, cursor = store.list(limit=limit, cursor=cursor, **filters)
+        pages.append([event["id"] for event in events])
+        if cursor is None:
+            return pages
+
+
+def test_cursor_pages_through_equal_timestamps(store):
+    for event_id in ("a", "b", "c", "d", "e"):
+        store.record(event_id, created=100.0 if event_id != "e" else 50.0)
+
+    assert page_ids(store, 2) == [["d", "c"], ["b", "a"], ["e"]]
+
+
+def test_cursor_pages_within_a_label(store):
+    for event_id in ("a", "b", "c", "d"):
+        store.record(event_id, created=100.0, labels={"person": 0.9} if event_id != "c" else {"cat": 0.9})
+
+    assert page_ids(store, 2, label="Person") == [["d", "b"], ["a"]]
+
+
+def test_min_score_filters_within_a_label(store):
+    store.record("low", created=1.0, labels={"person": 0.2})
+    store.record("high", created=2.0, labels={"person": 0.8})
+    store.record("unscored", created=3.0, labels={"person": None})
+
+    assert page_ids(store, 10, label="person", min_score=0.5) == [["high"]]
+
+
+def test_labels_keep_their_highest_score_and_stay_unscored_until_one_arrives(store):
+    store.record("e", labels={"person": None, "cat": 0.7, "dog": None})
+    event = store.record("e", labels={"person": None, "cat": 0.4, "dog": 0.3})
+
+    assert event["labels"] == {"person": None, "cat": 0.7, "dog": 0.3}
+
+
+def test_recording_again_merges_data_and_keeps_the_original_time(store):
+    store.record("e", created=10.0, data={"doorbell": True})
+    event = store.record("e", created=20.0, data={"clip": "notification_e.mp4"})
+
+    assert event["created"] == 10.0
+    assert event["data"] == {"doorbell": True, "clip": "notification_e.mp4"}
+
+
+def test_events_link_to_their_clips(store):
+    index = store.recordings_index
+    with open(os.path.join(index.video_dir, "notification_e.mp4"), "wb") as clip:
+        clip.write(b"\0" * 100)
+    index.add("notification_e.mp4", created=5.0)
+    store.record("e")
+
+    assert [clip["filename"] for clip in store.get("e")["clips"]] == ["notification_e.mp4"]
+    assert store.delete("e")
+    assert store.get("e") is None
+    assert index.get("notification_e.mp4") is not None
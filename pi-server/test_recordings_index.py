@@ -0,0 +1,103 @@
+import os
+
+import pytest
+
+from recordings_index import RecordingsIndex
+
+
+def write_clip(video_dir, filename, size=100):
+    with open(os.path.join(video_dir, filename), "wb") as clip:
+        clip.write(b"\0" * size)
+
+
+@pytest.fixture
+def index(tmp_path):
+    video_dir = tmp_path / "videos"
+    video_dir.mkdir()
+    index = RecordingsIndex(str(video_dir))
+    yield index
+    index.close()
+
+
+def test_database_lives_next_to_the_videos_directory(index, tmp_path):
+    assert index.db_path == str(tmp_path / "recordings.db")
+    assert os.path.exists(index.db_path)
+
+
+def test_every_change_bumps_the_generation(index):
+    write_clip(index.video_dir, "a.mp4")
+    start = index.generation
+
+    index.add("a.mp4", created=1.0)
+    assert index.generation == start + 1
+    index.add("a.mp4", created=1.0)
+    assert index.generation == start + 2
+    index.remove("a.mp4")
+    assert index.generation == start + 3
+    # Removing what isn't indexed changes nothing, so cached listings stay valid
+    index.remove("a.mp4")
+    assert index.generation == start + 3
+
+
+def test_events_since_replays_changes_in_order(index):
+    write_clip(index.video_dir, "a.mp4")
+    write_clip(index.video_dir, "b.mp4")
+    start = index.generation
+    index.add("a.mp4", created=1.0)
+    index.add("b.mp4", created=2.0)
+    index.remove("a.mp4")
+
+    events = index.events_since(start)
+    assert [(event["type"], event["filename"]) for event in events] == [
+        ("add", "a.mp4"), ("add", "b.mp4"), ("delete", "a.mp4"),
+    ]
+    assert events[1]["recording"]["created"] == 2.0
+    assert index.events_since(index.generation) == []
+    # A client ahead of the index (e.g. it was recreated) has to reload
+    assert index.events_since(index.generation + 1) is None
+
+
+def test_list_pages_through_equal_timestamps(index):
+    for name in ("a.mp4", "b.mp4", "c.mp4", "d.mp4"):
+        write_clip(index.video_dir, name)
+        index.add(name, created=5.0 if name != "d.mp4" else 9.0)
+
+    pages, cursor = [], None
+    while True:
+        rows, cursor = index.list(limit=2, cursor=cursor)
+        pages.append([row["filename"] for row in rows])
+        if cursor is None:
+            break
+    assert pages == [["d.mp4", "c.mp4"], ["b.mp4", "a.mp4"]]
+
+
+def test_notification_clips_are_linked_to_their_event(index):
+    write_clip(index.video_dir, "notification_42.mp4")
+    index.add("notification_42.mp4")
+    assert index.get("notification_42.mp4")["event_id"] == "42"
+
+
+def test_reconcile_indexes_new_drops_missing_and_refreshes_changed(index):
+    for name in ("kept.mp4", "gone.mp4", "grown.mp4"):
+        write_clip(index.video_dir, name)
+        index.add(name, created=1.0)
+    os.remove(os.path.join(index.video_dir, "gone.mp4"))
+    write_clip(index.video_dir, "grown.mp4", size=500)
+    write_clip(index.video_dir, "new.mp4")
+    # Clips still being written are hidden and left alone
+    write_clip(index.video_dir, ".partial.mp4")
+    start = index.generation
+
+    index.reconcile()
+
+    rows, _ = index.list()
+    assert sorted(row["filename"] for row in rows) == ["grown.mp4", "kept.mp4", "new.mp4"]
+    assert index.get("grown.mp4")["size"] == 500
+    assert sorted((event["type"], event["filename"]) for event in index.events_since(start)) == [
+        ("add", "new.mp4"), ("delete", "gone.mp4"), ("update", "grown.mp4"),
+    ]
+
+    # A second pass finds nothing to do
+    generation = index.generation
+    index.reconcile()
+    assert index.generation == generation
@@ -0,0 +1,70 @@
+import os
+
+import pytest
+
+from recordings_index import RecordingsIndex
+from retention import DAY, RetentionManager
+
+
+@pytest.fixture
+def index(tmp_path):
+    video_dir = tmp_path / "videos"
+    video_dir.mkdir()
+    index = RecordingsIndex(str(video_dir))
+    yield index
+    index.close()
+
+
+def add_clip(index, filename, created, size=1000):
+    with open(os.path.join(index.video_dir, filename), "wb") as clip:
+        clip.write(b"\0" * size)
+    index.add(filename, created=created)
+
+
+def manager(index, **options):
+    return RetentionManager(index, downgrade_after=None, batch_size=2, batch_pause=0, **options)
+
+
+def test_over_quota_evicts_oldest_first(index):
+    for i in range(5):
+        add_clip(index, f"clip{i}.mp4", created=1000.0 + i)
+    retention = manager(index, max_bytes=2500, max_age=None)
+
+    retention.sweep()
+
+    rows, _ = index.list()
+    assert sorted(row["filename"] for row in rows) == ["clip3.mp4", "clip4.mp4"]
+    assert sorted(os.listdir(index.video_dir)) == ["clip3.mp4", "clip4.mp4"]
+    assert retention.stats["evicted_by_quota"] == 3
+    assert retention.stats["evicted_bytes"] == 3000
+
+
+def test_expired_clips_are_evicted_by_age(index, monkeypatch):
+    now = 100 * DAY
+    monkeypatch.setattr("retention.time.time", lambda: now)
+    add_clip(index, "old.mp4", created=now - 31 * DAY)
+    add_clip(index, "new.mp4", created=now - DAY)
+
+    manager(index).sweep()
+
+    assert [row["filename"] for row in index.list()[0]] == ["new.mp4"]
+
+
+def test_undeletable_clips_do_not_stall_the_sweep(index, monkeypatch):
+    add_clip(index, "stuck.mp4", created=1.0)
+    monkeypatch.setattr("retention.os.remove", lambda path: (_ for _ in ()).throw(PermissionError(path)))
+    retention = manager(index, max_bytes=0, max_age=None)
+
+    retention.sweep()
+
+    assert index.get("stuck.mp4") is not None
+    assert retention.stats["errors"] == 1
+
+
+def test_files_already_gone_are_still_unindexed(index):
+    add_clip(index, "gone.mp4", created=1.0)
+    os.remove(os.path.join(index.video_dir, "gone.mp4"))
+
+    manager(index, max_bytes=0, max_age=None).sweep()
+
+    assert index.get("gone.mp4") is None
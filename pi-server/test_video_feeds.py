@@ -0,0 +1,124 @@
+import numpy as np
+import pytest
+
+from video_feeds import TILE_HEADER, TILE_KEYFRAME, TILE_MAGIC, TileFeed
+
+
+def fake_jpeg(image):
+    """Stands in for a JPEG encoder: the image's height and width, then its pixels."""
+    return np.array(image.shape[:2], "<u2").tobytes() + image.tobytes()
+
+
+def parse(message):
+    magic, flags, captured_at, width, height, size, count, atlas_columns = TILE_HEADER.unpack_from(message)
+    assert magic == TILE_MAGIC
+    body = message[TILE_HEADER.size:]
+    indices = np.frombuffer(body[:count * 2], "<u2").tolist()
+    jpeg = body[count * 2:]
+    return {
+        "keyframe": bool(flags & TILE_KEYFRAME),
+        "captured_at": captured_at,
+        "frame_size": (width, height),
+        "tile_size": size,
+        "indices": indices,
+        "atlas_columns": atlas_columns,
+        "image_size": tuple(np.frombuffer(jpeg[:4], "<u2")),
+    }
+
+
+@pytest.fixture
+def feed():
+    # Keyframes only when asked for or when most tiles change
+    return TileFeed(tile_size=32, threshold=4.0, refresh_seconds=3600)
+
+
+def frame(height=64, width=96):
+    return np.full((height, width, 3), 100, np.uint8)
+
+
+def test_first_frame_is_a_keyframe(feed):
+    message = parse(feed.encode(frame(), 1.5, fake_jpeg))
+
+    assert message["keyframe"]
+    assert message["captured_at"] == 1.5
+    assert message["frame_size"] == (96, 64)
+    assert message["image_size"] == (64, 96)
+
+
+def test_unchanged_frame_sends_nothing(feed):
+    feed.encode(frame(), 1.0, fake_jpeg)
+
+    assert feed.encode(frame(), 2.0, fake_jpeg) is None
+
+
+def test_changed_tiles_are_packed_into_an_atlas(feed):
+    feed.encode(frame(), 1.0, fake_jpeg)
+    changed = frame()
+    changed[40:50, 70:80] = 200  # Row 1, column 2: tile 5
+
+    message = parse(feed.encode(changed, 2.0, fake_jpeg))
+
+    assert not message["keyframe"]
+    assert message["indices"] == [5]
+    assert message["image_size"] == (32, 32)
+    # Viewers now have the change, so the same frame again sends nothing
+    assert feed.encode(changed, 3.0, fake_jpeg) is None
+
+
+def test_small_differences_stay_under_the_threshold(feed):
+    feed.encode(frame(), 1.0, fake_jpeg)
+    noisy = frame()
+    noisy[0:32, 0:32] += 2
+
+    assert feed.encode(noisy, 2.0, fake_jpeg) is None
+
+
+def test_frames_that_are_not_whole_tiles_are_padded(feed):
+    feed.encode(frame(50, 70), 1.0, fake_jpeg)
+    changed = frame(50, 70)
+    changed[40:50, 64:70] = 0  # The bottom-right tile, mostly padding
+
+    message = parse(feed.encode(changed, 2.0, fake_jpeg))
+
+    assert message["frame_size"] == (70, 50)
+    assert message["indices"] == [5]
+
+
+def test_mostly_changed_frame_becomes_a_keyframe(feed):
+    feed.encode(frame(), 1.0, fake_jpeg)
+
+    assert parse(feed.encode(frame() + 50, 2.0, fake_jpeg))["keyframe"]
+
+
+def test_failed_update_encode_forces_a_keyframe(feed):
+    feed.encode(frame(), 1.0, fake_jpeg)
+    changed = frame()
+    changed[0:10, 0:10] = 0
+
+    assert feed.encode(changed, 2.0, lambda image: None) is None
+    assert parse(feed.encode(changed, 3.0, fake_jpeg))["keyframe"]
+
+
+def publish(feed, image, captured_at):
+    message = feed.encode(image, captured_at, fake_jpeg)
+    feed.publish(message, captured_at)
+    return feed.latest[0]
+
+
+def test_since_replays_from_the_newest_keyframe(feed):
+    first = publish(feed, frame(), 1.0)
+    changed = frame()
+    changed[0:10, 0:10] = 0
+    second = publish(feed, changed, 2.0)
+    changed[0:10, 40:50] = 0
+    third = publish(feed, changed, 3.0)
+
+    assert [entry[0] for entry in feed.since(None)] == [first, second, third]
+    assert [entry[0] for entry in feed.since(first)] == [second, third]
+    assert feed.since(third) == []
+
+    feed.request_refresh()
+    keyframe = publish(feed, changed, 4.0)
+    # A viewer whose position fell out of the history starts again at the keyframe
+    assert [(entry[0], entry[2]) for entry in feed.since(second)] == [(keyframe, True)]
+    assert feed.since(keyframe) == []
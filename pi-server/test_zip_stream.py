@@ -0,0 +1,40 @@
+import io
+import zipfile
+
+from zip_stream import stream_zip
+
+
+def test_archive_round_trips_through_zipfile(tmp_path):
+    contents = {"a.mp4": b"first clip" * 1000, "b.mp4": b"", "c.mp4": bytes(range(256)) * 50}
+    for name, data in contents.items():
+        (tmp_path / name).write_bytes(data)
+
+    chunks = list(stream_zip(((str(tmp_path / name), f"clips/{name}") for name in contents), chunk_size=4096))
+
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == [f"clips/{name}" for name in contents]
+        for info in archive.infolist():
+            # Sizes and CRC follow each entry in a data descriptor, as nothing was seeked back to
+            assert info.flag_bits & 0x08
+            assert info.compress_type == zipfile.ZIP_STORED
+            assert archive.read(info) == contents[info.filename.split("/")[1]]
+
+
+def test_chunks_stay_bounded_by_chunk_size(tmp_path):
+    (tmp_path / "big.mp4").write_bytes(b"\xab" * 100_000)
+
+    chunks = list(stream_zip([(str(tmp_path / "big.mp4"), "big.mp4")], chunk_size=8192))
+
+    # Each chunk is at most one read plus an entry header or descriptor
+    assert max(len(chunk) for chunk in chunks) < 8192 + 512
+
+
+def test_files_that_disappear_are_skipped(tmp_path):
+    (tmp_path / "kept.mp4").write_bytes(b"kept")
+
+    data = b"".join(stream_zip([(str(tmp_path / "gone.mp4"), "gone.mp4"), (str(tmp_path / "kept.mp4"), "kept.mp4")]))
+
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.namelist() == ["kept.mp4"]
+        assert archive.read("kept.mp4") == b"kept"
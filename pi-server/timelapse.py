@@ -0,0 +1,203 @@
+"""
+Optional continuous timelapse: one downscaled JPEG every `interval` seconds.
+
+Stills are appended to one chunk per local day (see chunk_log.py), so a
+day at the default 10 s interval is 8640 records in two files rather than
+8640 files. Any time range is rendered on demand by reading its chunks
+front to back, either as a multipart MJPEG stream a browser can play in
+an <img>, or piped through ffmpeg into a fragmented MP4. Days older than
+`keep_days` are dropped, and the oldest days beyond `max_bytes`.
+"""
+import asyncio
+import collections
+import logging
+import threading
+import time
+
+import metrics
+from chunk_log import ChunkLog, iterate_in_thread
+from media_tools import stream_ffmpeg
+
+logger = logging.getLogger(__name__)
+
+MJPEG_BOUNDARY = "timelapse-frame"
+
+
+def day_chunk(timestamp):
+    return time.strftime("%Y-%m-%d", time.localtime(timestamp))
+
+
+class RenderStats:
+    """Throughput of one render: frames and bytes read, and the time spent reading them."""
+
+    def __init__(self, format, start, end):
+        self.format = format
+        self.start = start
+        self.end = end
+        self.began = time.monotonic()
+        self.finished = None
+        self.frames = 0
+        self.bytes_read = 0
+        self.read_seconds = 0.0
+        self.completed = False
+
+    def finish(self, completed):
+        self.finished = time.monotonic()
+        self.completed = completed
+        metrics.TIMELAPSE_RENDER_FRAMES.labels(self.format).inc(self.frames)
+        metrics.TIMELAPSE_RENDER_SECONDS.labels(self.format).observe(self.finished - self.began)
+
+    def to_dict(self):
+        seconds = (self.finished or time.monotonic()) - self.began
+        return {
+            "format": self.format,
+            "start": self.start,
+            "end": self.end,
+            "frames": self.frames,
+            "bytes_read": self.bytes_read,
+            "seconds": round(seconds, 3),
+            "completed": self.completed,
+            "frames_per_second": round(self.frames / seconds, 1) if seconds else None,
+            "read_mb_per_second": round(self.bytes_read / self.read_seconds / 1e6, 1) if self.read_seconds else None,
+        }
+
+
+class TimelapseRecorder:
+    def __init__(
+        self, video_handler, directory="./timelapse", interval=10, width=480, keep_days=7, max_bytes=2 * 1024 ** 3,
+    ):
+        self.video_handler = video_handler
+        self.directory = directory
+        self.enabled = False
+        self.interval = interval
+        self.width = width
+        self.keep_days = keep_days
+        self.max_bytes = max_bytes
+        self.log = None
+        self.stopping = threading.Event()
+        self.thread = None
+        self.last_captured_at = None
+        self.renders = collections.deque(maxlen=20)
+        metrics.TIMELAPSE_BYTES.set_function(
+            lambda: sum(chunk["bytes"] for chunk in self.log.stats()) if self.log else 0
+        )
+
+    def start(self):
+        self.log = ChunkLog(self.directory, day_chunk, max_bytes=self.max_bytes)
+        self.log.open()
+        self.thread = threading.Thread(target=self.run, name="timelapse", daemon=True)
+        self.thread.start()
+        logger.info(
+            f"Timelapse recording every {self.interval}s at {self.width}px wide, keeping "
+            f"{self.keep_days} days and at most {self.max_bytes / 1024 ** 3:.1f} GiB"
+        )
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread:
+            self.thread.join(timeout=10)
+        if self.log:
+            self.log.close()
+
+    def run(self):
+        next_due = time.monotonic()
+        while not self.stopping.wait(max(0.0, next_due - time.monotonic())):
+            next_due += self.interval
+            try:
+                self.record()
+                self.log.remove_before(day_chunk(time.time() - self.keep_days * 86400))
+            except Exception as e:
+                logger.error(f"Timelapse capture failed: {e}")
+
+    def record(self):
+        """Append the newest captured frame, reusing the snapshot cache rather than capturing."""
+        captured_at, jpeg, _ = self.video_handler.snapshot(self.width)
+        if jpeg is None or captured_at == self.last_captured_at:
+            return
+        self.log.append(captured_at, jpeg)
+        self.last_captured_at = captured_at
+        metrics.TIMELAPSE_FRAMES.inc()
+
+    def count(self, start, end):
+        return self.log.count(start, end)
+
+    def read(self, start, end, stats):
+        """The stored stills in a range, timing the reads into `stats`."""
+        records = self.log.read(start, end)
+        while True:
+            reading = time.perf_counter()
+            record = next(records, None)
+            stats.read_seconds += time.perf_counter() - reading
+            if record is None:
+                return
+            stats.frames += 1
+            stats.bytes_read += len(record[1])
+            yield record
+
+    def begin_render(self, format, start, end):
+        stats = RenderStats(format, start, end)
+        self.renders.append(stats)
+        return stats
+
+    async def render_mjpeg(self, start, end, fps):
+        """Multipart JPEG parts for the range, paced to play at `fps`."""
+        stats = self.begin_render("mjpeg", start, end)
+        completed = False
+        try:
+            next_due = time.monotonic()
+            async for timestamp, jpeg in iterate_in_thread(self.read(start, end, stats)):
+                delay = next_due - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                next_due = max(next_due + 1 / fps, time.monotonic() - 1)
+                yield (
+                    f"--{MJPEG_BOUNDARY}\r\nContent-Type: image/jpeg\r\n"
+                    f"Content-Length: {len(jpeg)}\r\nX-Timestamp: {timestamp:.3f}\r\n\r\n"
+                ).encode() + jpeg + b"\r\n"
+            completed = True
+        finally:
+            stats.finish(completed)
+
+    async def render_mp4(self, start, end, fps):
+        """The range encoded by ffmpeg as it is read, streamed as fragmented MP4."""
+        stats = self.begin_render("mp4", start, end)
+
+        async def stills():
+            async for _, jpeg in iterate_in_thread(self.read(start, end, stats)):
+                yield jpeg
+
+        completed = False
+        try:
+            async for chunk in stream_ffmpeg(
+                ["-f", "image2pipe", "-c:v", "mjpeg", "-framerate", str(fps), "-i", "-",
+                 "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p",
+                 "-movflags", "frag_keyframe+empty_moov+default_base_moof", "-f", "mp4", "pipe:1"],
+                stills(),
+                low_priority=True,
+            ):
+                yield chunk
+            completed = True
+        except RuntimeError as e:
+            logger.error(f"Timelapse MP4 render failed: {e}")
+            raise
+        finally:
+            stats.finish(completed)
+
+    def status(self):
+        days = self.log.stats() if self.log else []
+        for day in days:
+            day["day"] = day.pop("chunk")
+        records = sum(day["records"] for day in days)
+        total_bytes = sum(day["bytes"] for day in days)
+        return {
+            "enabled": self.enabled,
+            "interval": self.interval,
+            "width": self.width,
+            "keep_days": self.keep_days,
+            "max_bytes": self.max_bytes,
+            "total_bytes": total_bytes,
+            # What a full day costs at the current interval, from the average still so far
+            "projected_bytes_per_day": int(total_bytes / records * 86400 / self.interval) if records else None,
+            "days": days,
+            "renders": [stats.to_dict() for stats in reversed(self.renders)],
+        }
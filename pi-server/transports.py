@@ -0,0 +1,289 @@
+"""
+Length-prefixed TCP and RTP/UDP transports for the live feeds.
+
+WebSockets suit browsers, but cost an HTTP upgrade, per-message framing
+and, when a client offers it, deflate attempts on JPEGs that will not
+shrink. LAN consumers such as NVR software can instead use:
+
+* TCP video and audio ports that send exactly the messages the `/video`
+  and `/audio` WebSockets do, each preceded by its length as a 4-byte
+  big-endian integer, the framing old/server5.py used. Video viewers share
+  the WebSocket viewers' feed and skip frames the same way; audio starts
+  with the sample rate as ASCII digits, then 16-bit little-endian PCM.
+* An RTP audio port (RFC 3550) for the lowest latency: L16 packets, i.e.
+  16-bit big-endian PCM (RFC 3551), with sequence numbers and sample
+  timestamps so receivers can spot loss. Send a datagram holding the
+  `--rtp-audio-token` to the port to receive the stream for
+  `SUBSCRIPTION_SECONDS`, and repeat it to keep receiving, or name fixed
+  receivers with `--rtp-audio-target`. Without the token anyone could
+  listen to the microphone, or spoof a source address to aim the stream at
+  someone else, so other datagrams are ignored; `--rtp-audio-allow` limits
+  subscriptions to some hosts as well, and at most `MAX_SUBSCRIBERS` are
+  served at once.
+  `GET /audio.sdp` describes the stream for players such as ffplay.
+
+Both are fed by the same capture and encode as the WebSocket clients.
+"""
+import array
+import asyncio
+import hmac
+import logging
+import random
+import socket
+import struct
+import sys
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+LENGTH_PREFIX = struct.Struct("!I")
+# Version 2, no padding, extension or CSRCs; marker and payload type; sequence; timestamp; SSRC
+RTP_HEADER = struct.Struct("!BBHII")
+RTP_VERSION = 0x80
+RTP_MARKER = 0x80
+# RFC 3551's static payload type for L16 mono at 44.1 kHz; anything else uses a dynamic one
+L16_MONO_44100 = 11
+DYNAMIC_PAYLOAD_TYPE = 96
+# Keeps every packet inside a 1500-byte Ethernet MTU once IP, UDP and RTP headers are added
+MAX_RTP_PAYLOAD = 1400
+SUBSCRIPTION_SECONDS = 30
+MAX_SUBSCRIBERS = 8
+MAX_RETRY_DELAY = 30.0
+
+
+def parse_address(value):
+    """Parse and resolve `HOST:PORT`, raising ValueError if it is malformed or unknown."""
+    host, separator, port = value.rpartition(":")
+    if not separator or not host or not port.isdigit() or not 0 < int(port) < 65536:
+        raise ValueError(f"Invalid address {value!r}; expected HOST:PORT")
+    try:
+        return socket.gethostbyname(host), int(port)
+    except OSError as e:
+        raise ValueError(f"Cannot resolve {host!r}: {e}") from None
+
+
+class FramedConnection:
+    """A TCP client behind the part of the WebSocket API the stream handlers use."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    async def accept(self):
+        sock = self.writer.get_extra_info("socket")
+        if sock is not None:
+            # Frames are written whole, so send each one as soon as it is written
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    async def send_bytes(self, data):
+        # One scatter write for prefix and payload
+        self.writer.writelines((LENGTH_PREFIX.pack(len(data)), data))
+        await self.writer.drain()
+
+    async def close(self, code=1000, reason=""):
+        if reason:
+            logger.info(f"Closing TCP client: {reason}")
+        self.writer.close()
+
+
+class RtpAudioSender(asyncio.DatagramProtocol):
+    """Sends every captured audio chunk to each RTP receiver as one or more L16 packets."""
+
+    def __init__(self, audio_handler):
+        self.audio_handler = audio_handler
+        self.transport = None
+        self.port = None
+        self.ready = False
+        self.fixed_targets = set()
+        # Subscribing datagrams must hold this token, optionally from one of `allowed_hosts`
+        self.token = None
+        self.allowed_hosts = set()
+        self.subscribers = {}  # address -> monotonic expiry
+        self.retry_delay = 1.0
+        self.retry_handle = None
+        self.sequence = random.getrandbits(16)
+        self.timestamp = random.getrandbits(32)
+        self.ssrc = random.getrandbits(32)
+        self.marker = RTP_MARKER
+        self.packets_sent = 0
+        self.bytes_sent = metrics.BYTES_SENT.labels("audio-rtp")
+        metrics.CONNECTED_CLIENTS.labels("audio-rtp").set_function(lambda: len(self.targets()))
+
+    @property
+    def payload_type(self):
+        handler = self.audio_handler
+        return L16_MONO_44100 if (handler.sample_rate, handler.channels) == (44100, 1) else DYNAMIC_PAYLOAD_TYPE
+
+    async def start(self, port):
+        loop = asyncio.get_running_loop()
+        self.transport, _ = await loop.create_datagram_endpoint(lambda: self, local_addr=("0.0.0.0", port or 0))
+        self.port = self.transport.get_extra_info("sockname")[1]
+        logger.info(f"RTP audio on UDP port {self.port}")
+
+    def datagram_received(self, data, address):
+        if not self.token or not hmac.compare_digest(data.strip(), self.token.encode()):
+            logger.debug(f"Ignoring RTP subscription without the token from {address[0]}:{address[1]}")
+            return
+        if self.allowed_hosts and address[0] not in self.allowed_hosts:
+            logger.warning(f"Ignoring RTP subscription from {address[0]}, which is not allowed")
+            return
+        if address not in self.subscribers:
+            if len(self.targets()) >= MAX_SUBSCRIBERS:
+                logger.warning(f"Ignoring RTP subscription from {address[0]}:{address[1]}: receiver limit reached")
+                return
+            logger.info(f"RTP audio receiver {address[0]}:{address[1]} subscribed")
+        self.subscribers[address] = time.monotonic() + SUBSCRIPTION_SECONDS
+        self.listen()
+
+    def listen(self):
+        """Start taking audio chunks once the device is up and someone is receiving."""
+        self.retry_handle = None
+        if self.ready and self.transport and self.targets() and self.send not in self.audio_handler.sinks:
+            # Tell receivers the timeline restarted
+            self.marker = RTP_MARKER
+            self.audio_handler.add_sink(self.send)
+
+    def targets(self):
+        now = time.monotonic()
+        for address, expires in list(self.subscribers.items()):
+            if expires < now:
+                del self.subscribers[address]
+                logger.info(f"RTP audio receiver {address[0]}:{address[1]} expired")
+        return self.fixed_targets | self.subscribers.keys()
+
+    def send(self, chunk):
+        targets = self.targets()
+        if chunk is None and self.fixed_targets and self.transport is not None:
+            # Capture failed; nobody will subscribe again on behalf of fixed targets, so retry ourselves
+            self.audio_handler.remove_sink(self.send)
+            if self.retry_handle is None:
+                logger.info(f"Retrying RTP audio in {self.retry_delay:.0f}s")
+                self.retry_handle = asyncio.get_running_loop().call_later(self.retry_delay, self.listen)
+                self.retry_delay = min(self.retry_delay * 2, MAX_RETRY_DELAY)
+            return
+        if chunk is None or not targets or self.transport is None:
+            self.audio_handler.remove_sink(self.send)
+            return
+        self.retry_delay = 1.0
+        if sys.byteorder == "little":
+            # L16 is big-endian on the wire
+            samples = array.array("h", chunk)
+            samples.byteswap()
+            chunk = samples.tobytes()
+        frame_bytes = 2 * self.audio_handler.channels
+        packets = -(-len(chunk) // MAX_RTP_PAYLOAD)
+        # Split evenly on whole sample frames
+        step = -(-len(chunk) // packets // frame_bytes) * frame_bytes
+        payload_type = self.payload_type
+        for offset in range(0, len(chunk), step):
+            payload = chunk[offset:offset + step]
+            packet = RTP_HEADER.pack(
+                RTP_VERSION, self.marker | payload_type, self.sequence, self.timestamp, self.ssrc
+            ) + payload
+            self.marker = 0
+            self.sequence = (self.sequence + 1) & 0xFFFF
+            self.timestamp = (self.timestamp + len(payload) // frame_bytes) & 0xFFFFFFFF
+            for address in targets:
+                self.transport.sendto(packet, address)
+            self.packets_sent += len(targets)
+            self.bytes_sent.inc(len(packet) * len(targets))
+
+    def sdp(self, host, port):
+        """Session description for a player listening on `port`."""
+        payload_type = self.payload_type
+        return "\r\n".join([
+            "v=0",
+            f"o=- {self.ssrc} 0 IN IP4 {host}",
+            "s=Doorbell audio",
+            "c=IN IP4 0.0.0.0",
+            "t=0 0",
+            f"m=audio {port} RTP/AVP {payload_type}",
+            f"a=rtpmap:{payload_type} L16/{self.audio_handler.sample_rate}/{self.audio_handler.channels}",
+            "a=recvonly",
+            "",
+        ])
+
+    def close(self):
+        if self.retry_handle:
+            self.retry_handle.cancel()
+            self.retry_handle = None
+        self.audio_handler.remove_sink(self.send)
+        if self.transport:
+            self.transport.close()
+            self.transport = None
+
+    def to_dict(self):
+        return {
+            "port": self.port,
+            "payload_type": self.payload_type,
+            "receivers": [f"{host}:{port}" for host, port in self.targets()],
+            "packets_sent": self.packets_sent,
+        }
+
+
+class Transports:
+    """The optional TCP and RTP listeners, started alongside the WebSocket server."""
+
+    def __init__(self, video_handler, audio_handler, device_ready):
+        self.video_handler = video_handler
+        self.audio_handler = audio_handler
+        # Coroutine function returning whether a named device started
+        self.device_ready = device_ready
+        self.tcp_video_port = None
+        self.tcp_audio_port = None
+        self.rtp_audio_port = None
+        self.rtp = RtpAudioSender(audio_handler)
+        self.servers = []
+        self.tasks = []
+
+    @property
+    def rtp_enabled(self):
+        return self.rtp_audio_port is not None or bool(self.rtp.fixed_targets)
+
+    async def start(self):
+        for port, serve, stream in (
+            (self.tcp_video_port, self.serve_video, "video"),
+            (self.tcp_audio_port, self.serve_audio, "audio"),
+        ):
+            if port is not None:
+                self.servers.append(await asyncio.start_server(serve, "0.0.0.0", port, reuse_address=True))
+                logger.info(f"Length-prefixed TCP {stream} on port {port}")
+        if self.rtp_enabled:
+            await self.rtp.start(self.rtp_audio_port)
+            self.tasks.append(asyncio.create_task(self.start_rtp()))
+
+    async def start_rtp(self):
+        if await self.device_ready("audio"):
+            self.rtp.ready = True
+            self.rtp.listen()
+
+    async def serve_video(self, reader, writer):
+        try:
+            if await self.device_ready("video"):
+                await self.video_handler.handle_client(FramedConnection(reader, writer), stream="video-tcp")
+        finally:
+            writer.close()
+
+    async def serve_audio(self, reader, writer):
+        try:
+            if await self.device_ready("audio"):
+                await self.audio_handler.handle_client(FramedConnection(reader, writer), stream="audio-tcp")
+        finally:
+            writer.close()
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        self.rtp.close()
+        # Not waiting for wait_closed(): connected viewers only end when the loop shuts down
+        for server in self.servers:
+            server.close()
+
+    def status(self):
+        return {
+            "tcp_video_port": self.tcp_video_port,
+            "tcp_audio_port": self.tcp_audio_port,
+            "rtp_audio": self.rtp.to_dict() if self.rtp_enabled else None,
+        }
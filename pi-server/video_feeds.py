@@ -0,0 +1,285 @@
+"""
+Encoded video feeds shared between viewers.
+
+Each feed holds the latest JPEG of one stream and the viewers waiting for
+it. The full view is one feed; each lower quality tier is another, and so
+is every distinct region of interest, so viewers who ask for the same
+tier or region share a single scale or crop and encode per frame.
+"""
+import collections
+import re
+import struct
+import threading
+import time
+
+import metrics
+
+# Regions are (x, y, width, height) as fractions of the full field of view
+FULL_VIEW = (0.0, 0.0, 1.0, 1.0)
+MIN_ROI_WIDTH = 16
+MAX_ROI_WIDTH = 1920
+# Simulcast tiers of the full view, by how many times smaller than the captured frame they are
+TIERS = {"full": 1, "half": 2, "thumb": 4}
+
+
+class FrameFeed:
+    def __init__(self):
+        self.latest = (0, None)  # (sequence number, JPEG)
+        self.latest_capture = (None, None)  # (capture time, JPEG), replaced as one tuple
+        self.subscribers = set()
+        # The last error scaling or encoding this feed, logged once instead of every frame
+        self.error = None
+
+    def publish(self, jpeg, captured_at):
+        """Called from the capture thread; wakes every subscriber on its own event loop."""
+        self.latest_capture = (captured_at, jpeg)
+        self.latest = (self.latest[0] + 1, jpeg)
+        for loop, wakeup in list(self.subscribers):
+            loop.call_soon_threadsafe(wakeup.set)
+
+
+class RoiFeed(FrameFeed):
+    def __init__(self, rect, size):
+        super().__init__()
+        self.rect = rect
+        self.size = size
+
+    def to_dict(self):
+        return {"rect": list(self.rect), "width": self.size[0], "height": self.size[1],
+                "viewers": len(self.subscribers), "error": self.error}
+
+
+class TierFeed(FrameFeed):
+    def __init__(self, name, divisor):
+        super().__init__()
+        self.name = name
+        self.divisor = divisor
+
+    def size(self, frame_size):
+        return tier_size(frame_size, self.divisor)
+
+    def to_dict(self, frame_size):
+        width, height = self.size(frame_size)
+        return {"width": width, "height": height, "viewers": len(self.subscribers), "error": self.error}
+
+
+class SnapshotCache:
+    """
+    Encoded stills of the newest captured frame, at most one per requested
+    width, so any number of pollers cost one encode per frame and width.
+    """
+
+    MAX_VARIANTS = 8
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.captured_at = None
+        self.variants = {}
+
+    def get(self, captured_at, width, encode):
+        """Return `(jpeg, cached)`, calling `encode()` on a miss."""
+        with self.lock:
+            if captured_at != self.captured_at:
+                self.captured_at = captured_at
+                self.variants = {}
+            jpeg = self.variants.get(width)
+            if jpeg is not None:
+                return jpeg, True
+            jpeg = encode()
+            if jpeg is not None and len(self.variants) < self.MAX_VARIANTS:
+                self.variants[width] = jpeg
+            return jpeg, False
+
+
+def parse_rect(value):
+    """Parse `x,y,width,height` fractions, raising ValueError unless it lies inside the frame."""
+    try:
+        rect = tuple(float(part) for part in value.split(","))
+    except ValueError:
+        raise ValueError(f"Invalid region {value!r}; expected x,y,width,height fractions") from None
+    if len(rect) != 4:
+        raise ValueError(f"Invalid region {value!r}; expected x,y,width,height fractions")
+    x, y, width, height = rect
+    if width <= 0 or height <= 0 or x < 0 or y < 0 or x + width > 1 or y + height > 1:
+        raise ValueError(f"Region {value!r} must lie within the frame")
+    return rect
+
+
+def parse_named_roi(value):
+    """Parse a `--roi NAME=x,y,width,height` command-line option."""
+    name, separator, rect = value.partition("=")
+    if not separator or not re.fullmatch(r"[\w-]+", name):
+        raise ValueError(f"Invalid named region {value!r}; expected NAME=x,y,width,height")
+    return name, parse_rect(rect)
+
+
+def roi_output_size(rect, frame_size, width=None):
+    """Output size for a region: `width` wide (default the view's width), keeping its aspect ratio."""
+    frame_width, frame_height = frame_size
+    # Relays forward `width` unchecked, so clamp it here too
+    width = max(MIN_ROI_WIDTH, min(int(width or frame_width), MAX_ROI_WIDTH))
+    aspect = (rect[3] * frame_height) / (rect[2] * frame_width)
+    # Encoders and browsers prefer even dimensions
+    return width - width % 2, max(2, int(round(width * aspect / 2)) * 2)
+
+
+def tier_size(frame_size, divisor):
+    """Size of a tier `divisor` times smaller than `frame_size`, rounded down to even dimensions."""
+    width, height = frame_size
+    return max(2, width // divisor // 2 * 2), max(2, height // divisor // 2 * 2)
+
+
+def crop_frame(frame, rect, size):
+    """Slice a region out of a frame and scale it to `size`. Returns a new array."""
+    import cv2
+
+    frame_height, frame_width = frame.shape[:2]
+    x, y, width, height = rect
+    left, top = int(x * frame_width), int(y * frame_height)
+    right = max(left + 1, int((x + width) * frame_width))
+    bottom = max(top + 1, int((y + height) * frame_height))
+    region = frame[top:bottom, left:right]
+    shrinking = region.shape[1] >= size[0]
+    return cv2.resize(region, size, interpolation=cv2.INTER_AREA if shrinking else cv2.INTER_LINEAR)
+
+
+# Tile update message header, little-endian: magic, flags, capture time, frame width and
+# height, tile size, number of tiles, and the tile atlas's width in tiles
+TILE_MAGIC = b"TILE"
+TILE_HEADER = struct.Struct("<4sBdHHHHH")
+TILE_KEYFRAME = 1
+
+
+class TileFeed(FrameFeed):
+    """
+    The full view as tile updates, for mostly static scenes.
+
+    Each frame is split into `tile_size` squares and compared with what
+    viewers were last sent by one vectorised block difference. Only the
+    tiles whose mean absolute difference exceeds `threshold` are encoded,
+    packed side by side into a single JPEG atlas; a frame with no changed
+    tiles costs no encode and sends nothing. A keyframe (the whole frame as
+    one JPEG) goes out every `refresh_seconds`, whenever most tiles changed,
+    and on request, so late joiners and viewers that fell behind recover.
+
+    Unlike the other feeds, every message after a keyframe matters, so the
+    messages since the newest keyframe are kept in `history` for viewers
+    to replay in order.
+
+    A message is `TILE_HEADER`, then for updates the changed tiles'
+    row-major indices as uint16, then the JPEG: the whole frame for a
+    keyframe, otherwise the atlas with the tiles in index order.
+    """
+
+    MAX_HISTORY = 300
+
+    def __init__(self, tile_size=32, threshold=4.0, refresh_seconds=2.0):
+        super().__init__()
+        self.tile_size = tile_size
+        self.threshold = threshold
+        self.refresh_seconds = refresh_seconds
+        self.history = collections.deque()  # (sequence, message, keyframe) since the newest keyframe
+        self.reference = None  # The frame as viewers have it, padded to whole tiles
+        self.last_keyframe = 0.0
+        self.refresh_requested = True
+        self.keyframes = metrics.VIDEO_TILE_MESSAGES.labels("keyframe")
+        self.updates = metrics.VIDEO_TILE_MESSAGES.labels("update")
+        self.tiles_sent = metrics.VIDEO_TILES_SENT.labels()
+
+    def request_refresh(self):
+        self.refresh_requested = True
+
+    def encode(self, frame, captured_at, encode_jpeg):
+        """
+        The message for a newly captured RGB frame, or None when nothing
+        changed. `encode_jpeg` may convert the array it is given in place;
+        `frame` itself is left untouched.
+        """
+        import numpy as np
+
+        height, width, channels = frame.shape
+        size = self.tile_size
+        rows, columns = -(-height // size), -(-width // size)
+        padded = frame
+        if (rows * size, columns * size) != (height, width):
+            padded = np.pad(frame, ((0, rows * size - height), (0, columns * size - width), (0, 0)), mode="edge")
+
+        now = time.monotonic()
+        if (
+            self.refresh_requested
+            or self.reference is None
+            or self.reference.shape != padded.shape
+            or now - self.last_keyframe >= self.refresh_seconds
+        ):
+            return self.keyframe(padded, frame, captured_at, encode_jpeg, now)
+
+        # Viewed as (rows, columns, size, size, channels) without copying
+        tiles = padded.reshape(rows, size, columns, size, channels).swapaxes(1, 2)
+        reference = self.reference.reshape(rows, size, columns, size, channels).swapaxes(1, 2)
+        # |a - b| on uint8 without widening the whole frame
+        difference = np.maximum(padded, self.reference) - np.minimum(padded, self.reference)
+        sums = difference.reshape(rows, size, columns, size, channels).sum(axis=(1, 3, 4), dtype=np.uint32)
+        changed = sums > self.threshold * size * size * channels
+        count = int(np.count_nonzero(changed))
+        if count == 0:
+            return None
+        if count > rows * columns // 2:
+            return self.keyframe(padded, frame, captured_at, encode_jpeg, now)
+
+        patches = tiles[changed]  # (count, size, size, channels), a copy in row-major tile order
+        reference[changed] = patches
+        atlas_columns = min(count, columns)
+        atlas_rows = -(-count // atlas_columns)
+        if atlas_rows * atlas_columns > count:
+            patches = np.concatenate(
+                [patches, np.zeros((atlas_rows * atlas_columns - count, size, size, channels), np.uint8)]
+            )
+        atlas = (
+            patches.reshape(atlas_rows, atlas_columns, size, size, channels)
+            .swapaxes(1, 2)
+            .reshape(atlas_rows * size, atlas_columns * size, channels)
+        )
+        jpeg = encode_jpeg(atlas)
+        if jpeg is None:
+            # Viewers never got these tiles, so resynchronise everyone
+            self.request_refresh()
+            return None
+        self.updates.inc()
+        self.tiles_sent.inc(count)
+        header = TILE_HEADER.pack(TILE_MAGIC, 0, captured_at, width, height, size, count, atlas_columns)
+        return header + np.flatnonzero(changed).astype("<u2").tobytes() + jpeg
+
+    def keyframe(self, padded, frame, captured_at, encode_jpeg, now):
+        jpeg = encode_jpeg(frame.copy())
+        if jpeg is None:
+            return None
+        self.reference = padded.copy()
+        self.refresh_requested = False
+        self.last_keyframe = now
+        self.keyframes.inc()
+        height, width = frame.shape[:2]
+        return TILE_HEADER.pack(TILE_MAGIC, TILE_KEYFRAME, captured_at, width, height, self.tile_size, 0, 0) + jpeg
+
+    def publish(self, message, captured_at):
+        sequence = self.latest[0] + 1
+        keyframe = bool(message[4] & TILE_KEYFRAME)
+        entry = (sequence, message, keyframe)
+        # Rebound rather than mutated where viewers might be iterating a snapshot of it
+        if keyframe:
+            self.history = collections.deque([entry])
+        else:
+            self.history.append(entry)
+            if len(self.history) >= self.MAX_HISTORY:
+                self.request_refresh()
+        super().publish(message, captured_at)
+
+    def since(self, sequence):
+        """
+        Messages after `sequence` a viewer should send, in order. With
+        `sequence` None, or if it fell out of the history, replay starts at
+        the newest keyframe.
+        """
+        history = list(self.history)
+        if sequence is not None and history and history[0][0] <= sequence + 1:
+            return [entry for entry in history if entry[0] > sequence]
+        return history
@@ -1,84 +1,712 @@
 import asyncio
-from picamera2 import Picamera2
+import glob
 import io
-import numpy as np
-from websockets.server import serve
-import cv2  # Add cv2 for image conversion
+import struct
+import os
 import logging
-from libcamera import ColorSpace
 import collections  # For deque to store video frames
+import concurrent.futures
+import queue
+import threading
 import time  # For timestamping video clips
-import imageio  # Use imageio for video writing
+from media_tools import temp_path_for
+from frame_sources import Picamera2Source
+from jpeg_encoders import benchmark, create_jpeg_encoder
+from video_feeds import (
+    FULL_VIEW, TIERS, FrameFeed, RoiFeed, SnapshotCache, TierFeed, TileFeed, crop_frame, parse_rect, roi_output_size,
+)
+import metrics
+from profiling import TRACER
 
 logger = logging.getLogger(__name__)
 
+# JPEG comment segment (marker, length, tag) carrying the capture time for benchmark.py
+FRAME_STAMP_PREFIX = b"\xff\xfe\x00\x0epits"
+
+CAPTURE_MODES = ("idle", "active")
+
+
+def read_power_watts(paths):
+    """Sum the power draw reported by battery or UPS power supplies, if the board has any."""
+    total = None
+    for path in paths:
+        try:
+            with open(path) as power_file:
+                total = (total or 0) + int(power_file.read()) / 1e6
+        except (OSError, ValueError):
+            continue
+    return total
+
+
+class ModeStats:
+    """Time, CPU, frames and (where measurable) energy spent in one capture mode."""
+
+    def __init__(self, mode):
+        self.seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.frames = 0
+        self.energy_joules = 0.0
+        self.metered_seconds = 0.0
+        self.seconds_counter = metrics.CAPTURE_MODE_SECONDS.labels(mode)
+        self.cpu_counter = metrics.CAPTURE_CPU_SECONDS.labels(mode)
+
+    def add(self, seconds, cpu_seconds, power_watts):
+        self.seconds += seconds
+        self.cpu_seconds += cpu_seconds
+        self.frames += 1
+        self.seconds_counter.inc(seconds)
+        self.cpu_counter.inc(cpu_seconds)
+        if power_watts is not None:
+            self.energy_joules += power_watts * seconds
+            self.metered_seconds += seconds
+
+    def to_dict(self):
+        return {
+            "seconds": round(self.seconds, 3),
+            "frames": self.frames,
+            "fps": round(self.frames / self.seconds, 2) if self.seconds else None,
+            "cpu_percent": round(100 * self.cpu_seconds / self.seconds, 2) if self.seconds else None,
+            "power_watts": (
+                round(self.energy_joules / self.metered_seconds, 3) if self.metered_seconds else None
+            ),
+        }
+
+
 class VideoStreamHandler:
-    def __init__(self):
+    """
+    Captures continuously on a background thread, independent of viewers.
+    With nobody watching it runs at `idle_fps` and only fills the pre-roll;
+    a connected viewer or an activity trigger ramps it to `full_fps` and
+    every viewer is sent the latest encoded frame. Viewers of a lower
+    quality tier share that tier's feed, scaled from the source's lores
+    frame when it has one. Viewers of a region of interest get their own
+    feed, cropped from the source's high-resolution frame when it has one
+    and from the regular frame otherwise. Each feed is encoded at most once
+    per frame, and only while someone watches it.
+    """
+
+    def __init__(self, source=None, full_fps=30, idle_fps=5, preroll_seconds=10):
         self.lock = asyncio.Lock()
-        self.picam2 = Picamera2()
-        self.config = self.picam2.create_video_configuration(
-            main={"size": (640, 480)},
-            controls={
-                "FrameDurationLimits": (33333, 33333)
-            },  # ~30fps
-            colour_space=ColorSpace.Smpte170m()  # Use Rec.709 color space
-        )
-        self.picam2.configure(self.config)
-        self.picam2.start()
-        full_res = self.picam2.camera_properties['PixelArraySize']
-        self.picam2.set_controls({"ScalerCrop": [0, 0, full_res[0], full_res[1]]})
+        # Any FrameSource works; replay and synthetic sources need no camera
+        self.source = source or Picamera2Source()
         self.clients = set()
-        self.frame_buffer = collections.deque(maxlen=300)  # Stores 10 seconds of video at 30fps (10 * 30 = 300 frames)
+        self.stamp_frames = False
+        self.full_fps = full_fps
+        self.idle_fps = idle_fps
+        self.preroll_seconds = preroll_seconds
+        self.jpeg_quality = 85
+        # A backend from jpeg_encoders, or "auto" to benchmark them on a real frame at startup
+        self.jpeg_encoder = "auto"
+        # (encoder, its encode timer), swapped together so other threads never see a mismatched pair
+        self.encoding = (None, None)
+        self.encoder_benchmark = None
+        # (capture time, RGB frame) pairs covering the last `preroll_seconds`
+        self.frame_buffer = collections.deque()
+        self.buffer_lock = threading.Lock()
+
+        self.mode = None
+        self.active_until = 0.0
+        self.feed = FrameFeed()
+        # Lower quality tiers of the full view; "full" is `feed` itself
+        self.tier_feeds = {name: TierFeed(name, divisor) for name, divisor in TIERS.items() if divisor > 1}
+        # One shared feed per distinct (region, output size)
+        self.roi_feeds = {}
+        # Changed tiles of the full view, for viewers that ask for `mode=tiles`
+        self.tile_feed = TileFeed()
+        self.named_rois = {}
+        self.snapshots = SnapshotCache()
+        # Called from the capture thread with every main-view JPEG, watched or not
+        self.recorders = []
+        self.mode_stats = {mode: ModeStats(mode) for mode in CAPTURE_MODES}
+        self.power_paths = glob.glob("/sys/class/power_supply/*/power_now")
+        self.thread = None
+        self.stopping = threading.Event()
+        self.wakeup = threading.Event()
+        # (changes, future) pairs the capture thread applies between frames
+        self.reconfigure_requests = queue.SimpleQueue()
+        self.reconfigurations = collections.deque(maxlen=10)
+        self.last_capture = None  # perf_counter time of the newest frame
+
+        # Resolve metric children once so the per-frame path only records samples
+        self.capture_timer = metrics.VIDEO_CAPTURE_SECONDS.labels()
+        self.convert_timer = metrics.VIDEO_CONVERT_SECONDS.labels()
+        self.frames_dropped = metrics.VIDEO_FRAMES_DROPPED.labels("video")
+        self.capture_fps = metrics.VIDEO_CAPTURE_FPS.labels()
+        self.reconfigure_gap = metrics.VIDEO_RECONFIGURE_GAP_SECONDS.labels()
+        metrics.CONNECTED_CLIENTS.labels("video").set_function(lambda: len(self.clients))
+        metrics.VIDEO_ROI_FEEDS.set_function(lambda: len(self.roi_feeds))
+        metrics.VIDEO_TIER_VIEWERS.labels("full").set_function(lambda: len(self.feed.subscribers))
+        for name, feed in self.tier_feeds.items():
+            metrics.VIDEO_TIER_VIEWERS.labels(name).set_function(lambda feed=feed: len(feed.subscribers))
+        metrics.VIDEO_BUFFER_FRAMES.set_function(lambda: len(self.frame_buffer))
+
+    def start(self):
+        """Open the frame source and start the capture thread. Blocks while the camera initialises."""
+        import cv2  # noqa: F401 - load OpenCV now rather than on the first client's first frame
+        self.source.start()
+        self.select_encoder(self.jpeg_encoder)
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, name="video-capture", daemon=True)
+        self.thread.start()
+
+    def trigger_activity(self, seconds=30):
+        """Capture at full rate for at least `seconds`, e.g. after a doorbell press."""
+        self.active_until = max(self.active_until, time.monotonic() + seconds)
+        self.wakeup.set()
+
+    def wanted_mode(self):
+        return "active" if self.clients or time.monotonic() < self.active_until else "idle"
+
+    def set_mode(self, mode):
+        fps = self.full_fps if mode == "active" else self.idle_fps
+        try:
+            self.source.set_frame_rate(fps)
+        except Exception as e:
+            logger.warning(f"Could not change the camera frame rate to {fps}: {e}")
+        self.capture_fps.set(fps)
+        logger.info(f"Video capture {self.mode or 'starting'} -> {mode} at {fps} fps")
+        self.mode = mode
+
+    def run(self):
+        next_due = time.monotonic()
+        last_wall = time.monotonic()
+        last_cpu = time.process_time()
+        power_watts = read_power_watts(self.power_paths)
+        power_read = last_wall
+        applied = []
+        while not self.stopping.is_set():
+            while not self.reconfigure_requests.empty():
+                result = self.apply_reconfiguration(*self.reconfigure_requests.get())
+                if result is not None:
+                    applied.append(result)
+            mode = self.wanted_mode()
+            if mode != self.mode or applied:
+                self.set_mode(mode)
+                next_due = time.monotonic()
+            interval = 1 / (self.full_fps if mode == "active" else self.idle_fps)
+
+            try:
+                self.capture_once()
+            except Exception as e:
+                logger.error(f"Video capture error: {e}")
+                self.stopping.wait(1)
+            else:
+                # The gap viewers saw is only known once the first reconfigured frame is in
+                for report, future in applied:
+                    self.finish_reconfiguration(report, future)
+                applied = []
+
+            now = time.monotonic()
+            cpu = time.process_time()
+            if self.power_paths and now - power_read >= 1:
+                power_watts = read_power_watts(self.power_paths)
+                power_read = now
+            self.mode_stats[mode].add(now - last_wall, cpu - last_cpu, power_watts)
+            last_wall, last_cpu = now, cpu
+
+            next_due += interval
+            if next_due < now:
+                # Count the frame slots capture fell behind on, then resync
+                missed = int((now - next_due) / interval)
+                if mode == "active" and missed:
+                    self.frames_dropped.inc(missed)
+                next_due = now
+            elif self.wakeup.wait(next_due - now):
+                # A viewer or trigger arrived; re-evaluate the mode right away
+                self.wakeup.clear()
+                next_due = time.monotonic()
+
+    def capture_once(self):
+        """Capture one frame into the pre-roll and encode and publish it for each watched feed."""
+        start = time.perf_counter()
+        frame = self.source.capture_array()
+        captured = time.perf_counter()
+        self.capture_timer.observe(captured - start)
+        self.last_capture = captured
+        captured_at = self.source.last_timestamp or time.time()
+        if TRACER.enabled:
+            TRACER.record("capture", start, captured)
+
+        roi_feeds = list(self.roi_feeds.values())
+        if roi_feeds:
+            crop_source = self.source.hires_frame if self.source.hires_frame is not None else frame
+            for feed in roi_feeds:
+                # One bad feed must not hold up the pre-roll and every other viewer
+                try:
+                    cropping = time.perf_counter()
+                    region = crop_frame(crop_source, feed.rect, feed.size)
+                    if TRACER.enabled:
+                        TRACER.record("crop", cropping, time.perf_counter())
+                    self.publish(feed, self.encode_jpeg(region, captured_at, time.perf_counter()), captured_at)
+                except Exception as e:
+                    self.feed_failed(feed, f"region {list(feed.rect)} at {feed.size[0]}x{feed.size[1]}", e)
+
+        tier_feeds = [feed for feed in self.tier_feeds.values() if feed.subscribers]
+        if tier_feeds:
+            import cv2
+
+            # The ISP's lores frame, when there is one, is already half size and cheaper to scale further
+            lores = self.source.lores_frame
+            for feed in tier_feeds:
+                try:
+                    scaling = time.perf_counter()
+                    size = feed.size(self.source.size)
+                    if lores is not None and lores.shape[1::-1] == size:
+                        image = lores.copy() if len(tier_feeds) > 1 else lores
+                    else:
+                        image = cv2.resize(lores if lores is not None else frame, size, interpolation=cv2.INTER_AREA)
+                    if TRACER.enabled:
+                        TRACER.record(f"scale {feed.name}", scaling, time.perf_counter())
+                    self.publish(feed, self.encode_jpeg(image, captured_at, time.perf_counter()), captured_at)
+                except Exception as e:
+                    self.feed_failed(feed, f"{feed.name} tier", e)
+
+        if self.tile_feed.subscribers:
+            message = self.tile_feed.encode(
+                frame, captured_at, lambda image: self.encode_jpeg(image, captured_at, time.perf_counter())
+            )
+            if message is not None:
+                self.tile_feed.publish(message, captured_at)
+
+        if not self.feed.subscribers and not self.recorders:
+            self.add_frame_to_buffer(captured_at, frame)
+            return
+        # Some encoders convert in place, so keep an unconverted copy for the pre-roll
+        self.add_frame_to_buffer(captured_at, frame.copy() if self.encoding[0].modifies_frame else frame)
+        jpeg = self.encode_jpeg(frame, captured_at, captured, yuv=self.source.yuv_frame)
+        self.publish(self.feed, jpeg, captured_at)
+        if jpeg is not None:
+            for record in self.recorders:
+                record(jpeg, captured_at)
 
-    async def handle_client(self, websocket):
+    def config(self):
+        width, height = self.source.size
+        return {
+            "width": width,
+            "height": height,
+            "fps": self.full_fps,
+            "idle_fps": self.idle_fps,
+            "quality": self.jpeg_quality,
+            "preroll_seconds": self.preroll_seconds,
+            "encoder": self.encoding[0].name if self.encoding[0] else self.jpeg_encoder,
+        }
+
+    def reconfigure(self, **changes):
+        """
+        Change any of `config()`'s settings while streaming. The capture
+        thread applies them between two frames, so viewers stay connected
+        and only see a pause. An `encoder` of "auto" reruns the encoder
+        benchmark. Returns a future resolving to the reconfiguration's
+        report once the first new frame is captured. Raises ValueError for
+        invalid settings.
+        """
+        unknown = changes.keys() - self.config().keys()
+        if unknown:
+            raise ValueError(f"Unknown video settings: {', '.join(sorted(unknown))}")
+        settings = {**self.config(), **{key: value for key, value in changes.items() if value is not None}}
+        if settings["width"] < 16 or settings["height"] < 16 or settings["width"] % 2 or settings["height"] % 2:
+            raise ValueError("Width and height must be even and at least 16")
+        if not 0 < settings["idle_fps"] <= settings["fps"]:
+            raise ValueError("Frame rates must be positive, with idle_fps no higher than fps")
+        if not 1 <= settings["quality"] <= 100:
+            raise ValueError("JPEG quality must be between 1 and 100")
+        if settings["preroll_seconds"] <= 0:
+            raise ValueError("The pre-roll must be positive")
+        if settings["encoder"] != "auto":
+            create_jpeg_encoder(settings["encoder"])
+        future = concurrent.futures.Future()
+        self.reconfigure_requests.put((settings, future))
+        self.wakeup.set()
+        return future
+
+    def apply_reconfiguration(self, settings, future):
+        """Apply new settings on the capture thread. Returns the report to finish, or None if it failed."""
+        previous = self.config()
+        began = time.perf_counter()
+        size = (settings["width"], settings["height"])
+        benchmarked = None
         try:
+            if settings["encoder"] == "auto" or settings["encoder"] != previous["encoder"]:
+                benchmarked = self.select_encoder(settings["encoder"])
+            if size != tuple(self.source.size):
+                try:
+                    self.source.resize(size)
+                except Exception:
+                    self.source.resize((previous["width"], previous["height"]))
+                    raise
+        except Exception as e:
+            logger.error(f"Video reconfiguration failed: {e}")
+            future.set_exception(e)
+            return None
+        self.full_fps = settings["fps"]
+        self.idle_fps = settings["idle_fps"]
+        self.jpeg_quality = settings["quality"]
+        self.preroll_seconds = settings["preroll_seconds"]
+        with self.buffer_lock:
+            # A shorter pre-roll takes effect now; a longer one fills up as frames arrive
+            while self.frame_buffer and self.frame_buffer[-1][0] - self.frame_buffer[0][0] > self.preroll_seconds:
+                self.frame_buffer.popleft()
+        # Frames already in the pre-roll keep their size; clips scale them to the newest frame's
+        current = self.config()
+        changed = {key: value for key, value in current.items() if value != previous[key]}
+        report = {
+            "time": time.time(),
+            "changed": {key: [previous[key], value] for key, value in changed.items()},
+            "apply_seconds": time.perf_counter() - began,
+            "last_frame_before": self.last_capture,
+        }
+        if benchmarked:
+            report["encoder_benchmark"] = benchmarked
+        logger.info(f"Video reconfigured: {changed or 'no changes'} in {report['apply_seconds'] * 1000:.1f} ms")
+        return report, future
+
+    def finish_reconfiguration(self, report, future):
+        last_frame_before = report.pop("last_frame_before")
+        # From the last frame at the old settings to the first at the new ones, as viewers saw it
+        gap = self.last_capture - last_frame_before if last_frame_before is not None else None
+        report["gap_seconds"] = gap
+        report["interval_seconds"] = 1 / (self.full_fps if self.mode == "active" else self.idle_fps)
+        if gap is not None:
+            self.reconfigure_gap.observe(gap)
+        self.reconfigurations.append(report)
+        future.set_result(report)
+
+    def select_encoder(self, name):
+        """
+        Switch JPEG encoder backend. "auto" times every available backend on
+        the newest frame, capturing one if there is none yet, switches to
+        the fastest and returns the timings. Blocks; call between captures.
+        """
+        results = None
+        if name == "auto":
+            with self.buffer_lock:
+                frame = self.frame_buffer[-1][1] if self.frame_buffer else None
+            if frame is None:
+                frame = self.source.capture_array()
+            results, encoder = benchmark(frame, self.jpeg_quality)
+            if encoder is None:
+                raise RuntimeError(f"No JPEG encoder is available: {results}")
+            height, width = frame.shape[:2]
+            self.encoder_benchmark = {"time": time.time(), "width": width, "height": height, "results": results}
+            for backend, result in results.items():
+                if "seconds" in result:
+                    metrics.VIDEO_ENCODER_BENCHMARK_SECONDS.labels(backend).set(result["seconds"])
+            timings = ", ".join(
+                f"{backend} {result['seconds'] * 1000:.2f} ms" for backend, result in results.items() if "seconds" in result
+            )
+            logger.info(f"JPEG encoder benchmark at {width}x{height}: {timings}; using {encoder.name}")
+        else:
+            encoder = create_jpeg_encoder(name)
+        previous = self.encoding[0]
+        if previous is not None:
+            metrics.VIDEO_JPEG_ENCODER.remove(previous.name)
+        metrics.VIDEO_JPEG_ENCODER.labels(encoder.name).set(1)
+        self.encoding = (encoder, metrics.VIDEO_ENCODE_SECONDS.labels(encoder.name))
+        return results
+
+    def publish(self, feed, jpeg, captured_at):
+        if jpeg is None:
+            self.frames_dropped.inc()
+        else:
+            feed.error = None
+            feed.publish(jpeg, captured_at)
+
+    def feed_failed(self, feed, description, error):
+        """Skip this frame for one derived feed, logging each distinct failure once."""
+        self.frames_dropped.inc()
+        if str(error) != feed.error:
+            logger.error(f"Video feed for the {description} failed: {error}")
+            feed.error = str(error)
+
+    def snapshot_key(self, width=None):
+        """Capture time of the newest frame and the width a snapshot of it would have (None for full size)."""
+        with self.buffer_lock:
+            if not self.frame_buffer:
+                return None, None
+            captured_at, frame = self.frame_buffer[-1]
+        return captured_at, width if width and width < frame.shape[1] else None
+
+    def snapshot(self, width=None):
+        """
+        The newest captured frame as `(capture time, JPEG, cached)`. Never
+        captures; reuses the live feed's JPEG when it is of the same frame
+        and otherwise encodes once per frame and width. Blocks on a miss.
+        """
+        with self.buffer_lock:
+            if not self.frame_buffer:
+                return None, None, False
+            captured_at, frame = self.frame_buffer[-1]
+        width = width if width and width < frame.shape[1] else None
+
+        def encode():
+            if width is None:
+                feed_captured_at, jpeg = self.feed.latest_capture
+                if feed_captured_at == captured_at:
+                    return jpeg
+                # Buffered frames are shared with clip jobs, so encode a copy
+                image = frame.copy()
+            else:
+                height, full_width = frame.shape[:2]
+                image = crop_frame(frame, FULL_VIEW, roi_output_size(FULL_VIEW, (full_width, height), width))
+            return self.encode_jpeg(image, captured_at, time.perf_counter())
+
+        jpeg, cached = self.snapshots.get(captured_at, width, encode)
+        return captured_at, jpeg, cached
+
+    def encode_jpeg(self, frame, captured_at, converting, yuv=None):
+        """
+        JPEG-encode a captured frame with the selected backend, which may
+        convert it in place. `yuv` is the same frame as the source captured
+        it, for backends that can encode that directly.
+        """
+        encoder, encode_timer = self.encoding
+        image = yuv if yuv is not None and encoder.accepts_yuv420 else encoder.prepare(frame)
+        converted = time.perf_counter()
+        jpeg = encoder.encode(image, self.jpeg_quality)
+        encoded = time.perf_counter()
+        self.convert_timer.observe(converted - converting)
+        encode_timer.observe(encoded - converted)
+        if TRACER.enabled:
+            TRACER.record("convert", converting, converted)
+            TRACER.record("encode", converted, encoded)
+        if jpeg is not None and self.stamp_frames:
+            # Browsers ignore comment segments, so stamped frames still display
+            return jpeg[:2] + FRAME_STAMP_PREFIX + struct.pack(">d", captured_at) + jpeg[2:]
+        return jpeg
+
+    def resolve_roi(self, roi, width=None):
+        """
+        Region and output size for a named or `x,y,width,height` region.
+        Raises ValueError for unknown names and malformed regions.
+        """
+        rect = self.named_rois.get(roi) or parse_rect(roi)
+        return rect, roi_output_size(rect, self.source.size, width)
+
+    def acquire_roi_feed(self, rect, size):
+        key = (rect, size)
+        feed = self.roi_feeds.get(key)
+        if feed is None:
+            feed = self.roi_feeds[key] = RoiFeed(rect, size)
+            self.source.request_hires(True)
+            logger.info(f"Started region feed {rect} at {size[0]}x{size[1]}")
+        return feed
+
+    def release_roi_feed(self, feed):
+        if feed.subscribers:
+            return
+        self.roi_feeds.pop((feed.rect, feed.size), None)
+        self.source.request_hires(bool(self.roi_feeds))
+        logger.info(f"Stopped region feed {feed.rect}")
+
+    async def handle_client(self, websocket, roi=None, width=None, tiles=False, stream="video", tier="full"):
+        """
+        Stream the full view, or with `roi` a named or `x,y,width,height`
+        region of it. `tier` picks a lower quality tier of the full view
+        (see TIERS). With `tiles` the full view is sent as tile updates
+        (see TileFeed) instead of whole JPEGs. `websocket` may be anything
+        with `accept`, `close` and `send_bytes`, e.g. a framed TCP
+        connection, with `stream` naming it in the metrics.
+        """
+        client_id = id(websocket)
+        counters = (
+            metrics.SEND_SECONDS.labels(stream),
+            metrics.BYTES_SENT.labels(stream),
+            metrics.CLIENT_BYTES_SENT.labels(stream, client_id),
+        )
+        subscriber = (asyncio.get_running_loop(), asyncio.Event())
+        feed = self.tile_feed if tiles else self.feed
+        try:
+            if tier not in TIERS:
+                await websocket.close(code=1008, reason=f"Unknown tier {tier!r}; expected one of {', '.join(TIERS)}")
+                return
+            if (roi or tiles) and tier != "full":
+                await websocket.close(code=1008, reason="Regions and tile mode are only available for the full tier")
+                return
+            if roi and tiles:
+                await websocket.close(code=1008, reason="Tile mode is only available for the full view")
+                return
+            if tier != "full":
+                feed = self.tier_feeds[tier]
+                self.source.request_lores(True)
+            if roi:
+                try:
+                    feed = self.acquire_roi_feed(*self.resolve_roi(roi, width))
+                except ValueError as e:
+                    await websocket.close(code=1008, reason=str(e))
+                    return
+            await websocket.accept()
             self.clients.add(websocket)
-            logger.info("New video client connected")
-            while True:
-                # Capture frame and convert to JPEG using cv2
-                frame = self.picam2.capture_array()
-                frame2 = frame.copy()
-                frame[:, :, [0, 2]] = frame[:, :, [2, 0]]
-                
-                
-                ret, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
-                if ret:
-                    await websocket.send(jpeg.tobytes())
-
-                asyncio.create_task(self.add_frame_to_buffer(frame2))
-                await asyncio.sleep(0.033)  # ~30fps
+            feed.subscribers.add(subscriber)
+            self.wakeup.set()
+            logger.info(
+                f"New video client connected{f' to region {roi}' if roi else ''}{' in tile mode' if tiles else ''}"
+                f"{f' at the {tier} tier' if tier != 'full' else ''}"
+            )
+            if tiles:
+                await self.stream_tiles(websocket, subscriber, counters)
+            else:
+                await self.stream_latest(websocket, feed, subscriber, counters)
         except Exception as e:
             logger.error(f"Video client error: {e}")
         finally:
-            self.clients.remove(websocket)
+            feed.subscribers.discard(subscriber)
+            if isinstance(feed, RoiFeed):
+                self.release_roi_feed(feed)
+            elif isinstance(feed, TierFeed):
+                self.source.request_lores(any(tier_feed.subscribers for tier_feed in self.tier_feeds.values()))
+            self.clients.discard(websocket)
+            metrics.CLIENT_BYTES_SENT.remove(stream, client_id)
             logger.info("Video client disconnected")
 
-    async def add_frame_to_buffer(self, frame):
-        """Asynchronously add frame to the frame buffer."""
-        self.frame_buffer.append(frame)
+    async def stream_latest(self, websocket, feed, subscriber, counters):
+        last_sequence = feed.latest[0]
+        while True:
+            await subscriber[1].wait()
+            subscriber[1].clear()
+            sequence, jpeg = feed.latest
+            # A client slower than the camera skips straight to the newest frame
+            if sequence - last_sequence > 1:
+                self.frames_dropped.inc(sequence - last_sequence - 1)
+            last_sequence = sequence
+            await self.send(websocket, jpeg, counters)
+
+    async def stream_tiles(self, websocket, subscriber, counters):
+        """
+        Send tile updates in order. Skipping one would leave stale tiles on
+        screen, so a viewer too slow to keep up skips to the next keyframe.
+        """
+        feed = self.tile_feed
+        entries = feed.since(None)
+        if not entries:
+            # Nobody has a keyframe to replay yet, so have the next frame be one
+            feed.request_refresh()
+        last_sequence = None
+        while True:
+            for sequence, message, keyframe in entries:
+                if last_sequence is not None and sequence - last_sequence > 1:
+                    self.frames_dropped.inc(sequence - last_sequence - 1)
+                last_sequence = sequence
+                await self.send(websocket, message, counters)
+            await subscriber[1].wait()
+            subscriber[1].clear()
+            entries = feed.since(last_sequence)
+
+    async def send(self, websocket, message, counters):
+        send_timer, bytes_sent, client_bytes_sent = counters
+        send_start = time.perf_counter()
+        await websocket.send_bytes(message)
+        send_end = time.perf_counter()
+        send_timer.observe(send_end - send_start)
+        if TRACER.enabled:
+            TRACER.record("send video", send_start, send_end)
+        bytes_sent.inc(len(message))
+        client_bytes_sent.inc(len(message))
+
+    def add_frame_to_buffer(self, timestamp, frame):
+        """Append a frame and drop those older than the pre-roll window."""
+        with self.buffer_lock:
+            self.frame_buffer.append((timestamp, frame))
+            while self.frame_buffer and timestamp - self.frame_buffer[0][0] > self.preroll_seconds:
+                self.frame_buffer.popleft()
+
+    def snapshot_frames(self):
+        """Reference copy of the pre-roll. Buffered frames are never mutated, so this is cheap."""
+        with self.buffer_lock:
+            return list(self.frame_buffer)
+
+    def status(self):
+        return {
+            "mode": self.mode,
+            "fps": self.full_fps if self.mode == "active" else self.idle_fps,
+            "viewers": len(self.clients),
+            "active_for": round(max(0.0, self.active_until - time.monotonic()), 1),
+            "preroll_frames": len(self.frame_buffer),
+            "named_regions": {name: list(rect) for name, rect in self.named_rois.items()},
+            "tiers": {
+                "full": {"width": self.source.size[0], "height": self.source.size[1],
+                         "viewers": len(self.feed.subscribers)},
+                **{name: feed.to_dict(self.source.size) for name, feed in self.tier_feeds.items()},
+            },
+            "region_feeds": [feed.to_dict() for feed in self.roi_feeds.values()],
+            "jpeg_encoder": {"name": self.config()["encoder"], "benchmark": self.encoder_benchmark},
+            "modes": {mode: stats.to_dict() for mode, stats in self.mode_stats.items()},
+        }
 
     async def save_last_4_seconds(self, output_path='last_4_seconds.mp4'):
         async with self.lock:
-            if not self.frame_buffer:
+            frames = self.snapshot_frames()
+            if not frames:
                 logger.warning("No frames available in the buffer to save.")
-                return
+                return None
 
             logger.info(f"Starting to save the last 4 seconds of video to {output_path}.")
             try:
-                with imageio.get_writer(output_path, fps=30, codec='libx264') as writer:
-                    for frame in list(self.frame_buffer):  # Convert deque to list to avoid issues during iteration
-                        writer.append_data(frame)
-
-                logger.info(f"Successfully saved video with {len(self.frame_buffer)} frames.")
+                # Encoding takes seconds; keep the shared event loop streaming meanwhile
+                return await asyncio.to_thread(self.write_clip, frames, output_path)
             except Exception as e:
                 logger.error(f"Error saving video: {e}")
+                return None
 
+    @staticmethod
+    def constant_rate(frames, fps):
+        """
+        Index of the frame to show at each tick of a constant `fps` clip, so
+        pre-roll captured at the idle rate plays back in real time.
+        """
+        start = frames[0][0]
+        ticks = int(round((frames[-1][0] - start) * fps)) + 1
+        indices = []
+        index = 0
+        for tick in range(ticks):
+            due = start + (tick + 0.5) / fps
+            while index + 1 < len(frames) and frames[index + 1][0] <= due:
+                index += 1
+            indices.append(index)
+        return indices
 
+    @staticmethod
+    def write_clip(frames, output_path, progress=None, fps=30):
+        """
+        Encode timestamped frames to a constant-rate MP4 and return its
+        metadata. The clip is written under a hidden temporary name and
+        renamed into place when complete.
+        """
+        import cv2
+        import imageio  # Deferred: only clip saving needs it
+
+        indices = VideoStreamHandler.constant_rate(frames, fps)
+        # Pre-roll from before a resolution change is scaled to the newest frame's size
+        height, width = frames[-1][1].shape[:2]
+        temp_path = temp_path_for(output_path)
+        try:
+            with imageio.get_writer(temp_path, fps=fps, codec='libx264') as writer:
+                for i, index in enumerate(indices):
+                    frame = frames[index][1]
+                    if frame.shape[:2] != (height, width):
+                        frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+                    writer.append_data(frame)
+                    if progress:
+                        # Closing the writer flushes the encoder, so count it as the last step
+                        progress((i + 1) / (len(indices) + 1))
+            os.replace(temp_path, output_path)
+            if progress:
+                progress(1.0)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
 
-    async def start_server(self):
-        async with serve(self.handle_client, "0.0.0.0", 5001):
-            logger.info("Video server started on ws://0.0.0.0:5001")
-            await asyncio.Future()
+        logger.info(f"Successfully saved video with {len(frames)} captured frames as {len(indices)} frames.")
+        return {
+            "frame_count": len(indices),
+            "duration": len(indices) / fps,
+            "width": width,
+            "height": height,
+        }
 
     def cleanup(self):
-        self.picam2.stop()
+        self.stopping.set()
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+        self.source.stop()
@@ -0,0 +1,70 @@
+import logging
+import os
+import time
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+
+class StreamSink:
+    """
+    Write-only file object that hands back whatever zipfile wrote to it.
+
+    It can tell() but not seek(), which makes zipfile write each entry's
+    sizes and CRC in a trailing data descriptor instead of seeking back.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def stream_zip(entries, chunk_size=1024 * 1024):
+    """
+    Yield a stored (uncompressed) ZIP archive of `entries`, an iterable of
+    `(path, arcname)` pairs, one chunk at a time. Memory use is bounded by
+    `chunk_size` no matter how many or how large the files are, and nothing
+    is written to disk.
+    """
+    sink = StreamSink()
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED) as archive:
+        for path, arcname in entries:
+            try:
+                source = open(path, "rb")
+            except FileNotFoundError:
+                logger.warning(f"Skipping {path} in ZIP export: file disappeared")
+                continue
+            with source:
+                stat = os.fstat(source.fileno())
+                if hasattr(os, "posix_fadvise"):
+                    os.posix_fadvise(source.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                info = zipfile.ZipInfo(arcname, date_time=time.localtime(stat.st_mtime)[:6])
+                info.compress_type = zipfile.ZIP_STORED
+                info.file_size = stat.st_size
+                with archive.open(info, mode="w") as entry:
+                    while True:
+                        data = source.read(chunk_size)
+                        if not data:
+                            break
+                        entry.write(data)
+                        yield sink.drain()
+            # Closing the entry wrote its data descriptor
+            yield sink.drain()
+    # Closing the archive wrote the central directory
+    yield sink.drain()
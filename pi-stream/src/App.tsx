@@ -92,33 +92,75 @@ const App = () => {
   const fetchRecordings = useCallback(async () => {
     try {
       console.log('Fetching recordings from backend...');
-      const response = await fetch(`http://${serverUrl}:5004/recordings`);
-      if (!response.ok) throw new Error('Failed to fetch recordings');
-
-
-      const data = await response.json();
-      console.log('Recordings fetched successfully:', data);
+      // The server pages results and sends an ETag, so unchanged pages are
+      // revalidated by the browser cache with a cheap 304
+      const fetched = [];
+      let cursor = null;
+      let generation = null;
+      do {
+        const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+        const response = await fetch(`http://${serverUrl}:5004/recordings${query}`);
+        if (!response.ok) throw new Error('Failed to fetch recordings');
+
+        const data = await response.json();
+        fetched.push(...data.recordings);
+        cursor = data.next_cursor;
+        // Changes made while paging are replayed by the event feed
+        generation ??= data.generation;
+      } while (cursor);
+
+      console.log('Recordings fetched successfully:', fetched);
       // Only update recordings if they have changed
-      if (JSON.stringify(data.recordings) !== JSON.stringify(recordings)) {
-        setRecordings(data.recordings);
-      }
+      setRecordings(prev => JSON.stringify(fetched) !== JSON.stringify(prev) ? fetched : prev);
+      return generation;
     } catch (error) {
       console.error('Error fetching recordings:', error);
+      return null;
     }
-  }, [serverUrl, recordings]);
+  }, [serverUrl]);
 
   useEffect(() => {
-    fetchRecordings(); // Fetch immediately on component mount
-    const intervalId = setInterval(fetchRecordings, 30000); // Poll every 30 seconds
+    let eventSource: EventSource | null = null;
+    let cancelled = false;
+
+    const subscribe = async () => {
+      // Fetch the full listing once, then apply pushed changes from there
+      const generation = await fetchRecordings();
+      if (cancelled) return;
+
+      const query = generation !== null ? `?last_event_id=${generation}` : '';
+      eventSource = new EventSource(`http://${serverUrl}:5005/recordings/events${query}`);
+
+      const upsert = (event: MessageEvent) => {
+        const { recording } = JSON.parse(event.data);
+        setRecordings(prev => [recording, ...prev.filter(r => r.filename !== recording.filename)]);
+      };
+      eventSource.addEventListener('add', upsert);
+      eventSource.addEventListener('update', upsert);
+      eventSource.addEventListener('delete', (event: MessageEvent) => {
+        const { filename } = JSON.parse(event.data);
+        setRecordings(prev => prev.filter(r => r.filename !== filename));
+      });
+      // Sent when we were disconnected for longer than the server keeps history
+      eventSource.addEventListener('reset', () => {
+        fetchRecordings();
+      });
+    };
 
-    return () => clearInterval(intervalId); // Cleanup on unmount
-  }, [fetchRecordings]);
+    subscribe();
+
+    return () => {
+      cancelled = true;
+      eventSource?.close();
+    };
+  }, [fetchRecordings, serverUrl]);
 
   const updateNotificationRecordings = useCallback(() => {
     setNotifications((prevNotifications) =>
       prevNotifications.map((notification) => {
+        // The server tags each saved clip with the event it was saved for
         const associatedRecording = recordings.find(
-          (recording) => recording.filename.includes(notification.id)
+          (recording) => recording.event_id === String(notification.id)
         );
         if (associatedRecording) {
           return {
@@ -153,6 +195,19 @@ const App = () => {
     setIsStreaming(!isStreaming);
   };
 
+  const recordEvent = async (notification, source: string) => {
+    try {
+      await axios.post(`http://${serverUrl}:5005/events`, {
+        id: String(notification.id),
+        source,
+        timestamp: notification.id / 1000,
+        labels: notification.labels ?? {},
+      });
+    } catch (error) {
+      console.error('Error recording event:', error);
+    }
+  };
+
   const handlePersonDetected = async (notification) => {
     // Get the current time
     const currentTime = Date.now();
@@ -177,6 +232,8 @@ const App = () => {
       return updated;
     });
 
+    await recordEvent(notification, 'detection');
+
     try {
       const response = await axios.post(`http://${serverUrl}:5005/save-video/${notification.id}`);
     } catch (error) {
@@ -227,6 +284,7 @@ const App = () => {
 
     // Start recording automatically
     handleRecordVideo('motion', newNotification.id);
+    recordEvent(newNotification, 'motion');
 
     // Update notifications
     setNotifications(prev => {
@@ -286,6 +344,8 @@ const App = () => {
       date: new Date().toLocaleDateString(),
     };
 
+    recordEvent(newNotification, 'doorbell');
+
     setNotifications(prev => {
       const updated = [newNotification, ...prev];
       localStorage.setItem('doorbell-notifications', JSON.stringify(updated));
@@ -18,6 +18,8 @@ interface VideoStreamProps {
   isStreaming: boolean;
   serverUrl: string;
   onPersonDetected: (notification: Notification) => void;
+  // Receive keyframes and changed tiles instead of whole frames; far less data for a static scene
+  tileMode?: boolean;
 }
 
 interface Notification {
@@ -26,11 +28,49 @@ interface Notification {
   time: string;
   message: string;
   date: string;
+  labels?: Record<string, number>;
 }
 
-export const VideoStream: React.FC<VideoStreamProps> = ({ isStreaming, serverUrl, onPersonDetected }) => {
+// Tile-mode header: "TILE", flags, capture time, frame width and height, tile size, tile count, atlas columns
+const TILE_HEADER_BYTES = 23;
+
+async function drawTileMessage(canvas: HTMLCanvasElement, data: ArrayBuffer) {
+  const header = new DataView(data);
+  const keyframe = (header.getUint8(4) & 1) === 1;
+  const width = header.getUint16(13, true);
+  const height = header.getUint16(15, true);
+  const tileSize = header.getUint16(17, true);
+  const count = header.getUint16(19, true);
+  const atlasColumns = header.getUint16(21, true);
+  const indicesEnd = TILE_HEADER_BYTES + count * 2;
+  const image = await createImageBitmap(new Blob([data.slice(indicesEnd)], { type: 'image/jpeg' }));
+  const canvasCtx = canvas.getContext('2d');
+  if (!canvasCtx) {
+    return;
+  }
+  if (keyframe) {
+    canvasCtx.drawImage(image, 0, 0, canvas.width, canvas.height);
+    return;
+  }
+  // Tiles sit in the atlas in the order of their indices, `atlasColumns` to a row
+  const scaleX = canvas.width / width;
+  const scaleY = canvas.height / height;
+  const columns = Math.ceil(width / tileSize);
+  for (let i = 0; i < count; i++) {
+    const index = header.getUint16(TILE_HEADER_BYTES + i * 2, true);
+    const sx = (i % atlasColumns) * tileSize;
+    const sy = Math.floor(i / atlasColumns) * tileSize;
+    const dx = (index % columns) * tileSize;
+    const dy = Math.floor(index / columns) * tileSize;
+    canvasCtx.drawImage(image, sx, sy, tileSize, tileSize, dx * scaleX, dy * scaleY, tileSize * scaleX, tileSize * scaleY);
+  }
+}
+
+export const VideoStream: React.FC<VideoStreamProps> = ({ isStreaming, serverUrl, onPersonDetected, tileMode = false }) => {
   const canvasRef = useRef<HTMLCanvasElement>(null);
   const wsRef = useRef<WebSocket | null>(null);
+  // Tile updates only make sense applied in order, so each waits for the previous one to be drawn
+  const drawQueueRef = useRef<Promise<void>>(Promise.resolve());
   const frameCounterRef = useRef(0);
   const lastClassificationTimeRef = useRef<number>(0);
   const [isModelLoaded, setIsModelLoaded] = useState(false);
@@ -61,7 +101,10 @@ export const VideoStream: React.FC<VideoStreamProps> = ({ isStreaming, serverUrl
   useEffect(() => {
     if (isStreaming && isModelLoaded) {
       console.log('Starting WebSocket connection...');
-      wsRef.current = new WebSocket(`ws://${serverUrl}:5001/video`);
+      wsRef.current = new WebSocket(`ws://${serverUrl}:5001/video${tileMode ? '?mode=tiles' : ''}`);
+      if (tileMode) {
+        wsRef.current.binaryType = 'arraybuffer';
+      }
 
       wsRef.current.onopen = () => {
         console.log('Video WebSocket connection established');
@@ -77,11 +120,17 @@ export const VideoStream: React.FC<VideoStreamProps> = ({ isStreaming, serverUrl
 
       wsRef.current.onmessage = async (event) => {
         try {
-          const blob = new Blob([event.data], { type: 'image/jpeg' });
-          const imageBitmap = await createImageBitmap(blob);
-          const canvasCtx = canvasRef.current!.getContext('2d');
-          if (canvasCtx) {
-            canvasCtx.drawImage(imageBitmap, 0, 0, canvasRef.current!.width, canvasRef.current!.height);
+          if (tileMode) {
+            const drawn = drawQueueRef.current.then(() => drawTileMessage(canvasRef.current!, event.data));
+            drawQueueRef.current = drawn.catch(() => undefined);
+            await drawn;
+          } else {
+            const blob = new Blob([event.data], { type: 'image/jpeg' });
+            const imageBitmap = await createImageBitmap(blob);
+            const canvasCtx = canvasRef.current!.getContext('2d');
+            if (canvasCtx) {
+              canvasCtx.drawImage(imageBitmap, 0, 0, canvasRef.current!.width, canvasRef.current!.height);
+            }
           }
 
           // Throttle classification by checking the timestamp
@@ -110,7 +159,7 @@ export const VideoStream: React.FC<VideoStreamProps> = ({ isStreaming, serverUrl
         wsRef.current = null;
       }
     };
-  }, [isStreaming, serverUrl, isModelLoaded]);
+  }, [isStreaming, serverUrl, isModelLoaded, tileMode]);
 
   const handleClassificationResult = (predictions) => {
     const personKeywords = [
@@ -120,17 +169,25 @@ export const VideoStream: React.FC<VideoStreamProps> = ({ isStreaming, serverUrl
       'shades', 'wig'
     ];
 
-    const personDetected = predictions.some(prediction =>
+    const personPredictions = predictions.filter(prediction =>
       personKeywords.some(keyword => prediction.className.toLowerCase().includes(keyword))
     );
 
-    if (personDetected) {
+    if (personPredictions.length > 0) {
+      // Every class the model reported, plus 'person' at the best matching score, for the event store
+      const labels: Record<string, number> = {
+        person: Math.max(...personPredictions.map(prediction => prediction.probability)),
+      };
+      for (const prediction of predictions) {
+        labels[prediction.className] = prediction.probability;
+      }
       const notification: Notification = {
         id: Date.now(),
         type: 'person-detected',
         time: new Date().toLocaleTimeString(),
         message: 'Person detected in video footage',
         date: new Date().toLocaleDateString(),
+        labels,
       };
       onPersonDetected(notification);
     }